@@ -8,10 +8,10 @@
 # Heavily inspired by https://github.com/joro75/Domoticz-Toyota-Plugin
 # Many thanks to John de Rooij!
 """
-<plugin key="Renault" name="Renault" author="HomeACcessoryKid" version="0.2.8"
+<plugin key="Renault" name="Renault" author="HomeACcessoryKid" version="0.5.3"
         externallink="https://github.com/HomeACcessoryKid/Domoticz-Renault-Plugin">
     <description>
-        <h2>Domoticz Renault Plugin 0.2.8</h2>
+        <h2>Domoticz Renault Plugin 0.5.3</h2>
         <ul style="list-style-type:none">
             <li>A Domoticz plugin that provides devices for a Renault car with connected services.</li>
             <li>It is using the same API that is used by the MyRenault connected service.</li>
@@ -27,17 +27,20 @@
             <li>Fuel level - Shows the current fuel level percentage</li>
             <li>Charge - Shows the charges made and the energy increase</li>
             <li>ChargingStatus - Shows plugState, chargingStatus and if Scheduled or Always charging</li>
-            <li>ChargeNowWhenAtHome - Toggle between Scheduled and Always charging, when at Home</li>
+            <li>ChargeNowWhenAtHome - Toggle between Scheduled and Always charging, when at Home or in a zone that charges Scheduled</li>
             <li>Distance to Home - How far away is your car from home in a straight line.</li>
+            <li>Zone - The zone of renault_zones.json or home that the car is parked in</li>
             <li>Airco/Heater - start Airco/Heater (stop does not work on Captur, must start car for that!)</li>
             <li>RefreshNow - Update all sensors</li>
+            <li>BackfillCharges - Import the charges of the past into the Charge counter</li>
         </ul>
         <h3>Configuration</h3>
         <ul style="list-style-type:square">
             <li>Username - The username that is also used to login in the MyRenault app.</li>
             <li>Password - The password that is also used to login in the MyRenault app.</li>
-            <li>Car -      The License plate or VIN if more than one car is available.</li>
+            <li>Car -      The License plate or VIN if more than one car is available, a comma separated list or * for several cars, at most 12.</li>
             <li>Locale -   The language and country that apply to your car</li>
+            <li>Options -  Optional tuning as key=value;key=value, see the README for the keys</li>
         </ul>
         <h4>Domoticz issue</h4>
         <ul style="list-style-type:none">
@@ -83,6 +86,7 @@
                 <option label="sv_SE" value="sv_SE"/>
             </options>
         </param>
+        <param field="Mode3" label="Options" width="400px" required="false" default=""/>
         <param field="Mode6" label="Debug" width="150px">
             <options>
                 <option label="None" value="0"  default="true" />
@@ -99,17 +103,32 @@
 </plugin>
 """
 
+from __future__ import annotations # the annotations name aiohttp and renault_api classes before they are imported
 import sys
+import os
+import json
+import gzip
+import hashlib
+import struct
+import importlib.util
 from abc import ABC, abstractmethod
 import asyncio
-import aiohttp
 import datetime
 from zoneinfo import ZoneInfo
-from typing import Any, Union, List, Tuple, Optional, Dict
-import math # for cosine of Latitude to do distance calculation to home
-from enum import Flag
+from typing import Any, Callable, Union, List, Tuple, Optional, Dict
+import math # for the distance calculations of the geofence zones
+import time
+import random
+import threading
+import queue
+import concurrent.futures
+from collections import deque
+from enum import Enum, Flag
 
 REFRESH_RATE: int = 10
+ENGAGE_TIMEOUT: int = 180 # seconds to wait for a blocking engage_vehicle
+PRIORITY_COMMAND: int = 0  # user commands are served before
+PRIORITY_POLL: int = 1     # background polls
 
 MINIMUM_PYTHON_VERSION = (3, 8)
 MINIMUM_MYRENAULT_VERSION: str = '0.2.0'
@@ -134,8 +153,12 @@ except (ModuleNotFoundError, ImportError):
 # except (ModuleNotFoundError, ImportError):
 #     _importErrors += ['The python setuptools library is not installed.']
 
-try:
-    import renault_api  # type: ignore
+# renault_api and aiohttp take half a second to import, load_libraries imports them on the worker thread
+aiohttp: Any = None
+renault_api: Any = None
+RENAULT_API_FOUND = importlib.util.find_spec('renault_api') is not None
+if not RENAULT_API_FOUND:
+    _importErrors += ['The Python renault_api library is not installed.']
 
 #     try:
 #         renault_api_version = Version(renault_api.__version__)
@@ -146,14 +169,30 @@ try:
 #     except AttributeError:
 #         _importErrors += ['The renault_api version is too old, an update is needed.']
 
-    if 'renault_api' in sys.modules:
+def load_libraries() -> None:
+    """Import renault_api and aiohttp into the module, the first call does the work."""
+    global aiohttp, renault_api, RenaultClient, CredentialStore, GIGYA_JWT, GIGYA_KEYS, GIGYA_LOGIN_TOKEN
+    if renault_api is None:
+        import aiohttp
+        import renault_api # type: ignore
         from renault_api.renault_client import RenaultClient
-#         import renault_api.kamereon.exceptions
-#         import renault_api.gigya.exceptions
-except (ModuleNotFoundError, ImportError):
-    _importErrors += ['The Python renault_api library is not installed.']
+        from renault_api.credential_store import CredentialStore
+        from renault_api.gigya import GIGYA_JWT, GIGYA_KEYS, GIGYA_LOGIN_TOKEN
 
 
+ENDPOINTS: Tuple[str, ...] = ('cockpit', 'charge_mode', 'battery_status', 'location', 'hvac_status', 'charges')
+
+def get_option(key: str, default: Any) -> Any:
+    """Return an option from the Options field (key=value;key=value), converted to the type of default."""
+    for item in Parameters['Mode3'].split(';'):
+        name, _, value = item.partition('=')
+        if name.strip().lower() == key:
+            try:
+                return type(default)(value.strip())
+            except ValueError:
+                Domoticz.Error(f'Option {key} has an invalid value: {value}')
+    return default
+
 UNIT_DISTANCE_INDEX:    int = 1
 UNIT_FUEL_INDEX:        int = 2
 UNIT_CHARGE_INDEX:      int = 3
@@ -162,6 +201,22 @@ UNIT_STATUS_INDEX:      int = 5
 UNIT_SEPARATION_INDEX:  int = 6
 UNIT_REFRESH_INDEX:     int = 7
 UNIT_AIRCO_INDEX:       int = 8
+UNIT_BACKFILL_INDEX:    int = 9
+UNIT_ZONE_INDEX:        int = 10
+UNIT_BLOCK:             int = 20 # every next car gets its devices 20 units further
+UNIT_METRIC_CYCLE:      int = 241 # the metric devices are for the plugin as a whole
+UNIT_METRIC_CALLS:      int = 242
+UNIT_METRIC_LOGINS:     int = 243
+UNIT_METRIC_QUOTA:      int = 244
+UNIT_BREAKER_INDEX:     int = 245 # the state of the circuit breaker, for the plugin as a whole
+MAX_CARS:               int = (UNIT_METRIC_CYCLE - 1) // UNIT_BLOCK # the blocks of cars below the plugin devices
+
+def car_file(name: str, car: int) -> str:
+    """Return the name of a state file of a car, the first car keeps the name as it was."""
+    if car == 0:
+        return name
+    stem, ext = os.path.splitext(name)
+    return f'{stem}_{car}{ext}'
 
 class Action(Flag):
     NO_ACTION        = 0
@@ -170,6 +225,7 @@ class Action(Flag):
     CHARGE           = CHARGE_ALWAYS | CHARGE_SCHEDULED
     AC_ON            = 4
     AC_OFF           = 8
+    BACKFILL         = 16 # handled by the plugin itself, not sent to the car
     
     def api_cmd(self):
         cmd={ self.CHARGE_ALWAYS:   "always_charging",
@@ -185,26 +241,1379 @@ class Action(Flag):
               self.AC_OFF:          "off"}
         return res[self]
 
+class PollScheduler():
+    """Choose the time of the next poll from the last known status of the vehicles."""
+
+    FOLLOW_UPS: Tuple[int, ...] = (60, 180) # seconds after a command to check on the car again
+    READS: Tuple[str, ...] = ('plug_status', 'charging_status')
+    READS_WHEN_KNOWN: Dict[str, Tuple[str, ...]] = {'location': ('latitude', 'longitude'), 'hvac_status': ('hvac_status',)}
+
+    def __init__(self) -> None:
+        super().__init__()
+        now = datetime.datetime.now()
+        self._interval = REFRESH_RATE * 60
+        self._next = now + datetime.timedelta(seconds=self._interval) # onStart already did a refresh
+        self._follow_ups: List[datetime.datetime] = []
+        self._positions: Dict[int, Tuple[float, float]] = {}
+        self._moved: Dict[int, datetime.datetime] = {}
+        self._day = now.date()
+        self._polls_today = 0
+
+    def due(self, now: datetime.datetime) -> bool:
+        """Check if a poll should be started now."""
+        if now.date() != self._day:
+            self._day = now.date()
+            self._polls_today = 0
+        return bool(self._follow_ups and self._follow_ups[0] <= now) or now >= self._next
+
+    def started(self, now: datetime.datetime) -> None:
+        """Count a poll that was started, a skipped one stays due."""
+        while self._follow_ups and self._follow_ups[0] <= now:
+            self._follow_ups.pop(0)
+        self._polls_today += 1
+        self._next = now + datetime.timedelta(seconds=self._interval) # until update() knows better
+
+    @classmethod
+    def reads(cls, vehicle_status) -> set:
+        """Return the snapshot fields the interval of a car depends on, location and hvac when the car has them."""
+        reads = set(cls.READS)
+        for name, fields in cls.READS_WHEN_KNOWN.items():
+            if vehicle_status is None or vehicle_status.has(name): # the first poll finds out
+                reads.update(fields)
+        return reads
+
+    def follow_up(self, now: datetime.datetime) -> None:
+        """Schedule some fast polls to see the effect of a command."""
+        self._follow_ups = [now + datetime.timedelta(seconds=delay) for delay in self.FOLLOW_UPS]
+
+    def _car_interval(self, car: int, vehicle_status, now: datetime.datetime, minimum: int) -> float:
+        """Return the poll interval that one car asks for."""
+        if vehicle_status.has('location'):
+            position = (round(vehicle_status.latitude, 4), round(vehicle_status.longitude, 4))
+            if position != self._positions.get(car):
+                self._positions[car] = position
+                self._moved[car] = now
+        moved = self._moved.get(car, now)
+        if vehicle_status.charging_status == 1.0 or vehicle_status.hvac_status == Action.AC_ON.api_res():
+            return minimum
+        if vehicle_status.plug_status or (now - moved).total_seconds() < 3600:
+            return REFRESH_RATE * 60
+        return max(self._interval, REFRESH_RATE * 60) * 2 # parked and unplugged, slow down step by step
+
+    def update(self, statuses: Dict[int, Any], now: datetime.datetime) -> None:
+        """Determine the next poll time from the plug, charge, hvac and location state of all cars."""
+        minimum = max(get_option('poll_min', 2), 1) * 60
+        maximum = max(get_option('poll_max', 60) * 60, minimum)
+        intervals = [self._car_interval(car, vehicle_status, now, minimum)
+                     for car, vehicle_status in statuses.items() if vehicle_status]
+        interval = min(intervals) if intervals else REFRESH_RATE * 60 # the busiest car decides
+        interval = min(max(interval, minimum), maximum)
+        self._interval = interval
+        budget = get_option('poll_budget', 200)
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+        left = (midnight - now).total_seconds()
+        remaining = budget - self._polls_today
+        if remaining <= 0:
+            self._next = midnight
+            Domoticz.Log(f'Daily poll budget of {budget} used, next poll after midnight')
+            return
+        if remaining <= left / maximum: # only the reserve for polling at maximum interval is left, spread it
+            interval = max(interval, left / remaining)
+        interval += random.uniform(-1, 1) * get_option('poll_jitter', 30)
+        self._next = now + datetime.timedelta(seconds=max(interval, 60))
+        Domoticz.Debug(f'Next poll at {self._next:%H:%M:%S}, {self._polls_today} polls today')
+
+
 class ReducedHeartBeat(ABC):
-    """Helper class that only calls the update of the devices just before a specific multiple of minutes"""
+    """Helper class that only calls the update of the devices when the poll scheduler says so"""
 
     def __init__(self) -> None:
         super().__init__()
-        self._last_update = datetime.datetime.now()
+        self._scheduler = PollScheduler()
 
     def onHeartbeat(self) -> None:
         """Callback from Domoticz that the plugin can perform some work."""
         now = datetime.datetime.now()
-        diff = now - self._last_update                   #prevent slip hit twice in 10s or skipping a beat
-        if now.minute%REFRESH_RATE == REFRESH_RATE-1 and now.second > 39 and now.second < 51 and diff.seconds > 13:
-            self._last_update = now
-            self.update_devices()
-            
+        if self._scheduler.due(now) and self.poll_devices():
+            self._scheduler.started(now)
 
     @abstractmethod
-    def update_devices(self, action: Action) -> None:
-        """Retrieve the status of the device and update the Domoticz devices."""
-        return
+    def poll_devices(self) -> bool:
+        """Start retrieving the status of the device, without waiting for the result, tell if it was started."""
+        return False
+
+class StateFile():
+    """A small JSON document in the plugin home folder that survives a restart of Domoticz."""
+
+    def __init__(self, name: str) -> None:
+        super().__init__()
+        self._name = name
+
+    def path(self) -> str:
+        """Return the location of the file."""
+        return os.path.join(Parameters['HomeFolder'], self._name)
+
+    def load(self) -> Dict[str, Any]:
+        """Return the stored document, or an empty one when there is none (yet)."""
+        try:
+            with open(self.path()) as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, data: Dict[str, Any]) -> None:
+        """Store the document, replacing the file in one go so a crash never leaves half of it."""
+        try:
+            with open(self.path() + '.tmp', 'w') as state_file:
+                json.dump(data, state_file)
+            os.replace(self.path() + '.tmp', self.path())
+        except OSError as ex:
+            Domoticz.Error(f'Could not save {self._name}: {ex}')
+
+
+class Metrics():
+    """Counters and latency histograms of the plugin, shown on the metric devices and written as a Prometheus textfile."""
+
+    BUCKETS: Tuple[float, ...] = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0) # seconds
+    HELP: Dict[str, str] = {'api_calls': 'renault_api calls made',
+                            'api_errors': 'renault_api calls that failed, by exception',
+                            'quota_errors': 'calls refused by the Renault quota',
+                            'logins': 'full Gigya logins',
+                            'retries': 'retries of a vehicle cycle',
+                            'cycles': 'vehicle cycles, by result',
+                            'commands': 'commands sent to a car, by outcome',
+                            'api_call_seconds': 'duration of a renault_api call',
+                            'cycle_seconds': 'duration of a vehicle cycle, login and commands included',
+                            'device_update_seconds': 'duration of the device update pass',
+                            'solar_changes': 'changes of the solar surplus decision',
+                            'breaker_trips': 'openings of the circuit breaker, by error class',
+                            'cache_lookups': 'endpoint lookups in the endpoint cache, by result'}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock() # the worker and the plugin thread both record
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {} # buckets, sum, count
+        self._day = datetime.date.today()
+        self._today: Dict[str, int] = {}
+        self.last_cycle = 0.0 # seconds
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add to a counter, also to its count of today."""
+        with self._lock:
+            key = (name, tuple(sorted(labels.items())))
+            self._counters[key] = self._counters.get(key, 0) + value
+            if datetime.date.today() != self._day:
+                self._day = datetime.date.today()
+                self._today = {}
+            self._today[name] = self._today.get(name, 0) + int(value)
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        """Add a duration to a histogram."""
+        with self._lock:
+            key = (name, tuple(sorted(labels.items())))
+            histogram = self._histograms.setdefault(key, [0.0] * (len(self.BUCKETS) + 2))
+            for index, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[index] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+            if name == 'cycle_seconds':
+                self.last_cycle = seconds
+
+    def total(self, name: str, **labels: str) -> float:
+        """Return a counter summed over the label values that are not given."""
+        with self._lock:
+            return sum(value for (metric, keys), value in self._counters.items()
+                       if metric == name and labels.items() <= dict(keys).items())
+
+    def today(self, name: str) -> int:
+        """Return the count of today of a counter, all labels together."""
+        with self._lock:
+            return self._today.get(name, 0) if datetime.date.today() == self._day else 0
+
+    @staticmethod
+    def _labels(labels: Tuple[Tuple[str, str], ...], extra: str = '') -> str:
+        parts = [f'{key}="{value}"' for key, value in labels] + ([extra] if extra else [])
+        return '{' + ','.join(parts) + '}' if parts else ''
+
+    def prometheus(self) -> str:
+        """Return the metrics in the Prometheus text format."""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted({key[0] for key in self._counters}):
+                lines += [f'# HELP renault_{name}_total {self.HELP.get(name, name)}',
+                          f'# TYPE renault_{name}_total counter']
+                lines += [f'renault_{name}_total{self._labels(labels)} {value:g}'
+                          for (metric, labels), value in sorted(self._counters.items()) if metric == name]
+            for name in sorted({key[0] for key in self._histograms}):
+                lines += [f'# HELP renault_{name} {self.HELP.get(name, name)}', f'# TYPE renault_{name} histogram']
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self.BUCKETS, histogram):
+                        le = 'le="%g"' % bound
+                        lines.append(f'renault_{name}_bucket{self._labels(labels, le)} {count:g}')
+                    le = 'le="+Inf"'
+                    lines += [f'renault_{name}_bucket{self._labels(labels, le)} {histogram[-1]:g}',
+                              f'renault_{name}_sum{self._labels(labels)} {histogram[-2]:.3f}',
+                              f'renault_{name}_count{self._labels(labels)} {histogram[-1]:g}']
+            lookups = {result: sum(value for (metric, labels), value in self._counters.items()
+                                   if metric == 'cache_lookups' and ('result', result) in labels)
+                       for result in ('hit', 'miss')}
+            if lookups['hit'] + lookups['miss']:
+                lines += ['# HELP renault_cache_hit_ratio share of the endpoint lookups served by the endpoint cache',
+                          '# TYPE renault_cache_hit_ratio gauge',
+                          f"renault_cache_hit_ratio {lookups['hit'] / (lookups['hit'] + lookups['miss']):.3f}"]
+            lines += ['# HELP renault_last_cycle_seconds duration of the last vehicle cycle',
+                      '# TYPE renault_last_cycle_seconds gauge', f'renault_last_cycle_seconds {self.last_cycle:.3f}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        """Write the Prometheus textfile, replaced in one go so the collector never reads half a file."""
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as prom_file:
+                prom_file.write(self.prometheus())
+            os.replace(path + '.tmp', path)
+        except OSError as ex:
+            Domoticz.Error(f'Could not write the metrics to {path}: {ex}')
+
+_metrics = Metrics()
+
+
+class Zone():
+    """A named circle around a location, with the charge mode to use when the car is plugged in there."""
+
+    EARTH_RADIUS = 6371.0088 # km, mean radius
+    KM_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+    NEAR = 20.0 # km, up to here the projection of the zone is as good as haversine
+
+    __slots__ = ('name', 'latitude', 'longitude', 'radius', 'charge', '_phi', '_cos', '_km_lon')
+
+    def __init__(self, name: str, latitude: float, longitude: float, radius: float,
+                 charge: Action = Action.CHARGE_ALWAYS) -> None:
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius = radius # km
+        self.charge = charge
+        self._phi = math.radians(latitude) # the projection constants are computed once per zone
+        self._cos = math.cos(self._phi)
+        self._km_lon = self.KM_PER_DEGREE * self._cos
+
+    def distance(self, latitude: float, longitude: float) -> float:
+        """Return the distance in km to the centre of the zone, flat near the zone and haversine further away."""
+        delta_lon = (longitude - self.longitude + 180) % 360 - 180
+        north = (latitude - self.latitude) * self.KM_PER_DEGREE
+        east = delta_lon * self._km_lon
+        if abs(north) + abs(east) < self.NEAR:
+            return math.hypot(north, east)
+        phi = math.radians(latitude)
+        half = (math.sin((phi - self._phi) / 2) ** 2
+                + self._cos * math.cos(phi) * math.sin(math.radians(delta_lon) / 2) ** 2)
+        return 2 * self.EARTH_RADIUS * math.asin(min(1.0, math.sqrt(half)))
+
+    def span(self) -> Tuple[float, float]:
+        """Return the degrees of latitude and longitude that the zone reaches from its centre."""
+        lat_span = self.radius / self.KM_PER_DEGREE
+        return lat_span, (360.0 if self._km_lon < 1e-6 else self.radius / self._km_lon)
+
+    def __repr__(self) -> str:
+        return f'Zone({self.name} {self.latitude:.5f},{self.longitude:.5f} r={self.radius}km {self.charge.name})'
+
+
+class Geofence():
+    """
+    The zones the cars can be parked in: home from the Domoticz location and the zones of renault_zones.json.
+    A grid of CELL degrees lists the zones that reach each cell, so a position is only checked against
+    the zones of its own cell however many zones there are.
+    """
+
+    CELL = 0.02 # degrees, about 2 km
+    MAX_CELLS = 2500 # a zone that would cover more cells is checked on every lookup instead
+    CHARGE = {'always': Action.CHARGE_ALWAYS, 'scheduled': Action.CHARGE_SCHEDULED}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.zones: List[Zone] = []
+        self.home: Optional[Zone] = None
+        self._grid: Dict[Tuple[int, int], List[Zone]] = {}
+        self._wide: List[Zone] = []
+        self._located: Dict[int, Optional[Zone]] = {} # car: the zone of its last known position
+
+    def load(self) -> None:
+        """Build the zones, loaded at the start as Settings and Parameters are not known at import."""
+        zones: Dict[str, Zone] = {}
+        if Settings['Location']:
+            latitude, longitude = (float(part) for part in Settings['Location'].split(';')[:2])
+            zones['home'] = Zone('home', latitude, longitude, get_option('home_radius', 0.05), Action.CHARGE_SCHEDULED)
+        stored = StateFile('renault_zones.json').load()
+        for entry in stored.get('zones', []) if isinstance(stored, dict) else stored:
+            try: # a zone named home replaces the Domoticz location
+                zone = Zone(str(entry['name']), float(entry['latitude']), float(entry['longitude']),
+                            float(entry.get('radius', 0.1)), self.CHARGE[entry.get('charge', 'always')])
+                zones[zone.name] = zone
+            except (KeyError, TypeError, ValueError) as ex:
+                Domoticz.Error(f'Zone {entry} in renault_zones.json is not valid: {ex!r}')
+        self.index(list(zones.values()))
+        Domoticz.Debug(f'Geofence: {self.zones}')
+
+    def index(self, zones: List[Zone]) -> None:
+        """Put the zones in the grid, in each cell their circle reaches."""
+        self.zones = zones
+        self.home = next((zone for zone in zones if zone.name == 'home'), None)
+        self._grid.clear()
+        self._wide.clear()
+        columns = round(360 / self.CELL)
+        for zone in zones:
+            lat_span, lon_span = zone.span()
+            row_low, col_low = self._cell(zone.latitude - lat_span, zone.longitude - lon_span)
+            row_high, col_high = self._cell(zone.latitude + lat_span, zone.longitude + lon_span)
+            width = (col_high - col_low) % columns + 1
+            if lon_span >= 180 or (row_high - row_low + 1) * width > self.MAX_CELLS:
+                self._wide.append(zone)
+                continue
+            for row in range(row_low, row_high + 1):
+                for offset in range(width):
+                    self._grid.setdefault((row, (col_low + offset) % columns), []).append(zone)
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        row = int(math.floor((min(max(latitude, -90.0), 90.0) + 90) / self.CELL))
+        column = int(math.floor(((longitude + 180) % 360) / self.CELL))
+        return row, column
+
+    def zones_at(self, latitude: float, longitude: float) -> List[Zone]:
+        """Return the zones that contain a position, the nearest centre first."""
+        candidates = self._grid.get(self._cell(latitude, longitude), []) + self._wide
+        distances = [(zone.distance(latitude, longitude), zone) for zone in candidates]
+        return [zone for distance, zone in sorted(distances, key=lambda pair: pair[0]) if distance <= zone.radius]
+
+    def locate(self, car: int, latitude: float, longitude: float) -> Optional[Zone]:
+        """Remember and return the zone a car is parked in, None when it is in none of them."""
+        zones = self.zones_at(latitude, longitude)
+        zone = zones[0] if zones else None
+        if car in self._located and self._located[car] is not zone:
+            Domoticz.Log(f'Car {car} is {"in zone " + zone.name if zone else "outside the zones"}')
+        self._located[car] = zone
+        return zone
+
+    def located(self, car: int) -> bool:
+        """Tell if the position of a car is known since the start."""
+        return car in self._located
+
+    def zone_of(self, car: int) -> Optional[Zone]:
+        return self._located.get(car)
+
+_geofence = Geofence()
+
+
+class TrackLog():
+    """
+    The positions of a car in a binary file of fixed size: a ring of recent samples and a ring of older
+    ones, where a sample that falls off the first ring is only kept once per track_coarse seconds.
+    Records are (time, latitude, longitude in micro degrees, direction in degrees or -1).
+    """
+
+    HEADER = struct.Struct('<4sH6I') # magic, version, then capacity, head and count of each ring
+    RECORD = struct.Struct('<Iiih')
+    MAGIC = b'RTRK'
+    MOVED = 0.02 # km, a car that moved less has not moved
+
+    def __init__(self, car: int = 0) -> None:
+        super().__init__()
+        self._state = StateFile(car_file('renault_track.bin', car))
+        self._data = bytearray()
+        self._rings: List[List[int]] = [] # [capacity, head, count] of the recent and the older samples
+        self._dirty: List[int] = [] # offsets of the records written since the last save
+
+    def path(self) -> str:
+        return self._state.path()
+
+    def _load(self) -> None:
+        """Read the file, a file of another size or version is rebuilt from its records."""
+        if self._rings:
+            return
+        capacity = get_option('track_records', 4096)
+        try:
+            with open(self.path(), 'rb') as track_file:
+                self._data = bytearray(track_file.read())
+            magic, version, *rings = self.HEADER.unpack_from(self._data)
+            self._rings = [rings[0:3], rings[3:6]]
+            if magic != self.MAGIC or version != 1 or \
+               len(self._data) != self.HEADER.size + self.RECORD.size * (rings[0] + rings[3]):
+                raise ValueError('not a track file')
+        except (OSError, ValueError, struct.error):
+            self._data, self._rings = bytearray(), []
+        if self._rings and self._rings[0][0] == capacity == self._rings[1][0]:
+            return
+        records = self._range(0, 2**32) if self._rings else []
+        self._rings = [[capacity, 0, 0], [capacity, 0, 0]]
+        self._data = bytearray(self.HEADER.size + self.RECORD.size * 2 * capacity)
+        for record in records:
+            self._append(record)
+        self._save(rebuild=True)
+
+    def _offset(self, ring: int, index: int) -> int:
+        """Return the byte offset of the index-th oldest record of a ring."""
+        capacity, head, count = self._rings[ring]
+        slot = (head - count + index) % capacity
+        return self.HEADER.size + self.RECORD.size * (ring * self._rings[0][0] + slot)
+
+    def _record(self, ring: int, index: int) -> Tuple[int, int, int, int]:
+        return self.RECORD.unpack_from(self._data, self._offset(ring, index))
+
+    def _push(self, ring: int, record: Tuple[int, int, int, int]) -> Optional[Tuple[int, int, int, int]]:
+        """Put a record at the head of a ring, return the record it replaced when the ring is full."""
+        capacity, head, count = self._rings[ring]
+        dropped = self._record(ring, 0) if count == capacity else None
+        self._rings[ring] = [capacity, (head + 1) % capacity, min(count + 1, capacity)]
+        offset = self._offset(ring, self._rings[ring][2] - 1)
+        self.RECORD.pack_into(self._data, offset, *record)
+        self._dirty.append(offset)
+        return dropped
+
+    def _append(self, record: Tuple[int, int, int, int]) -> None:
+        dropped = self._push(0, record)
+        if dropped and (self._rings[1][2] == 0 or
+                        dropped[0] >= self._record(1, self._rings[1][2] - 1)[0] + get_option('track_coarse', 3600)):
+            self._push(1, dropped)
+
+    def _save(self, rebuild: bool = False) -> None:
+        """Write the changed records and the header in place, or replace the whole file after a rebuild."""
+        self.HEADER.pack_into(self._data, 0, self.MAGIC, 1, *self._rings[0], *self._rings[1])
+        try:
+            if rebuild:
+                with open(self.path() + '.tmp', 'wb') as track_file:
+                    track_file.write(self._data)
+                os.replace(self.path() + '.tmp', self.path())
+            else:
+                with open(self.path(), 'r+b') as track_file:
+                    for offset in self._dirty: # records first, a crash before the header loses only this sample
+                        track_file.seek(offset)
+                        track_file.write(self._data[offset:offset + self.RECORD.size])
+                    track_file.seek(0)
+                    track_file.write(self._data[:self.HEADER.size])
+            self._dirty.clear()
+        except OSError as ex:
+            Domoticz.Error(f'Could not write the track log {self.path()}: {ex}')
+
+    def last(self) -> Optional[Tuple[float, float, float, int]]:
+        """Return the newest sample, None when there is none."""
+        self._load()
+        return self._decode(self._record(0, self._rings[0][2] - 1)) if self._rings[0][2] else None
+
+    @staticmethod
+    def _decode(record: Tuple[int, int, int, int]) -> Tuple[float, float, float, int]:
+        return (float(record[0]), record[1] / 1e6, record[2] / 1e6, record[3])
+
+    def add(self, stamp: float, latitude: float, longitude: float) -> bool:
+        """Keep a sample, unless it is not newer than the last one or the car has not moved since."""
+        if get_option('track_records', 4096) <= 0:
+            return False
+        self._load()
+        last = self.last()
+        direction = -1
+        if last:
+            if stamp <= last[0] or Zone('', last[1], last[2], 0).distance(latitude, longitude) < self.MOVED:
+                return False
+            phi, last_phi = math.radians(latitude), math.radians(last[1])
+            delta = math.radians(longitude - last[2])
+            direction = round(math.degrees(math.atan2(math.sin(delta) * math.cos(phi),
+                                                      math.cos(last_phi) * math.sin(phi) -
+                                                      math.sin(last_phi) * math.cos(phi) * math.cos(delta)))) % 360
+        self._append((int(stamp), round(latitude * 1e6), round(longitude * 1e6), direction))
+        self._save()
+        return True
+
+    def _first_at(self, ring: int, stamp: float) -> int:
+        """Return the index of the oldest record of a ring at or after stamp, by binary search."""
+        low, high = 0, self._rings[ring][2]
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(ring, middle)[0] < stamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _range(self, start: float, end: float) -> List[Tuple[int, int, int, int]]:
+        records = []
+        for ring in (1, 0): # every record of the older ring predates those of the recent ring
+            for index in range(self._first_at(ring, start), self._rings[ring][2]):
+                record = self._record(ring, index)
+                if record[0] > end:
+                    break
+                records.append(record)
+        return records
+
+    def query(self, start: float, end: float) -> List[Tuple[float, float, float, int]]:
+        """Return the samples from start to end (seconds since the epoch), oldest first."""
+        self._load()
+        return [self._decode(record) for record in self._range(start, end)]
+
+
+class SolarController():
+    """
+    Decide from a power or P1 meter in Domoticz if there is solar surplus to charge on: the readings are
+    averaged over solar_window seconds, and the decision only changes when the average stays past the
+    other threshold for solar_dwell seconds and fewer than solar_flips changes were made in the last hour.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.charging = False
+        self._samples: deque = deque() # (monotonic time, surplus in W)
+        self._since: Optional[float] = None # since when the average asks for the other decision
+        self._flips: deque = deque() # monotonic times of the changes of the last hour
+
+    @staticmethod
+    def enabled() -> bool:
+        return get_option('solar_idx', 0) > 0
+
+    async def read(self, session: aiohttp.ClientSession) -> float:
+        """Return the surplus in W that the meter device shows, through the JSON API of Domoticz."""
+        url = get_option('solar_url', 'http://127.0.0.1:8080').rstrip('/') + '/json.htm'
+        params = {'type': 'command', 'param': 'getdevices', 'rid': str(get_option('solar_idx', 0))}
+        async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            answer = await response.json(content_type=None)
+        return self.surplus_of(answer['result'][0])
+
+    @staticmethod
+    def surplus_of(device: Dict[str, Any]) -> float:
+        """Return the surplus of a meter: delivered minus used for P1, else the power times solar_sign."""
+        def watts(text: Any) -> float:
+            return float(str(text).split()[0]) # '1200 Watt'
+        if 'UsageDeliv' in device:
+            return watts(device['UsageDeliv']) - watts(device['Usage'])
+        return get_option('solar_sign', -1) * watts(device.get('Usage', device.get('Data')))
+
+    def average(self) -> Optional[float]:
+        return sum(watts for _, watts in self._samples) / len(self._samples) if self._samples else None
+
+    def add(self, now: float, surplus: float) -> bool:
+        """Take a reading, return True when the decision changed."""
+        self._samples.append((now, surplus))
+        while now - self._samples[0][0] > get_option('solar_window', 300):
+            self._samples.popleft()
+        average = self.average()
+        if self.charging:
+            wanted = average > get_option('solar_off', -1000) # the charging car itself lowers the surplus
+        else:
+            wanted = average >= get_option('solar_on', 1500)
+        if wanted == self.charging:
+            self._since = None
+            return False
+        if self._since is None:
+            self._since = now
+        while self._flips and now - self._flips[0] > 3600:
+            self._flips.popleft()
+        if now - self._since < get_option('solar_dwell', 600) or len(self._flips) >= get_option('solar_flips', 2):
+            return False
+        self.charging = wanted
+        self._since = None
+        self._flips.append(now)
+        _metrics.count('solar_changes')
+        Domoticz.Status(f'Solar surplus {average:.0f} W, {"charge now" if wanted else "back to the charge mode of the zone"}')
+        return True
+
+_solar = SolarController()
+
+
+def utc_stamp(text: Optional[str]) -> float:
+    """Return the seconds since the epoch of a Kamereon lastUpdateTime, now when it is missing or not readable."""
+    try:
+        stamp = datetime.datetime.fromisoformat(str(text).replace('Z', '+00:00'))
+    except ValueError:
+        return time.time()
+    return (stamp if stamp.tzinfo else stamp.replace(tzinfo=datetime.timezone.utc)).timestamp()
+
+
+def charge_records(charges: Optional[List[Dict[str, Any]]]) -> Tuple[Tuple[str, int], ...]:
+    """Return the (chargeStartDate, energy in Wh) of the charges in a get_charges response."""
+    records = []
+    for charge in charges or []:
+        energy = round((charge.get('chargeEnergyRecovered') or 0) * 1000)
+        if energy < 0: #Renault API is able to report a negative number !!!
+            energy = 1 #signal that something bad happened but not significant to disturb
+        records.append((charge['chargeStartDate'], energy))
+    return tuple(sorted(records))
+
+
+class VehicleSnapshot():
+    """The fields of one poll of a car that the devices use, without the renault_api responses behind them."""
+
+    FIELDS: Dict[str, Tuple[Tuple[str, str], ...]] = { # endpoint: ((response attribute, slot), ...)
+        'cockpit':        (('totalMileage', 'mileage'), ('fuelQuantity', 'fuel')),
+        'charge_mode':    (('chargeMode', 'charge_mode'),),
+        'battery_status': (('timestamp', 'battery_time'), ('batteryLevel', 'battery_level'),
+                           ('plugStatus', 'plug_status'), ('chargingStatus', 'charging_status')),
+        'location':       (('lastUpdateTime', 'gps_time'), ('gpsLatitude', 'latitude'),
+                           ('gpsLongitude', 'longitude')),
+        'hvac_status':    (('lastUpdateTime', 'hvac_time'), ('hvacStatus', 'hvac_status')),
+        'charges':        (('charges', 'charges'),)} # charge_records of today
+    STAMPS: Dict[str, str] = {'battery_status': 'battery_time', 'location': 'gps_time', 'hvac_status': 'hvac_time'}
+    DATA = tuple(slot for fields in FIELDS.values() for _, slot in fields)
+    __slots__ = DATA + ('endpoints', 'changed')
+
+    def __init__(self, values: Dict[str, Optional[Tuple[Any, ...]]]) -> None:
+        """values holds the extract of each endpoint, None for an endpoint that never came through."""
+        self.endpoints = frozenset(name for name in self.FIELDS if values.get(name) is not None)
+        self.changed: frozenset = frozenset() # the fields that differ from the previous snapshot
+        for name, fields in self.FIELDS.items():
+            extract = values.get(name) or (None,) * len(fields)
+            for (_, slot), value in zip(fields, extract):
+                setattr(self, slot, value)
+
+    @classmethod
+    def extract(cls, name: str, result: Any) -> Tuple[Any, ...]:
+        """Return the values of an endpoint response that a snapshot keeps, in FIELDS order."""
+        if name == 'charges':
+            return (charge_records(result.raw_data.get('charges')),)
+        return tuple(getattr(result, attribute, None) for attribute, _ in cls.FIELDS[name])
+
+    @classmethod
+    def endpoints_for(cls, fields) -> frozenset:
+        """Return the endpoints that have to be fetched to know the given fields."""
+        return frozenset(name for name, extracts in cls.FIELDS.items()
+                         if any(slot in fields for _, slot in extracts))
+
+    def extracts(self) -> Dict[str, Tuple[Any, ...]]:
+        """Return the extract of each endpoint that came through, what the snapshot is made from."""
+        return {name: tuple(getattr(self, slot) for _, slot in fields)
+                for name, fields in self.FIELDS.items() if name in self.endpoints}
+
+    @classmethod
+    def from_json(cls, stored: Dict[str, List[Any]]) -> 'VehicleSnapshot':
+        """Return the snapshot of extracts that were saved as JSON, which turned the tuples into lists."""
+        values: Dict[str, Optional[Tuple[Any, ...]]] = {name: tuple(stored[name]) for name in cls.FIELDS if name in stored}
+        if values.get('charges'):
+            values['charges'] = (tuple(tuple(record) for record in values['charges'][0] or ()),)
+        return cls(values)
+
+    def has(self, name: str) -> bool:
+        """Tell if the endpoint came through at least once."""
+        return name in self.endpoints
+
+    def values(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, slot) for slot in self.DATA)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, VehicleSnapshot):
+            return NotImplemented
+        return self.values() == other.values()
+
+    __hash__ = None # type: ignore
+
+    def diff(self, other: Optional['VehicleSnapshot']) -> frozenset:
+        """
+        Return the fields that differ from another snapshot, all known fields when there is none. An endpoint
+        whose server timestamp did not move has nothing new from the car, its fields count as unchanged.
+        """
+        if other is None:
+            return frozenset(slot for slot in self.DATA if getattr(self, slot) is not None)
+        same = {slot for name, stamp in self.STAMPS.items()
+                if getattr(self, stamp) is not None and getattr(self, stamp) == getattr(other, stamp)
+                for _, slot in self.FIELDS[name]}
+        return frozenset(slot for slot, mine, theirs in zip(self.DATA, self.values(), other.values())
+                         if mine != theirs and slot not in same)
+
+    def __repr__(self) -> str:
+        fields = ' '.join(f'{slot}={getattr(self, slot)}' for slot in self.DATA if slot != 'charges')
+        return f'VehicleSnapshot({fields} charges={len(self.charges or ())})'
+
+
+class EndpointCache():
+    """Keep the last result of each endpoint for its own time to live and tell if the car reported anything new."""
+
+    TTL: Dict[str, int] = {'cockpit': 1800, 'charge_mode': 600, 'battery_status': 300,
+                           'location': 300, 'hvac_status': 300, 'charges': 900}
+    TTL_ACTIVE: Dict[str, int] = {'battery_status': 60, 'hvac_status': 60, 'charges': 300} # charging or hvac on
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._entries: Dict[str, Tuple[Tuple[Any, ...], float]] = {} # name: (extract, monotonic time of the fetch)
+        self._day = datetime.date.today()
+        self.hits = 0
+        self.misses = 0
+
+    def _active(self) -> bool:
+        snapshot = self.snapshot()
+        return snapshot.charging_status == 1.0 or snapshot.hvac_status == Action.AC_ON.api_res()
+
+    def ttl(self, name: str) -> int:
+        """Return the time to live of an endpoint, shorter while charging or when the hvac is on."""
+        ttl = self.TTL_ACTIVE.get(name, self.TTL[name]) if self._active() else self.TTL[name]
+        return get_option('ttl_' + name, ttl)
+
+    def snapshot(self) -> VehicleSnapshot:
+        """Return the last known values of all endpoints, how old they may be."""
+        return VehicleSnapshot({name: entry[0] for name, entry in self._entries.items()})
+
+    def stale(self, names=ENDPOINTS) -> List[str]:
+        """Return which of the names need a fetch and count the hits and misses."""
+        if datetime.date.today() != self._day: # the charges are those of today
+            self._day = datetime.date.today()
+            self.invalidate('charges')
+        now = time.monotonic()
+        stale = [name for name in ENDPOINTS if name in names and
+                 (name not in self._entries or now - self._entries[name][1] > self.ttl(name))]
+        self.misses += len(stale)
+        self.hits += len(names) - len(stale)
+        if stale:
+            _metrics.count('cache_lookups', len(stale), result='miss')
+        if len(names) > len(stale):
+            _metrics.count('cache_lookups', len(names) - len(stale), result='hit')
+        return stale
+
+    def store(self, name: str, result: Any) -> None:
+        """Remember the values of a fresh result, the response itself is let go."""
+        self._entries[name] = (VehicleSnapshot.extract(name, result), time.monotonic())
+
+    def invalidate(self, name: str) -> None:
+        """Make sure an endpoint is fetched next time, e.g. after a command changed it."""
+        self._entries.pop(name, None)
+
+    def hit_ratio(self) -> float:
+        """Return the part of the endpoint reads that came from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class Outcome(Enum):
+    PENDING   = 0 # sent, the car did not confirm yet
+    CONFIRMED = 1 # the status endpoint shows the requested state
+    TIMED_OUT = 2 # the deadline passed before the car showed it
+    REJECTED  = 3 # the command could not be sent or was refused
+
+
+class ActionConfirmation():
+    """
+    Follow one command from sending until the car confirms it: sent once, then only its status
+    endpoint is polled, with exponential backoff up to a deadline.
+    """
+
+    ENDPOINTS: Dict[Action, str] = {Action.CHARGE_ALWAYS: 'charge_mode', Action.CHARGE_SCHEDULED: 'charge_mode',
+                                    Action.AC_ON: 'hvac_status', Action.AC_OFF: 'hvac_status'} # first one wins
+    FIELDS: Dict[str, str] = {'charge_mode': 'chargeMode', 'hvac_status': 'hvacStatus'}
+
+    def __init__(self, car: int, action: Action, now: float) -> None:
+        super().__init__()
+        self.car = car
+        self.action = action
+        self.endpoint = self.ENDPOINTS[action]
+        self.outcome = Outcome.PENDING
+        self.polls = 0
+        self.sent = now
+        self._deadline = now + get_option('confirm_timeout', 120)
+        self._delay = float(get_option('confirm_delay', 2))
+        self._max_delay = 30.0
+
+    @classmethod
+    def parts(cls, action: Action) -> List[Action]:
+        """Split an action into the commands to send, one per status endpoint."""
+        parts: Dict[str, Action] = {}
+        for part in cls.ENDPOINTS:
+            if part in action:
+                parts.setdefault(cls.ENDPOINTS[part], part)
+        return list(parts.values())
+
+    def command(self, vehicle) -> Tuple[Any, ...]:
+        """Return the renault_api method and arguments that send the command."""
+        if self.action in Action.CHARGE:
+            return (vehicle.set_charge_mode, self.action.api_cmd())
+        if self.action == Action.AC_ON:
+            return (vehicle.set_ac_start, 20.0) # TODO: make temperature a parameter
+        return (vehicle.set_ac_stop,)
+
+    def status(self, vehicle) -> Any:
+        """Return the renault_api method that reads the status the command changes."""
+        return getattr(vehicle, 'get_' + self.endpoint)
+
+    def next_delay(self, now: float) -> Optional[float]:
+        """Return how long to wait for the next poll, None when the deadline has passed."""
+        if now >= self._deadline:
+            self.outcome = Outcome.TIMED_OUT
+            return None
+        delay = min(self._delay, self._deadline - now)
+        self._delay = min(self._delay * 2, self._max_delay)
+        return delay
+
+    def check(self, result: Any) -> bool:
+        """Check a status read, the confirmation is done when it shows the requested state."""
+        self.polls += 1
+        if getattr(result, self.FIELDS[self.endpoint], None) == self.action.api_res():
+            self.outcome = Outcome.CONFIRMED
+        return self.outcome == Outcome.CONFIRMED
+
+
+class CommandDebouncer():
+    """
+    Hold the switch commands of a car for a short window: per status endpoint only the last intended
+    state is kept, presses that cancel each other are dropped and refresh presses collapse into one.
+    """
+
+    OPPOSITE: Dict[Action, Action] = {Action.CHARGE_ALWAYS: Action.CHARGE_SCHEDULED,
+                                      Action.CHARGE_SCHEDULED: Action.CHARGE_ALWAYS,
+                                      Action.AC_ON: Action.AC_OFF, Action.AC_OFF: Action.AC_ON}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._cars: Dict[int, Dict[str, Any]] = {} # car: {'due', 'unit', 'refresh', 'states', 'units'}
+
+    def add(self, car: int, unit: int, action: Action, now: float) -> None:
+        """Take a command of a device, the window of the car starts again."""
+        held = self._cars.setdefault(car, {'refresh': False, 'states': {}, 'units': {}})
+        held['due'] = now + get_option('debounce', 2.0)
+        held['unit'] = unit
+        if not ActionConfirmation.parts(action):
+            held['refresh'] = True
+        for part in ActionConfirmation.parts(action):
+            endpoint = ActionConfirmation.ENDPOINTS[part]
+            if held['states'].get(endpoint) == self.OPPOSITE[part]:
+                held['states'][endpoint] = None # back to where it was, nothing to send
+                Domoticz.Debug(f'Command {part.name} cancels {self.OPPOSITE[part].name}')
+            else:
+                held['states'][endpoint] = part
+                held['units'][part] = unit
+
+    def pending(self, car: Optional[int] = None) -> bool:
+        """Tell if commands are held, for one car or any car."""
+        return bool(self._cars) if car is None else car in self._cars
+
+    def release(self, now: float) -> List[Tuple[int, int, Action, Dict[Action, int]]]:
+        """Return (car, unit, action, unit per command) of each car whose window has passed."""
+        released = []
+        for car, held in list(self._cars.items()):
+            if now < held['due']:
+                continue
+            del self._cars[car]
+            action = Action.NO_ACTION
+            for part in held['states'].values():
+                if part is not None:
+                    action |= part
+            if action or held['refresh']:
+                released.append((car, held['unit'], action, {part: held['units'][part]
+                                                             for part in ActionConfirmation.parts(action)}))
+            else:
+                Domoticz.Status('Commands cancelled each other, nothing to send')
+        return released
+
+    def clear(self) -> None:
+        self._cars.clear()
+
+
+class RequestLimitException(Exception):
+    """A renault_api call was refused by the RequestLimiter."""
+
+
+class RequestLimiter():
+    """Token bucket around every renault_api call, kept on disk so a restart does not forget an overload."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._state = StateFile('renault_limiter.json')
+        self._tokens: Optional[float] = None # loaded on first use, Parameters are not known at import
+        self._stamp = time.time()
+        self._backoff = 0.0       # seconds of the last quota backoff, doubles on each quota error
+        self._backoff_until = 0.0
+
+    def _load(self) -> None:
+        if self._tokens is None:
+            state = self._state.load()
+            self._tokens = float(state.get('tokens', get_option('api_burst', 30)))
+            self._stamp = float(state.get('stamp', time.time()))
+            self._backoff = float(state.get('backoff', 0))
+            self._backoff_until = float(state.get('backoff_until', 0))
+            if self._backoff_until > time.time():
+                Domoticz.Error(f'Quota backoff until {datetime.datetime.fromtimestamp(self._backoff_until):%H:%M:%S}')
+
+    def save(self) -> None:
+        """Store the state of the bucket in the plugin home folder."""
+        if self._tokens is not None:
+            self._state.save({'tokens': self._tokens, 'stamp': self._stamp,
+                              'backoff': self._backoff, 'backoff_until': self._backoff_until})
+
+    def _refill(self) -> None:
+        self._load()
+        now = time.time()
+        rate = get_option('api_rate', 120) / 3600 # tokens per second
+        self._tokens = min(self._tokens + max(now - self._stamp, 0) * rate, get_option('api_burst', 30))
+        self._stamp = now
+
+    def available(self, priority: int, count: int = 1) -> bool:
+        """Check if count calls can be made now, polls leave a reserve for commands."""
+        self._refill()
+        if time.time() < self._backoff_until:
+            return False
+        reserve = get_option('api_reserve', 4) if priority == PRIORITY_POLL else 0
+        return self._tokens >= count + reserve
+
+    async def acquire(self, priority: int) -> None:
+        """Take a token for one call, commands may wait a little, polls are refused right away."""
+        deadline = time.time() + (30 if priority == PRIORITY_COMMAND else 0)
+        while not self.available(priority):
+            if time.time() >= deadline or time.time() < self._backoff_until:
+                raise RequestLimitException('Request limit reached, call refused')
+            await asyncio.sleep(1)
+        self._tokens -= 1
+
+    def quota_error(self) -> None:
+        """Back off exponentially after the servers reported an overload."""
+        self._load()
+        self._backoff = min(max(self._backoff * 2, 300), 6 * 3600)
+        self._backoff_until = time.time() + self._backoff
+        self._tokens = 0
+        self.save()
+        Domoticz.Error(f'Quota backoff for {self._backoff/60:.0f} minutes')
+
+    def success(self) -> None:
+        """Forget the backoff history once the servers answer again."""
+        self._backoff = 0
+
+
+class CircuitOpenException(RequestLimitException):
+    """A renault_api call was refused because the CircuitBreaker is open."""
+
+
+class BreakerState(Enum):
+    CLOSED    = 'closed'
+    OPEN      = 'open'
+    HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker():
+    """
+    Stop calling the Renault servers while they are down. Failures in a row of one error class open the breaker:
+    connection errors and failed forwards after breaker_failures, quota errors and a failed login at once. An
+    expired token is no outage: the cycle invalidates it and logs in again, only that login counts. While open the
+    cycles fail fast with the cached data. After breaker_open seconds it is half-open: a single probe call goes
+    out, an answer closes the breaker, another failure opens it twice as long, up to an hour.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.state = BreakerState.CLOSED
+        self.reason = ''
+        self._failures: Dict[str, int] = {}
+        self._open_for = 0.0
+        self._open_until = 0.0
+        self._probe: Optional[asyncio.Future] = None # done when the probe call has ended
+
+    @staticmethod
+    def trips(ex: BaseException) -> Optional[str]:
+        """Return the error class of a failure that says the servers are down, None for any other failure."""
+        status = getattr(ex, 'status', None)
+        if isinstance(ex, renault_api.kamereon.exceptions.QuotaLimitException) or status == 429:
+            return 'quota'
+        if isinstance(ex, renault_api.kamereon.exceptions.FailedForwardException) or status in (502, 503, 504):
+            return 'forward'
+        if isinstance(ex, (aiohttp.client_exceptions.ClientConnectionError, asyncio.TimeoutError)):
+            return 'connection'
+        return None
+
+    def is_open(self) -> bool:
+        """Tell if calls are refused now, a breaker that waits for its probe is not."""
+        return self.state == BreakerState.OPEN and time.time() < self._open_until
+
+    async def admit(self) -> bool:
+        """Wait until a call may go out and tell if it is the probe, raise CircuitOpenException while open."""
+        while self.state != BreakerState.CLOSED:
+            if self.is_open():
+                raise CircuitOpenException(f'Renault servers unavailable ({self.reason}), '
+                                           f'next try at {datetime.datetime.fromtimestamp(self._open_until):%H:%M:%S}')
+            if self.state == BreakerState.OPEN:
+                self.state = BreakerState.HALF_OPEN
+                Domoticz.Log('Circuit breaker half-open, sending one probe request')
+            if self._probe is None:
+                self._probe = asyncio.get_running_loop().create_future()
+                return True
+            await asyncio.shield(self._probe)
+        return False
+
+    def success(self) -> None:
+        """Close the breaker after an answer of the servers, a late answer does not close an open breaker."""
+        if self.state == BreakerState.OPEN:
+            return
+        if self.state == BreakerState.HALF_OPEN:
+            Domoticz.Status('Circuit breaker closed, the Renault servers answer again')
+        self.state = BreakerState.CLOSED
+        self.reason = ''
+        self._failures = {}
+        self._open_for = 0.0
+        self.settle()
+
+    def failure(self, ex: BaseException, login: bool = False) -> None:
+        """Count a failed call, open the breaker when its error class has failed often enough."""
+        if login and isinstance(ex, renault_api.gigya.exceptions.GigyaException):
+            key: Optional[str] = 'login' # the credentials or Gigya itself, a new token will not help
+        else:
+            key = self.trips(ex)
+        if key is None:
+            if self.state == BreakerState.HALF_OPEN and \
+               isinstance(ex, (renault_api.exceptions.RenaultException, aiohttp.client_exceptions.ClientResponseError)):
+                self.success() # an error answer of the servers is still an answer
+            return
+        if self.state == BreakerState.OPEN:
+            return
+        self._failures[key] = self._failures.get(key, 0) + 1
+        threshold = 1 if key in ('quota', 'login') else max(get_option('breaker_failures', 3), 1)
+        if self.state == BreakerState.HALF_OPEN or self._failures[key] >= threshold:
+            self._open(key)
+
+    def _open(self, key: str) -> None:
+        base = max(get_option('breaker_open', 300), 1)
+        self._open_for = min(self._open_for * 2, max(base, 3600)) if self._open_for else base
+        self._open_until = time.time() + self._open_for
+        self.state = BreakerState.OPEN
+        self.reason = key
+        self._failures = {}
+        _metrics.count('breaker_trips', reason=key)
+        Domoticz.Error(f'Circuit breaker open for {self._open_for:.0f} seconds after {key} errors')
+        self.settle()
+
+    def settle(self) -> None:
+        """End the probe and wake the calls that wait for it, after a probe without answer the next one probes."""
+        if self._probe is not None:
+            if not self._probe.done():
+                self._probe.set_result(None)
+            self._probe = None
+
+    def describe(self) -> str:
+        """Return the state for the breaker device."""
+        if self.state == BreakerState.OPEN:
+            return f'open until {datetime.datetime.fromtimestamp(self._open_until):%H:%M} ({self.reason})'
+        return self.state.value
+
+_breaker = CircuitBreaker()
+
+
+class BackgroundLoop():
+    """Run one long-lived asyncio event loop with a keep-alive aiohttp session in a worker thread."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._websession: Optional[aiohttp.ClientSession] = None
+
+    def start(self) -> None:
+        """Start the worker thread with its event loop, if not yet running."""
+        if self._thread is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(name='RenaultLoop', target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        try:
+            load_libraries() # before any coroutine of the loop runs
+        except ImportError as ex:
+            Domoticz.Error(f'The Python renault_api library could not be loaded: {ex}')
+        self._loop.run_forever()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedule a coroutine on the worker loop and return a future for its result."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the worker loop and wait for its result."""
+        return self.submit(coro).result(timeout)
+
+    async def websession(self) -> aiohttp.ClientSession:
+        """Return the shared session, connections, DNS lookups and TLS sessions are reused. Call from the loop."""
+        if self._websession is None or self._websession.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=get_option('connections', 4),
+                                             ttl_dns_cache=3600, keepalive_timeout=300)
+            self._websession = aiohttp.ClientSession(connector=connector)
+        return self._websession
+
+    def stop(self) -> None:
+        """Close the session and stop the worker thread, Domoticz does not like threads surviving onStop."""
+        if self._thread is None:
+            return
+        if self._websession is not None and not self._websession.closed:
+            try:
+                self.run(self._websession.close(), 10)
+            except concurrent.futures.TimeoutError:
+                pass
+        self._websession = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+
+
+class DiscoveryCache():
+    """
+    The accountId and the vehicleLinks of the chosen cars, kept on disk for discovery_days so that a new
+    login skips get_person and get_vehicles. Another username, car, locale or plugin name does not match it.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._state = StateFile('renault_discovery.json')
+
+    @staticmethod
+    def _key() -> List[str]:
+        return [Parameters['Username'], Parameters['Mode1'], Parameters['Mode2'], Parameters['Name']]
+
+    def load(self) -> Optional[Tuple[str, List[Any]]]:
+        """Return the accountId and the vehicleLinks, None when there is no valid discovery."""
+        if _cassette.active(): # the discovery belongs on the cassette
+            return None
+        stored = self._state.load()
+        if stored.get('key') != self._key() or \
+           time.time() - stored.get('stamp', 0) > get_option('discovery_days', 7) * 24 * 3600:
+            return None
+        try:
+            vehicles = renault_api.kamereon.schemas.KamereonVehiclesResponseSchema.load(
+                {'vehicleLinks': stored['vehicleLinks']})
+        except Exception as ex: # e.g. a file of another renault_api version, discover again
+            Domoticz.Error(f'Discovery cache not usable: {ex!r}')
+            return None
+        return stored['accountId'], list(vehicles.vehicleLinks)
+
+    def save(self, account_id: str, cars: List[Any]) -> None:
+        if _cassette.active():
+            return
+        self._state.save({'key': self._key(), 'stamp': time.time(), 'accountId': account_id,
+                          'vehicleLinks': [car.raw_data for car in cars]})
+
+    def invalidate(self, ex: BaseException) -> None:
+        """Forget the discovery when the servers say that the account or the car is not there or not ours."""
+        if isinstance(ex, (renault_api.kamereon.exceptions.AccessDeniedException,
+                           renault_api.kamereon.exceptions.ResourceNotFoundException)) or \
+           getattr(ex, 'status', None) in (403, 404):
+            if self._state.load():
+                Domoticz.Log(f'Discovery cache dropped: {ex}')
+                self._state.save({})
+
+
+class Cassette():
+    """
+    With option cassette=record every renault_api response is kept, one gzip JSON line per vehicle cycle with
+    the identifiers masked; with cassette=replay the responses of the file are given back instead of calling
+    the servers, a cycle at a time. cassette_file is the file in the plugin folder.
+    """
+
+    SCHEMAS: Dict[str, str] = {'get_person':         'KamereonPersonResponseSchema',
+                               'get_vehicles':       'KamereonVehiclesResponseSchema',
+                               'get_cockpit':        'KamereonVehicleCockpitDataSchema',
+                               'get_charge_mode':    'KamereonVehicleChargeModeDataSchema',
+                               'get_battery_status': 'KamereonVehicleBatteryStatusDataSchema',
+                               'get_location':       'KamereonVehicleLocationDataSchema',
+                               'get_hvac_status':    'KamereonVehicleHvacStatusDataSchema',
+                               'get_charges':        'KamereonVehicleChargesDataSchema',
+                               'set_charge_mode':    'KamereonVehicleChargeModeActionDataSchema',
+                               'set_ac_start':       'KamereonVehicleHvacStartActionDataSchema',
+                               'set_ac_stop':        'KamereonVehicleHvacStartActionDataSchema'}
+    MASKED = frozenset(('vin', 'registrationNumber', 'accountId', 'personId', 'partyId', 'mdmId', 'idpId',
+                        'login', 'firstName', 'lastName', 'emailValue', 'phoneValue', 'addressLine1',
+                        'postalCode', 'city', 'radioCode'))
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._calls: List[List[Any]] = [] # [name, masked VIN, response or None, error or absent] of this cycle
+        self._cycle: Dict[Tuple[str, str], deque] = {}
+        self._reader: Optional[Any] = None
+        self.cycles = 0
+        self.exhausted = False
+
+    @staticmethod
+    def mode() -> str:
+        return get_option('cassette', '').lower()
+
+    def active(self) -> bool:
+        return self.mode() in ('record', 'replay')
+
+    def replaying(self) -> bool:
+        return self.mode() == 'replay'
+
+    def path(self) -> str:
+        return os.path.join(Parameters['HomeFolder'], get_option('cassette_file', 'renault_cassette.jsonl.gz'))
+
+    @staticmethod
+    def pseudonym(key: str, value: str) -> str:
+        """Return the mask of a value, the same for each recording of the same account."""
+        digest = hashlib.sha256((Parameters['Username'] + value.strip().upper()).encode()).hexdigest()
+        return f'{key or "masked"}-{digest[:10]}'
+
+    def _mask(self, value: Any, key: str = '') -> Any:
+        if isinstance(value, dict):
+            return {name: self._mask(item, name) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self._mask(item, key) for item in value]
+        if isinstance(value, str) and (key in self.MASKED or value == Parameters['Username']):
+            return self.pseudonym(key, value)
+        return value
+
+    def record(self, name: str, vin: str, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """Keep a response or the error of a call, until the cycle ends."""
+        entry = [name, self.pseudonym('vin', vin) if vin else '',
+                 None if error else self._mask(getattr(result, 'raw_data', None))]
+        if error:
+            entry.append([type(error).__name__, [str(arg) for arg in error.args]])
+        self._calls.append(entry)
+
+    def chosen(self, cars: List[Any]) -> None:
+        """Keep only the chosen cars in the recorded get_vehicles, so a replay can use Car *."""
+        vins = {self.pseudonym('vin', car.vin or car.vehicleDetails.vin) for car in cars}
+        for name, _, response, *_ in reversed(self._calls):
+            if name == 'get_vehicles' and response:
+                response['vehicleLinks'] = [link for link in response.get('vehicleLinks') or []
+                                            if link.get('vin') in vins]
+                return
+
+    def end_cycle(self) -> None:
+        """Append the calls of the cycle to the cassette, the calls in between cycles go with the next one."""
+        if not self._calls:
+            return
+        line = json.dumps({'t': round(time.time()), 'calls': self._calls}, separators=(',', ':'))
+        try:
+            with gzip.open(self.path(), 'at', encoding='utf-8') as cassette:
+                cassette.write(line + '\n')
+        except OSError as ex:
+            Domoticz.Error(f'Could not record to {self.path()}: {ex}')
+        self._calls = []
+
+    def next_cycle(self) -> bool:
+        """Load the calls of the next recorded cycle, False when the cassette has no more."""
+        if self._reader is None and not self.exhausted:
+            try:
+                self._reader = gzip.open(self.path(), 'rt', encoding='utf-8')
+            except OSError as ex:
+                Domoticz.Error(f'Could not replay {self.path()}: {ex}')
+                self.exhausted = True
+        line = self._reader.readline() if self._reader else ''
+        if not line:
+            if self._reader:
+                self._reader.close()
+                self._reader = None
+                Domoticz.Status(f'Cassette replayed: {self.cycles} cycles')
+            self.exhausted = True
+            return False
+        self._cycle = {}
+        for entry in json.loads(line)['calls']:
+            self._cycle.setdefault((entry[0], entry[1]), deque()).append(entry)
+        self.cycles += 1
+        return True
+
+    def has(self, name: str, vin: str) -> bool:
+        return bool(self._cycle.get((name, vin)))
+
+    def action(self, vin: str) -> Action:
+        """Return the commands that were sent to a car in this cycle."""
+        action = Action.NO_ACTION
+        for entry in self._cycle.get(('set_charge_mode', vin), ()):
+            if entry[2]:
+                action |= Action.CHARGE_ALWAYS if entry[2].get('action') == Action.CHARGE_ALWAYS.api_cmd() \
+                          else Action.CHARGE_SCHEDULED
+        if self.has('set_ac_start', vin):
+            action |= Action.AC_ON
+        if self.has('set_ac_stop', vin):
+            action |= Action.AC_OFF
+        return action
+
+    def replay(self, name: str, vin: str) -> Any:
+        """Return the recorded response of a call as renault_api would, or raise the recorded error."""
+        entries = self._cycle.get((name, vin))
+        if not entries:
+            raise renault_api.exceptions.RenaultException(f'{name} is not in this cycle of the cassette')
+        entry = entries.popleft()
+        if len(entry) > 3:
+            error, args = entry[3]
+            for module in (renault_api.kamereon.exceptions, renault_api.exceptions):
+                if hasattr(module, error):
+                    raise getattr(module, error)(*args)
+            raise renault_api.exceptions.RenaultException(f'{error}: {" ".join(args)}')
+        return getattr(renault_api.kamereon.schemas, self.SCHEMAS[name]).load(entry[2])
+
+_cassette = Cassette()
+
+
+class TokenCache():
+    """Keep the Gigya login token and JWT between cycles, so a full login is only done when needed."""
+
+    def __init__(self, limiter: RequestLimiter, jwt_margin: int = 300, max_age: int = 24 * 3600) -> None:
+        super().__init__()
+        self._limiter = limiter
+        self._store: Optional[CredentialStore] = None # made on the worker, which imports renault_api
+        self._jwt_margin = jwt_margin # refresh the JWT when it expires within this many seconds
+        self._max_age = max_age       # force a full login after this many seconds
+        self._login_time: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None # cars engaged in parallel share one login
+        self.hits = 0
+        self.misses = 0
+
+    def _locale_details(self) -> Optional[Dict[str, str]]:
+        """Return the servers to use instead of those of the locale, e.g. the stand-in of tools/standin.py."""
+        url = get_option('api_url', '').rstrip('/')
+        if not url:
+            return None
+        return {'gigya-root-url': url + '/gigya', 'gigya-api-key': 'stand-in',
+                'kamereon-root-url': url + '/kamereon', 'kamereon-api-key': 'stand-in'}
+
+    def valid(self) -> bool:
+        """Check if the cached login token can be reused."""
+        if self._login_time is None or self._store is None or GIGYA_LOGIN_TOKEN not in self._store:
+            return False
+        return time.monotonic() - self._login_time < self._max_age
+
+    async def client(self, websession: aiohttp.ClientSession, priority: int = PRIORITY_POLL) -> RenaultClient:
+        """Return a RenaultClient that uses the cached credentials, only login when they are missing or stale."""
+        if self._store is None:
+            self._store = CredentialStore()
+        client = RenaultClient(websession=websession, locale=Parameters['Mode2'],
+                               locale_details=self._locale_details(), credential_store=self._store)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            jwt = self._store.get(GIGYA_JWT)
+            if jwt and jwt.expiry - time.time() < self._jwt_margin:
+                self._store.clear_keys([GIGYA_JWT]) # renault_api fetches a new one with the login token
+            if self.valid() or _cassette.replaying(): # a replay does not need the servers
+                self.hits += 1
+            else:
+                self.misses += 1
+                probe = await _breaker.admit()
+                try:
+                    await self._limiter.acquire(priority)
+                    _metrics.count('logins')
+                    await client.session.login(Parameters['Username'], Parameters['Password'])
+                    _breaker.success()
+                except Exception as ex:
+                    _breaker.failure(ex, login=True)
+                    raise
+                finally:
+                    if probe:
+                        _breaker.settle()
+                self._login_time = time.monotonic()
+        Domoticz.Debug(f'Token cache: {self.hits} hits, {self.misses} misses')
+        return client
+
+    @staticmethod
+    def expired(ex: BaseException) -> bool:
+        """Tell if a failed call says that the login has expired, a new login will do."""
+        return isinstance(ex, renault_api.exceptions.NotAuthenticatedException) or \
+               getattr(ex, 'status', None) in (401, 403)
+
+    def invalidate(self) -> None:
+        """Forget the login, so the next client will login again."""
+        if self._store is not None:
+            self._store.clear_keys(GIGYA_KEYS)
+        self._login_time = None
+
+    def close(self) -> None:
+        """Forget the login and the lock, which belongs to the event loop that is being stopped."""
+        self.invalidate()
+        self._lock = None
+
+
+class BackfillException(Exception):
+    """A backfill window could not be fetched after backfill_attempts tries, the checkpoint lets it resume."""
+
 
 class MyRenaultConnector():
     """Provide a connection to the MyRenault service."""
@@ -212,8 +1621,20 @@ class MyRenaultConnector():
     def __init__(self) -> None:
         super().__init__()
         self._logged_on = False
-        self._car: Optional[Dict[str, Any]] = None
+        self._cars: List[Any] = [] # the vehicleLinks in use, their index is the car number of the devices
         self._accountId = None
+        self._limiter = RequestLimiter()
+        self._tokens = TokenCache(self._limiter)
+        self._discovery = DiscoveryCache()
+        self._priority = PRIORITY_POLL
+        self._worker = BackgroundLoop()
+        self._engage_lock: Optional[asyncio.Lock] = None
+        self.endpoint_times: Dict[Tuple[int, str], float] = {} # (car, endpoint): seconds of the last call
+        self._caches: Dict[int, EndpointCache] = {}
+        self._snapshots: Dict[int, VehicleSnapshot] = {} # the last snapshot of each car
+        self._plans: Dict[int, frozenset] = {} # the endpoints each car needs, all when missing
+        self._confirming: Dict[Tuple[int, str], Tuple[ActionConfirmation, asyncio.Task]] = {} # (car, endpoint)
+        self.outcomes: queue.Queue = queue.Queue() # finished ActionConfirmations for the plugin thread
 
     def _lookup_car(self, cars: Optional[List[Dict[str, Any]]],
                 identifier: str) -> Optional[Dict[str, Any]]:
@@ -227,154 +1648,502 @@ class MyRenaultConnector():
                     return car
         return None
 
+    def _lookup_cars(self, cars: List[Dict[str, Any]], identifiers: str) -> List[Dict[str, Any]]:
+        """Find the cars for a comma separated list of identifiers, * means all cars."""
+        if identifiers.strip() == '*':
+            return self._cap_cars(list(cars))
+        found = []
+        for identifier in identifiers.split(','):
+            car = self._lookup_car(cars, identifier)
+            if car is None:
+                return [] # all or nothing, so the car numbers of the devices never shift
+            found.append(car)
+        return self._cap_cars(found)
+
+    @staticmethod
+    def _cap_cars(cars: List[Any]) -> List[Any]:
+        """Keep the cars that have room for their devices, Domoticz allows 255 units per hardware."""
+        for car in cars[MAX_CARS:]:
+            Domoticz.Error(f'Skipping car {car.vehicleDetails.registrationNumber}: '
+                           f'at most {MAX_CARS} cars per hardware, add another hardware for it')
+        return cars[:MAX_CARS]
+
+    def _plan_for(self, car: int) -> frozenset:
+        return self._plans.get(car, frozenset(ENDPOINTS))
+
+    def plan_endpoints(self, plans: Dict[int, frozenset]) -> None:
+        """Set the endpoints to fetch per car for the next cycles, a car without a plan gets all of them."""
+        self._plans = dict(plans)
+
+    def _cache_for(self, car: int) -> EndpointCache:
+        """Return the endpoint cache of a car."""
+        if car not in self._caches:
+            self._caches[car] = EndpointCache()
+        return self._caches[car]
+
 
     async def _connect_to_myr(self) -> None:
-        """Connect to the Renault MyR servers."""
+        """Connect to the Renault MyR servers, with the account and cars of the discovery cache when it is valid."""
         Domoticz.Debug('_connect_to_myr')
         self._logged_on = False
+        connected = False # the account is known, the cars not yet
         cars: Optional[List[Any]] = None
-        async with aiohttp.ClientSession() as websession:
-            try:
-                client = RenaultClient(websession=websession, locale=Parameters['Mode2'])
-                await client.session.login(Parameters['Username'], Parameters['Password'])
-                person=await client.get_person()
-                for accnt in person.accounts:
-                    if accnt.accountType=='MYRENAULT':
-                        self._accountId=accnt.accountId
-                Domoticz.Status('Using accountID: ' + self._accountId)
-                account = await client.get_api_account(self._accountId)
+        discovered = self._discovery.load()
+        websession = await self._worker.websession()
+        try:
+            client = await self._tokens.client(websession, self._priority)
+            if discovered:
+                self._accountId, self._cars = discovered
+                self._cars = self._cap_cars(self._cars)
                 self._logged_on = True
+                Domoticz.Debug(f'Using accountID {self._accountId} and {len(self._cars)} car(s) of the discovery cache')
+                return
+            person=await self._call(client.get_person)
+            for accnt in person.accounts:
+                if accnt.accountType=='MYRENAULT':
+                    self._accountId=accnt.accountId
+            Domoticz.Status('Using accountID: ' + self._accountId)
+            account = await client.get_api_account(self._accountId)
+            connected = True
+        except (aiohttp.client_exceptions.ClientResponseError,
+                renault_api.exceptions.RenaultException) as ex:
+            self._tokens.invalidate()
+            Domoticz.Error(f'Login Failed: {ex}')
+        except RequestLimitException as ex:
+            Domoticz.Error(f'Login postponed: {ex}')
+        if connected:
+            Domoticz.Log('Succesfully logged on')
+            try:
+                cars=await self._call(account.get_vehicles)
             except (aiohttp.client_exceptions.ClientResponseError,
-                    renault_api.exceptions.RenaultException) as ex:
-                Domoticz.Error(f'Login Failed: {ex}')
-            if self._logged_on:
-                Domoticz.Log('Succesfully logged on')
-                cars=await account.get_vehicles()
-                if cars.errors is None and not cars.vehicleLinks is None:
-                    if len(cars.vehicleLinks) == 1:
-                        self._car = cars.vehicleLinks[0]
-                    else:
-                        self._car = self._lookup_car(cars.vehicleLinks, Parameters['Mode1'])
-                        if self._car is None:
-                            self._car = self._lookup_car(cars.vehicleLinks, Parameters['Name'])
-                    if self._car is None:
-                        self._logged_on = False
-                        Domoticz.Error('Could not find the desired car: choose one from the below list')
-                        for car in cars.vehicleLinks:
-                            Domoticz.Error( 'VIN: ' + car.vehicleDetails.vin + 
-                                           ' LicensePlate: ' + car.vehicleDetails.registrationNumber +
-                                           ' Model: ' + car.vehicleDetails.model.label +
-                                           ' ' + car.vehicleDetails.engineEnergyType)
-                    else:
-                        Domoticz.Status('Using VIN: ' + self._car.vehicleDetails.vin + 
-                                       ' LicensePlate: ' + self._car.vehicleDetails.registrationNumber +
-                                       ' Model: ' + self._car.vehicleDetails.model.label +
-                                       ' ' + self._car.vehicleDetails.engineEnergyType)
+                    renault_api.exceptions.RenaultException,
+                    RequestLimitException) as ex:
+                Domoticz.Error(f'Error in get_vehicles: {ex}')
+                return
+            if cars.errors is None and not cars.vehicleLinks is None:
+                if len(cars.vehicleLinks) == 1:
+                    self._cars = [cars.vehicleLinks[0]]
                 else:
-                    Domoticz.Error('Error in get_vehicles:' + cars)
-
-
-    async def _engage_vehicle(self, action: Action) -> Union[Any, None]:
+                    self._cars = self._lookup_cars(cars.vehicleLinks, Parameters['Mode1'])
+                    if not self._cars:
+                        self._cars = self._lookup_cars(cars.vehicleLinks, Parameters['Name'])
+                if not self._cars:
+                    Domoticz.Error('Could not find the desired car: choose one or more from the below list')
+                    for car in cars.vehicleLinks:
+                        Domoticz.Error( 'VIN: ' + car.vehicleDetails.vin + 
+                                       ' LicensePlate: ' + car.vehicleDetails.registrationNumber +
+                                       ' Model: ' + car.vehicleDetails.model.label +
+                                       ' ' + car.vehicleDetails.engineEnergyType)
+                else:
+                    for car in self._cars:
+                        Domoticz.Status('Using VIN: ' + car.vehicleDetails.vin + 
+                                       ' LicensePlate: ' + car.vehicleDetails.registrationNumber +
+                                       ' Model: ' + car.vehicleDetails.model.label +
+                                       ' ' + car.vehicleDetails.engineEnergyType)
+                    self._discovery.save(self._accountId, self._cars)
+                    self._logged_on = True
+                    if _cassette.mode() == 'record':
+                        _cassette.chosen(self._cars)
+            else:
+                Domoticz.Error('Error in get_vehicles:' + cars)
+
+
+    async def _call(self, method, *args, priority: Optional[int] = None) -> Any:
+        """Call a renault_api method once the CircuitBreaker and the RequestLimiter allow it."""
+        name = getattr(method, '__name__', 'call')
+        vin = getattr(getattr(method, '__self__', None), 'vin', '')
+        if _cassette.replaying():
+            return _cassette.replay(name, vin) # the VIN on the cassette is masked already
+        probe = await _breaker.admit()
+        try:
+            return await self._request(name, vin, method, *args, priority=priority)
+        finally:
+            if probe: # e.g. refused by the limiter, the next call probes
+                _breaker.settle()
+
+    async def _request(self, name: str, vin: str, method, *args, priority: Optional[int] = None) -> Any:
+        await self._limiter.acquire(self._priority if priority is None else priority)
+        start = time.monotonic()
+        _metrics.count('api_calls', endpoint=name)
+        try:
+            result = await method(*args)
+        except renault_api.kamereon.exceptions.QuotaLimitException as ex:
+            self._limiter.quota_error()
+            _metrics.count('quota_errors')
+            _breaker.failure(ex)
+            if _cassette.active():
+                _cassette.record(name, vin, error=ex)
+            raise
+        except Exception as ex:
+            _metrics.count('api_errors', error=type(ex).__name__)
+            if not TokenCache.expired(ex): # no outage, the cycle invalidates the token and logs in again
+                _breaker.failure(ex)
+            if _cassette.active():
+                _cassette.record(name, vin, error=ex)
+            raise
+        finally:
+            _metrics.observe('api_call_seconds', time.monotonic() - start, endpoint=name)
+        self._limiter.success()
+        _breaker.success()
+        if _cassette.active():
+            _cassette.record(name, vin, result)
+        return result
+
+    def _snapshot(self, car: int, cache: EndpointCache) -> VehicleSnapshot:
+        """Build the snapshot of this cycle and mark what changed since the previous one."""
+        snapshot = cache.snapshot()
+        snapshot.changed = snapshot.diff(self._snapshots.get(car))
+        self._snapshots[car] = snapshot
+        return snapshot
+
+    async def _timed(self, car: int, name: str, method, *args) -> Any:
+        """Call one endpoint of a car and remember how long it took."""
+        start = time.monotonic()
+        try:
+            return await self._call(method, *args)
+        finally:
+            self.endpoint_times[car, name] = time.monotonic() - start
+
+    async def _engage_vehicle(self, car: int, action: Action) -> Union[Any, None]:
         """Get status from the Renault MyR servers."""
-        Domoticz.Debug('_engage_vehicle ' + action.name)
+        Domoticz.Debug(f'_engage_vehicle {car} {action.name}')
         now = datetime.datetime.now()
+        cache = self._cache_for(car)
+        sent: List[Action] = [] # a retry must not send a command again
+        expired = False # only a login that keeps failing ends the session of all cars
         attempt = 3
         while attempt:
             try:
-                async with aiohttp.ClientSession() as websession:
-                    client = RenaultClient(websession=websession, locale=Parameters['Mode2'])
-                    await client.session.login(Parameters['Username'], Parameters['Password'])
-                    account = await  client.get_api_account(self._accountId)
-                    vehicle = await account.get_api_vehicle(self._car.vehicleDetails.vin)
-                    if action: # zero is reserved for no action, just collect vehicle_status
-                        if action in Action.CHARGE:
-                            pending = 3
-                            while pending:
-                                result = await vehicle.get_charge_mode()
-                                if result.chargeMode == action.api_res():
-                                    pending = 0
-                                else:
-                                    Domoticz.Status(await vehicle.set_charge_mode(action.api_cmd()))
-                                    await asyncio.sleep(3)
-                                    pending -= 1
-                        if action in Action.AC_ON:
-                            pending = 3
-                            while pending:
-                                result = await vehicle.get_hvac_status()
-                                if result.hvacStatus == action.api_res():
-                                    pending = 0
-                                else:
-                                    Domoticz.Status(await vehicle.set_ac_start(20.0)) # TODO: make temperature a parameter
-                                    await asyncio.sleep(3)
-                                    pending -= 1
-                        if action in Action.AC_OFF:
-                            pending = 3
-                            while pending:
-                                result = await vehicle.get_hvac_status()
-                                if result.hvacStatus == action.api_res():
-                                    pending = 0
-                                else:
-                                    Domoticz.Status(await vehicle.set_ac_stop())
-                                    await asyncio.sleep(3)
-                                    pending -= 1
-                    vehicle_status = []
-                    vehicle_status.append(await vehicle.get_cockpit())        #[0] fuelAutonomy fuelQuantity totalMileage
-                    vehicle_status.append(await vehicle.get_charge_mode())    #[1] chargeMode
-                    vehicle_status.append(await vehicle.get_battery_status()) #[2] timestamp batteryLevel batteryAutonomy plugStatus chargingStatus
-                    vehicle_status.append(await vehicle.get_location())       #[3] timestamp gpsLongitude gpsLatitude lastUpdateTime gpsDirection
-                    vehicle_status.append(await vehicle.get_hvac_status())    #[4] hvacStatus socThreshold internalTemperature lastUpdateTime
-                    vehicle_status.append(await vehicle.get_charges(now,now)) #[5] charges of today
-#                     vehicle_status.append(await vehicle.get_details())
-#                     vehicle_status.append(await vehicle.get_charging_settings())
-#                     vehicle_status.append(await vehicle.get_hvac_settings())
-                    #vehicle_status.append(await vehicle.get_lock_status())                  #broken
-                    #vehicle_status.append(await vehicle.get_notification_settings())        #broken
-                    #vehicle_status.append(await vehicle.get_res_state())                    #broken
-                    #vehicle_status.append(await vehicle.get_hvac_sessions(now,now))         #broken
-                    return vehicle_status
+                plan = self._plan_for(car)
+                stale = cache.stale(plan)
+                if self._priority == PRIORITY_COMMAND: # e.g. RefreshNow, the user wants it all fresh
+                    stale = [name for name in ENDPOINTS if name in plan]
+                if _cassette.replaying(): # what was fetched in the recorded cycle
+                    stale = [name for name in ENDPOINTS
+                             if name in plan and _cassette.has('get_' + name, self._cars[car].vehicleDetails.vin)]
+                Domoticz.Debug(f'Endpoint cache {car}: {len(stale)} stale, hit ratio {cache.hit_ratio():.2f}')
+                if not action and not stale:
+                    return self._snapshot(car, cache)
+                websession = await self._worker.websession()
+                client = await self._tokens.client(websession, self._priority)
+                account = await  client.get_api_account(self._accountId)
+                vehicle = await account.get_api_vehicle(self._cars[car].vehicleDetails.vin)
+                for part in ActionConfirmation.parts(action): # zero is reserved for no action
+                    if part not in sent:
+                        await self._send(car, vehicle, part, cache)
+                        sent.append(part)
+                calls = {'cockpit':        (vehicle.get_cockpit,),          # fuelAutonomy fuelQuantity totalMileage
+                         'charge_mode':    (vehicle.get_charge_mode,),      # chargeMode
+                         'battery_status': (vehicle.get_battery_status,),   # timestamp batteryLevel batteryAutonomy plugStatus chargingStatus
+                         'location':       (vehicle.get_location,),         # timestamp gpsLongitude gpsLatitude lastUpdateTime gpsDirection
+                         'hvac_status':    (vehicle.get_hvac_status,),      # hvacStatus socThreshold internalTemperature lastUpdateTime
+                         'charges':        (vehicle.get_charges, now, now)} # charges of today
+#                 vehicle.get_details()
+#                 vehicle.get_charging_settings()
+#                 vehicle.get_hvac_settings()
+                #vehicle.get_lock_status()                  #broken
+                #vehicle.get_notification_settings()        #broken
+                #vehicle.get_res_state()                    #broken
+                #vehicle.get_hvac_sessions(now,now)         #broken
+                results = await asyncio.gather(*(self._timed(car, name, *calls[name]) for name in stale),
+                                               return_exceptions=True)
+                Domoticz.Debug(f'Endpoint times {car}: ' + ' '.join(f'{name}={self.endpoint_times[car, name]:.2f}s'
+                                                                   for name in stale))
+                failed = [result for result in results if isinstance(result, BaseException)]
+                if failed and len(failed) == len(results):
+                    raise failed[0] # nothing came through, let the retry logic decide
+                for name, result in zip(stale, results):
+                    if isinstance(result, BaseException):
+                        Domoticz.Error(f'Retrieve {name} failed: {result}') # keep the last known result
+                    else:
+                        cache.store(name, result)
+                return self._snapshot(car, cache)
             except (aiohttp.client_exceptions.ClientResponseError,
                     aiohttp.client_exceptions.ClientConnectorError,
                     renault_api.kamereon.exceptions.FailedForwardException) as ex:
                 Domoticz.Error(f'Try again? {attempt}: {ex}')
+                expired = TokenCache.expired(ex)
+                if expired:
+                    self._tokens.invalidate()
+                self._discovery.invalidate(ex)
                 attempt -= 1
-                if attempt:
+                _metrics.count('retries')
+                if attempt and not _breaker.is_open():
                     await asyncio.sleep(5)
+            except renault_api.exceptions.NotAuthenticatedException as ex:
+                Domoticz.Error(f'Login expired, try again? {attempt}: {ex}')
+                expired = True
+                self._tokens.invalidate()
+                attempt -= 1
+                _metrics.count('retries')
             except renault_api.kamereon.exceptions.QuotaLimitException as ex:
                 Domoticz.Error(f'Overload Error: {ex}')
                 attempt = 0
+            except CircuitOpenException as ex:
+                Domoticz.Log(f'Not retrieved: {ex}')
+                self._reject(car, action, sent)
+                return self._snapshot(car, cache) # what is known, the login is still fine
+            except RequestLimitException as ex:
+                Domoticz.Error(f'Postponed: {ex}')
+                self._reject(car, action, sent)
+                return None # the login is still fine
             except renault_api.exceptions.RenaultException as ex:
                 Domoticz.Error(f'Retrieve Error: {ex}')
+                self._discovery.invalidate(ex)
                 attempt = 0
-        self._logged_on = False
+        self._reject(car, action, sent)
+        if expired:
+            self._logged_on = False
         return None
 
-
-    def engage_vehicle(self, action: Action = 0) -> Union[Any, None]:
-        """Perform action and Retrieve the status information of the vehicle."""
-        vehicle_status = None
-        if not self._logged_on:
-            asyncio.run(self._connect_to_myr())
-        if self._logged_on:
+    async def _send(self, car: int, vehicle, action: Action, cache: EndpointCache) -> None:
+        """Send a command once and follow it in the background until the car confirms it."""
+        confirmation = ActionConfirmation(car, action, time.monotonic())
+        key = (car, confirmation.endpoint)
+        if key in self._confirming:
+            previous, task = self._confirming[key]
+            if previous.action == action:
+                Domoticz.Log(f'Command {action.name} is already waiting for the car')
+                return
+            task.cancel() # superseded by the new command on the same endpoint
+            self._finish(previous, Outcome.REJECTED)
+        Domoticz.Status(await self._call(*confirmation.command(vehicle)))
+        if _cassette.replaying(): # the recorded confirmation polls are spread over later cycles
+            self._finish(confirmation, Outcome.CONFIRMED)
+            return
+        task = asyncio.get_running_loop().create_task(self._confirm(confirmation, vehicle, cache))
+        self._confirming[key] = (confirmation, task)
+
+    async def _confirm(self, confirmation: ActionConfirmation, vehicle, cache: EndpointCache) -> None:
+        """Poll the status endpoint of a sent command with backoff, without holding the engage lock."""
+        while True:
+            delay = confirmation.next_delay(time.monotonic())
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
             try:
-                if not self._car.vehicleDetails.vin is None:
-                    Domoticz.Log('Engaging Vehicle')
-                    vehicle_status = asyncio.run(self._engage_vehicle(action))
-                else:
-                    Domoticz.Error('Lost login with no VIN')
-                    self._logged_on = False
+                result = await self._call(confirmation.status(vehicle), priority=PRIORITY_COMMAND)
+            except (aiohttp.client_exceptions.ClientError,
+                    renault_api.exceptions.RenaultException,
+                    RequestLimitException) as ex:
+                Domoticz.Log(f'Confirmation of {confirmation.action.name} postponed: {ex}')
+                continue
+            cache.store(confirmation.endpoint, result) # the freshest there is
+            if confirmation.check(result):
+                break
+        if self._confirming.get((confirmation.car, confirmation.endpoint), (None,))[0] is confirmation:
+            del self._confirming[(confirmation.car, confirmation.endpoint)]
+        self._finish(confirmation, confirmation.outcome)
+
+    def _finish(self, confirmation: ActionConfirmation, outcome: Outcome) -> None:
+        confirmation.outcome = outcome
+        _metrics.count('commands', outcome=outcome.name.lower())
+        self.outcomes.put(confirmation)
+
+    def _reject(self, car: int, action: Action, sent: List[Action]) -> None:
+        """Report the commands that could not be sent."""
+        for part in ActionConfirmation.parts(action):
+            if part not in sent:
+                self._finish(ActionConfirmation(car, part, time.monotonic()), Outcome.REJECTED)
+
+
+    async def _backfill_window(self, car: int, first: datetime.date,
+                               last: datetime.date) -> Optional[Tuple[Tuple[str, int], ...]]:
+        """Fetch the charges of one window, None when it has to be tried again later."""
+        async with self._engage_lock:
+            self._priority = PRIORITY_POLL
+            if not self._limiter.available(PRIORITY_POLL, 1 + len(ENDPOINTS)): # leave room for a poll
+                return None
+            if not self._logged_on:
+                await self._connect_to_myr()
+                if not self._logged_on:
+                    return None
+            try:
+                websession = await self._worker.websession()
+                client = await self._tokens.client(websession, self._priority)
+                account = await client.get_api_account(self._accountId)
+                vehicle = await account.get_api_vehicle(self._cars[car].vehicleDetails.vin)
+                start = datetime.datetime.combine(first, datetime.time())
+                end = datetime.datetime.combine(last, datetime.time())
+                charges = await self._call(vehicle.get_charges, start, end)
+                return charge_records(charges.raw_data.get('charges'))
+            except (aiohttp.client_exceptions.ClientResponseError,
+                    aiohttp.client_exceptions.ClientConnectorError,
+                    renault_api.exceptions.RenaultException,
+                    RequestLimitException) as ex:
+                Domoticz.Error(f'Backfill {first} - {last} postponed: {ex}')
+                self._discovery.invalidate(ex)
+                return None
+            finally:
+                self._limiter.save()
+
+    async def _backfill_charges(self, car: int, first: datetime.date, last: datetime.date, results: queue.Queue) -> None:
+        """Walk from first to last in windows and stream the charges to the plugin thread."""
+        if self._engage_lock is None:
+            self._engage_lock = asyncio.Lock() # created here so it belongs to the worker loop
+        window = datetime.timedelta(days=max(get_option('backfill_window', 7), 1))
+        start = first
+        attempts = 0
+        while start <= last:
+            end = min(start + window - datetime.timedelta(days=1), last)
+            charges = await self._backfill_window(car, start, end)
+            if charges is None:
+                attempts += 1
+                if attempts >= max(get_option('backfill_attempts', 8), 1):
+                    raise BackfillException(f'the charges of {start} - {end} failed {attempts} times')
+                await asyncio.sleep(min(60 * 2 ** (attempts - 1), 3600)) # the limiter or the servers want us to wait
+                continue
+            attempts = 0
+            results.put((car, start, end, charges))
+            start = end + datetime.timedelta(days=1)
+        results.put((car, None, None, None))
+
+    def submit_backfill(self, car: int, first: datetime.date, last: datetime.date,
+                        results: queue.Queue) -> concurrent.futures.Future:
+        """Import the charges of a car from first up to last in the background, windows are put on results."""
+        return self._worker.submit(self._backfill_charges(car, first, last, results))
+
+    async def _one_vehicle(self, car: int, action: Action, limit: asyncio.Semaphore) -> Union[Any, None]:
+        """Engage one car, at most limit cars at the same time."""
+        async with limit:
+            try:
+                if not self._cars[car].vehicleDetails.vin is None:
+                    Domoticz.Log(f'Engaging Vehicle {car}')
+                    return await self._engage_vehicle(car, action)
+                Domoticz.Error(f'Car {car} has no VIN')
             except AttributeError as ex:
-                Domoticz.Error(f'Lost login: {ex}')
-                self._logged_on = False
-        if vehicle_status is None:
-            Domoticz.Error('Vehicle status could not be retrieved')
-        else:
-            Domoticz.Log(vehicle_status)
-        return vehicle_status
+                Domoticz.Error(f'Car {car} could not be engaged: {ex}')
+            return None
+
+    async def _vehicle(self, actions: Dict[int, Action], priority: int) -> Dict[int, Any]:
+        """
+        Login when needed, perform the actions and retrieve the status information of the vehicles.
+        actions maps car numbers to their action, empty means just the status of all cars.
+        """
+        if self._engage_lock is None:
+            self._engage_lock = asyncio.Lock() # created here so it belongs to the worker loop
+        async with self._engage_lock:
+            start = time.monotonic()
+            self._priority = priority
+            statuses: Dict[int, Any] = {}
+            if _cassette.replaying():
+                if not _cassette.next_cycle():
+                    return statuses
+                if not actions: # the commands of the user in the recorded cycle
+                    actions = {car: action for car, action in
+                               ((car, _cassette.action(link.vehicleDetails.vin)) for car, link in enumerate(self._cars))
+                               if action}
+            if _breaker.is_open(): # fail fast with what is known
+                Domoticz.Log(f'Circuit breaker {_breaker.describe()}, using the cached data')
+                for car, action in actions.items():
+                    self._reject(car, action, [])
+                return {car: self._snapshot(car, self._cache_for(car)) for car in range(len(self._cars))}
+            if priority == PRIORITY_POLL and \
+               not self._limiter.available(priority, max(sum(len(self._plan_for(car))
+                                                             for car in range(len(self._cars))), 1)):
+                Domoticz.Log('Poll skipped, the request limit is reached')
+                return statuses
+            if not self._logged_on:
+                await self._connect_to_myr()
+            if self._logged_on:
+                if not actions:
+                    actions = {car: Action.NO_ACTION for car in range(len(self._cars))}
+                actions = {car: action for car, action in actions.items() if car < len(self._cars)}
+                limit = asyncio.Semaphore(max(get_option('car_parallel', 2), 1))
+                results = await asyncio.gather(*(self._one_vehicle(car, action, limit)
+                                                 for car, action in actions.items()))
+                statuses = dict(zip(actions, results))
+            self._limiter.save()
+            for car, vehicle_status in statuses.items():
+                if vehicle_status is None:
+                    Domoticz.Error(f'Vehicle status {car} could not be retrieved')
+                else:
+                    Domoticz.Log(vehicle_status)
+            if not statuses:
+                Domoticz.Error('Vehicle status could not be retrieved')
+            _metrics.observe('cycle_seconds', time.monotonic() - start)
+            _metrics.count('cycles', result='ok' if any(statuses.values()) else 'failed')
+            if _cassette.mode() == 'record':
+                _cassette.end_cycle()
+            return statuses
+
+    def engage_vehicle(self, actions: Optional[Dict[int, Action]] = None,
+                       priority: int = PRIORITY_POLL) -> Dict[int, Any]:
+        """Perform actions and Retrieve the status information of the vehicles, waiting for the result."""
+        try:
+            return self._worker.run(self._vehicle(actions or {}, priority), ENGAGE_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            Domoticz.Error('Vehicle status could not be retrieved in time')
+            return {}
+
+    def submit_vehicle(self, actions: Optional[Dict[int, Action]] = None,
+                       priority: int = PRIORITY_POLL) -> concurrent.futures.Future:
+        """Perform actions and Retrieve the status information of the vehicles in the background."""
+        return self._worker.submit(self._vehicle(actions or {}, priority))
+
+    def car_count(self) -> int:
+        """Return the number of cars in use, 0 until logged on."""
+        return len(self._cars)
+
+    def car_label(self, car: int) -> str:
+        """Return the license plate of a car, to tell the devices of the cars apart."""
+        return self._cars[car].vehicleDetails.registrationNumber or self._cars[car].vehicleDetails.vin
 
 
     def disconnect(self) -> None:
         """Disconnect from the MyRenault servers."""
+        self._confirming.clear() # their tasks end with the worker loop
+        _breaker.settle() # a probe of the stopped worker loop
         self._logged_on = False
+        self._tokens.close()
+        self._worker.stop()
+        self._engage_lock = None
+
+
+class DeviceWriter():
+    """Layer between the device classes and Devices that drops unchanged writes and merges the writes of a cycle."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._queue: Dict[int, Tuple[int, str, bool, Any]] = {} # unit: (nValue, sValue, force, device)
+        self.written = 0
+        self.suppressed = 0
+        self.merged = 0
+
+    def update(self, unit: int, nValue: int, sValue: str, force: bool = False, device: Any = None) -> None:
+        """Queue a write, a later write to the same unit before the flush replaces it."""
+        if unit in self._queue:
+            self.merged += 1
+            force = force or self._queue[unit][2]
+        self._queue[unit] = (nValue, sValue, force, device)
+
+    def history(self, unit: int, nValue: int, sValue: str) -> None:
+        """Write right away and in order, for counters that keep each dated sValue as a separate point."""
+        Devices[unit].Update(nValue=nValue, sValue=sValue)
+        self.written += 1
+
+    def read(self, unit: int) -> Tuple[int, str]:
+        """Return nValue and sValue of a unit, including a write that is still queued."""
+        if unit in self._queue:
+            return self._queue[unit][0], self._queue[unit][1]
+        return Devices[unit].nValue, Devices[unit].sValue
+
+    def flush(self) -> None:
+        """Write the queued values that differ from what Domoticz has, or that are forced as keep-alive."""
+        for unit, (nValue, sValue, force, device) in self._queue.items():
+            if not unit in Devices:
+                continue
+            if not force and Devices[unit].nValue == nValue and Devices[unit].sValue == sValue:
+                self.suppressed += 1
+                continue
+            Devices[unit].Update(nValue=nValue, sValue=sValue)
+            self.written += 1
+            if device:
+                device.did_update()
+        self._queue.clear()
+        Domoticz.Debug(f'Device writes: {self.written} written, {self.suppressed} suppressed, {self.merged} merged')
+
+_writer = DeviceWriter()
 
 
 class DomoticzDevice(ABC):
@@ -401,12 +2170,32 @@ class DomoticzDevice(ABC):
         diff = datetime.datetime.now() - self._last_update
         return (diff.seconds > self._update_interval) or self._do_first_update
 
+    def write(self, nValue: int, sValue: str, force: bool = False) -> None:
+        """Update the device in Domoticz via the DeviceWriter, unchanged values only when a keep-alive is due."""
+        _writer.update(self._unit_index, nValue, sValue, force or self.requires_update(), self)
+
 class RenaultDomoticzDevice(DomoticzDevice):
     """
     A generic updateable Domoticz device, to represent information from
     a MyRenault connected services car.
     """
 
+    READS: Tuple[str, ...] = () # the VehicleSnapshot fields that update uses
+
+    def __init__(self, unit_index: int, car: int = 0, label: str = '') -> None:
+        super().__init__(car * UNIT_BLOCK + unit_index)
+        self.car = car
+        self._offset = car * UNIT_BLOCK # add to a UNIT_*_INDEX to find a sibling device of the same car
+        self._label = label
+
+    def used(self) -> bool:
+        """Check if the device exists and is not switched off as unused in Domoticz."""
+        return bool(self.exists() and getattr(Devices[self._unit_index], 'Used', 1))
+
+    def name(self, name: str) -> str:
+        """Return the device name, the devices of the second and later cars carry their label."""
+        return f'{name} {self._label}' if self.car else name
+
     @abstractmethod
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
@@ -419,6 +2208,10 @@ class RenaultDomoticzDevice(DomoticzDevice):
         """
         return
 
+    def next_action(self, vehicle_status) -> Action:
+        """Return the action that the status asks for, without updating the device."""
+        return Action.NO_ACTION
+
     def onCommand(self, Command, Level, Color) -> Action: # return: which action to apply
         """
         Process a command for this device and
@@ -426,21 +2219,40 @@ class RenaultDomoticzDevice(DomoticzDevice):
         """
         return
 
+    def command_start(self) -> None:
+        """Learn that a press starts a new command, none of this device is held or waiting for the car."""
+        return
+
+    def command_done(self, action: Action, outcome: Outcome) -> None:
+        """Learn the outcome of the action that an earlier onCommand asked for."""
+        return
+
+    def zone_charge(self) -> Action:
+        """Return the charge mode of the zone the car is parked in, always charging outside the zones."""
+        if _geofence.located(self.car):
+            zone = _geofence.zone_of(self.car)
+        else: # no position since the start, the home distance shown is the last one known
+            try:
+                distance = float(_writer.read(self._offset + UNIT_SEPARATION_INDEX)[1])
+            except (KeyError, ValueError):
+                distance = math.inf
+            zone = _geofence.home if _geofence.home and distance <= _geofence.home.radius else None
+        if zone and zone is _geofence.home and _solar.charging: # the meter of Domoticz is at home
+            return Action.CHARGE_ALWAYS
+        return zone.charge if zone else Action.CHARGE_ALWAYS
+
 class SeparationRenaultDevice(RenaultDomoticzDevice):
     """The Domoticz device that shows the distance between the parked car and home."""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_SEPARATION_INDEX)
-        self._home: Optional[Tuple[float, ...]] = None
-        if Settings['Location']: # we assume the earth is flat and square near the home location
-            self._home = tuple(float(part) for part in Settings['Location'].split(';'))
-            self._degreev: float=40000/360                                          # kmeters at equator per degree
-            self._degreeh=self._degreev*math.cos(float(self._home[0])*math.pi/180)  # kmeters at home Latitude per degree
+    READS = ('latitude', 'longitude')
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_SEPARATION_INDEX, car, label)
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='Distance to home', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('Distance to home'), Unit=self._unit_index,
                             TypeName='Custom Sensor', Type=243, Subtype=31,
                             Options={'Custom': '1;km'},
                             Used=1,
@@ -449,25 +2261,49 @@ class SeparationRenaultDevice(RenaultDomoticzDevice):
 
     def update(self, vehicle_status) -> Action:
         """Determine the actual value of the instrument and update the device in Domoticz."""
-        if vehicle_status:
+        if vehicle_status and vehicle_status.has('location') and _geofence.home:
             if self.exists():
-                kmetersv=self._degreev*(float(self._home[0])-vehicle_status[3].gpsLatitude)
-                kmetersh=self._degreeh*(float(self._home[1])-vehicle_status[3].gpsLongitude)
-                dist=round(math.sqrt(kmetersv*kmetersv+kmetersh*kmetersh),3)
-                Devices[self._unit_index].Update(nValue=0, sValue=f'{dist}')
+                dist = round(_geofence.home.distance(vehicle_status.latitude, vehicle_status.longitude), 3)
+                self.write(0, f'{dist}')
+
+
+class ZoneRenaultDevice(RenaultDomoticzDevice):
+    """The Domoticz device that shows the zone the car is parked in."""
+
+    READS = ('latitude', 'longitude')
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_ZONE_INDEX, car, label)
+
+    def create(self) -> None:
+        """Check if the device is present in Domoticz, and otherwise create it."""
+        if not self.exists():
+            Domoticz.Device(Name=self.name('Zone'), Unit=self._unit_index,
+                            TypeName='Text', Type=243, Subtype=19,
+                            Used=1,
+                            Description='The zone of renault_zones.json or home the car is parked in'
+                            ).Create()
+
+    def update(self, vehicle_status) -> Action:
+        """Determine the actual value of the instrument and update the device in Domoticz."""
+        if vehicle_status and vehicle_status.has('location') and self.exists():
+            zone = _geofence.zone_of(self.car)
+            self.write(0, zone.name if zone else 'elsewhere')
 
 
 class DistanceRenaultDevice(RenaultDomoticzDevice): # TODO: make option for miles based on relevant locale?
     """The Domoticz device that shows the distance."""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_DISTANCE_INDEX)
+    READS = ('mileage',)
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_DISTANCE_INDEX, car, label)
         self._last_distance: int = 0
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='Distance', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('Distance'), Unit=self._unit_index,
                             Type=113, Switchtype=3,
                             Used=1,
                             Description='Counter to hold the overall distance',
@@ -485,27 +2321,28 @@ class DistanceRenaultDevice(RenaultDomoticzDevice): # TODO: make option for mile
 
     def update(self, vehicle_status) -> Action:
         """Determine the actual value of the instrument and update the device in Domoticz."""
-        if vehicle_status:
+        if vehicle_status and vehicle_status.mileage is not None:
             if self.exists():
-                distance = vehicle_status[0].totalMileage
+                distance = vehicle_status.mileage
                 diff = distance - self._last_distance
                 if diff >= 0 or self.requires_update(): # Distance can only go up
-                    Devices[self._unit_index].Update(nValue=0, sValue=f'{distance}')
+                    self.write(0, f'{distance}')
                     self._last_distance = distance
-                    self.did_update()
 
 
 class FuelRenaultDevice(RenaultDomoticzDevice):
     """The Domoticz device that shows the fuel level percentage."""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_FUEL_INDEX)
+    READS = ('fuel',)
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_FUEL_INDEX, car, label)
         self._last_fuel: float = 0.0
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='Fuel level', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('Fuel level'), Unit=self._unit_index,
                             TypeName='Percentage',
                             Used=1,
                             Image=10, # LogFire (represents Fossil Fuel)
@@ -519,26 +2356,30 @@ class FuelRenaultDevice(RenaultDomoticzDevice):
 
     def update(self, vehicle_status) -> Action:
         """Determine the actual value of the instrument and update the device in Domoticz."""
-        if vehicle_status:
+        if vehicle_status and vehicle_status.fuel is not None:
             if self.exists():
-                fuel = vehicle_status[0].fuelQuantity/0.4 # TODO: make this litres or learn tank volume
-#                 if fuel != self._last_fuel or self.requires_update():
-                Devices[self._unit_index].Update(nValue=0, sValue=str(fuel))
+                fuel = vehicle_status.fuel/0.4 # TODO: make this litres or learn tank volume
+                self.write(0, str(fuel)) # the DeviceWriter drops it when unchanged
                 self._last_fuel = fuel
-                self.did_update()
 
 
 class ChargeRenaultDevice(RenaultDomoticzDevice):
     """The Domoticz device that shows the charges made"""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_CHARGE_INDEX)
+    READS = ('charges',)
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_CHARGE_INDEX, car, label)
         self._last_fuel: float = 0.0
+        self._state_file = StateFile(car_file('renault_charges.json', car))
+        self._state: Optional[Dict[str, Any]] = None
+        self._utc = ZoneInfo('UTC')
+        self._localtime = ZoneInfo('localtime')
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='Charge', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('Charge'), Unit=self._unit_index,
                             Type=243, Subtype=33, Switchtype=0, # Managed Counter
                             Used=1,
                             Image=1, # Wall Socket (represents Electric Energy)
@@ -550,46 +2391,88 @@ class ChargeRenaultDevice(RenaultDomoticzDevice):
             except ValueError:
                 self._last_fuel = 0
 
+    def _watermark(self) -> Dict[str, Any]:
+        """Return the ingestion state: last chargeStartDate and its energy, the day totals and the last zero point."""
+        if self._state is None:
+            self._state = self._state_file.load()
+        return self._state
+
+    def _local(self, start: str) -> Tuple[str, str]:
+        """Return the local time and date of a chargeStartDate."""
+        ncsd=datetime.datetime.strptime(start,'%Y-%m-%dT%H:%M:%SZ') #2023-09-17T00:00:49Z
+        ucsd=ncsd.replace(tzinfo=self._utc)         #convert naive time to UTC aware
+        lcsd=ucsd.astimezone(self._localtime)       #present in the local timezone
+        return lcsd.strftime('%Y-%m-%d %H:%M:%S'), lcsd.strftime('%Y-%m-%d')
+
+    def backfill(self, charges: Tuple[Tuple[str, int], ...], totals: Dict[str, int]) -> int:
+        """
+        Write historical charges to the counter history in one go, return the number of points written.
+        totals carries the day totals over to the next window, for a day that spans two windows.
+        """
+        days = set()
+        for start, energy in sorted(charges):
+            csd_time, csd_date = self._local(start)
+            totals[csd_date] = totals.get(csd_date, 0) + energy
+            _writer.history(self._unit_index, 0, '-1;' + str(energy) + ';' + csd_time)
+            days.add(csd_date)
+        for csd_date in sorted(days):
+            _writer.history(self._unit_index, 0, '-1;' + str(totals[csd_date]) + ';' + csd_date)
+        for csd_date in sorted(totals)[:-1]: # only the last day can continue in the next window
+            del totals[csd_date]
+        return len(charges) + len(days)
+
+    def ingest(self, charges: Tuple[Tuple[str, int], ...]) -> int:
+        """Write the charges from the watermark on to the counter history, return the number of points written."""
+        state = self._watermark()
+        mark = state.get('start', '')
+        fresh = sorted(charge for charge in charges if charge[0] >= mark)
+        totals = state.setdefault('totals', {})
+        days = set()
+        written = 0
+        for start, energy in fresh:
+            if start == mark and energy == state.get('energy'):
+                continue # already ingested and not grown since
+            csd_time, csd_date = self._local(start)
+            previous = state.get('energy', 0) if start == mark else 0 # a charge in progress grows
+            totals[csd_date] = totals.get(csd_date, 0) + energy - previous
+            _writer.history(self._unit_index, 0, '-1;' + str(energy) + ';' + csd_time)
+            written += 1
+            days.add(csd_date)
+            mark = state['start'] = start
+            state['energy'] = energy
+        for csd_date in sorted(days):
+            _writer.history(self._unit_index, 0, '-1;' + str(totals[csd_date]) + ';' + csd_date)
+        for csd_date in sorted(totals)[:-3]: # only the last days can still change
+            del totals[csd_date]
+        if days:
+            self._state_file.save(state)
+        return written + len(days)
+
     def update(self, vehicle_status) -> Action:
         """Determine the actual value of the instrument and update the device in Domoticz."""
-        if vehicle_status: # TODO: make a at home and elsewhere counter...
+        if vehicle_status and vehicle_status.has('charges'): # TODO: make a at home and elsewhere counter...
             if self.exists():
-                old_csd_date=''
-                raw_data=vehicle_status[5].raw_data
-                now = datetime.datetime.now()
-                sValn='-1;0;' + now.strftime('%Y-%m-%d') + ' 00:00:00'
-                Devices[self._unit_index].Update(nValue=0,sValue=sValn)  # register a zero point at 00:00
-                for charge in raw_data['charges']:
-                    energy=round(charge['chargeEnergyRecovered']*1000)
-                    if energy<0: #Renault API is able to report a negative number !!!
-                        energy=1 #signal that something bad happened but not significant to disturb
-                    ncsd=datetime.datetime.strptime(charge['chargeStartDate'],'%Y-%m-%dT%H:%M:%SZ') #2023-09-17T00:00:49Z
-                    ucsd=ncsd.replace(tzinfo=ZoneInfo('UTC'))   #convert naive time to UTC aware
-                    lcsd=ucsd.astimezone(ZoneInfo('localtime')) #present in the local timezone
-                    csd_time=lcsd.strftime('%Y-%m-%d %H:%M:%S')
-                    csd_date=lcsd.strftime('%Y-%m-%d')
-                    if csd_date == old_csd_date:
-                        daytotal+=energy
-                    else:
-                        daytotal=energy
-                    old_csd_date = csd_date
-                    sValt='-1;' + str(energy)   + ';' + csd_time
-                    sVald='-1;' + str(daytotal) + ';' + csd_date
-                    Devices[self._unit_index].Update(nValue=0,sValue=sValt)
-                    Devices[self._unit_index].Update(nValue=0,sValue=sVald)
+                state = self._watermark()
+                today = datetime.datetime.now().strftime('%Y-%m-%d')
+                if state.get('zero') != today:
+                    _writer.history(self._unit_index, 0, '-1;0;' + today + ' 00:00:00')  # register a zero point at 00:00
+                    state['zero'] = today
+                    self._state_file.save(state)
+                self.ingest(vehicle_status.charges)
                 self.did_update()
 
 
 class ChargeRenaultSwitch(RenaultDomoticzDevice):
     """The Domoticz device that enables charges"""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_SWITCH_INDEX)
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_SWITCH_INDEX, car, label)
+        self._previous: Optional[int] = None # the state before the presses of the command
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='ChargeNowWhenAtHome', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('ChargeNowWhenAtHome'), Unit=self._unit_index,
                             Type=244, Subtype=73, Switchtype=0, # Switch on/off
                             Description="Toggle between Scheduled and Always charging in case at Home and Plugged in",
                             Used=1
@@ -599,29 +2482,36 @@ class ChargeRenaultSwitch(RenaultDomoticzDevice):
         """Process a command for this device and update the device in Domoticz."""
         if self.exists():
             if Command == "On":
-                Devices[self._unit_index].Update(nValue=1,sValue="")
+                self.write(1, "")
                 return Action.CHARGE_ALWAYS
             if Command == "Off":
-                Devices[self._unit_index].Update(nValue=0,sValue="")
-                plugged_in = True if Devices[UNIT_STATUS_INDEX].nValue else False # TODO: decide what to do with level 4 Error
-                dst_from_home =  Devices[UNIT_SEPARATION_INDEX].sValue
-                if plugged_in and float(dst_from_home) < 0.05:  # less than 50m is Home ??
-                    return Action.CHARGE_SCHEDULED
-                else:
-                    return Action.CHARGE_ALWAYS
+                self.write(0, "")
+                plugged_in = True if _writer.read(self._offset + UNIT_STATUS_INDEX)[0] else False # TODO: decide what to do with level 4 Error
+                return self.zone_charge() if plugged_in else Action.CHARGE_ALWAYS
             return Action.NO_ACTION
 
+    def command_start(self) -> None:
+        """Remember the state before the presses of a debounce window, a failed command goes back to it."""
+        if self.exists():
+            self._previous = _writer.read(self._unit_index)[0]
+
+    def command_done(self, action: Action, outcome: Outcome) -> None:
+        """Put the switch back when the car did not take the new charge mode."""
+        if outcome in (Outcome.REJECTED, Outcome.TIMED_OUT) and self._previous is not None and self.exists():
+            self.write(self._previous, "")
+        self._previous = None
+
 
 class RefreshRenaultSwitch(RenaultDomoticzDevice):
     """The Domoticz device that refreshes readings"""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_REFRESH_INDEX)
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_REFRESH_INDEX, car, label)
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='RefreshNow', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('RefreshNow'), Unit=self._unit_index,
                             Type=244, Subtype=73, Switchtype=9, # PushOn
                             Description="Refresh car readings now",
                             Used=1
@@ -631,21 +2521,46 @@ class RefreshRenaultSwitch(RenaultDomoticzDevice):
         """Process a command for this device and update the device in Domoticz."""
         if self.exists():
             if Command == "On":
-                Devices[self._unit_index].Update(nValue=1,sValue="")
-                Devices[self._unit_index].Update(nValue=0,sValue="")
+                self.write(0, "", force=True) # one write so the log knows when it was used
                 return Action.NO_ACTION
 
 
+class BackfillRenaultSwitch(RenaultDomoticzDevice):
+    """The Domoticz device that imports the charge history of the past"""
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_BACKFILL_INDEX, car, label)
+
+    def create(self) -> None:
+        """Check if the device is present in Domoticz, and otherwise create it."""
+        if not self.exists():
+            Domoticz.Device(Name=self.name('BackfillCharges'), Unit=self._unit_index,
+                            Type=244, Subtype=73, Switchtype=9, # PushOn
+                            Description="Import the charges of the past into the Charge counter",
+                            Used=1
+                            ).Create()
+
+    def onCommand(self, Command, Level, Color) -> Action: # return: which action to apply
+        """Process a command for this device and update the device in Domoticz."""
+        if self.exists():
+            if Command == "On":
+                self.write(0, "", force=True)
+                return Action.BACKFILL
+            return Action.NO_ACTION
+
+
 class AircoRenaultSwitch(RenaultDomoticzDevice):
     """The Domoticz device that refreshes readings"""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_AIRCO_INDEX)
+    READS = ('hvac_status',)
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_AIRCO_INDEX, car, label)
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='Airco/Heater', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('Airco/Heater'), Unit=self._unit_index,
                             Type=244, Subtype=73, Switchtype=0, # Switch on/off
                             Description="Switch the Airco/Heater on or off",
                             Used=1
@@ -653,12 +2568,12 @@ class AircoRenaultSwitch(RenaultDomoticzDevice):
 
     def update(self, vehicle_status) -> Action:
         """Determine the actual value of the instrument and update the device in Domoticz."""
-        if vehicle_status:
+        if vehicle_status and vehicle_status.has('hvac_status'):
             if self.exists():
-                if vehicle_status[4].hvacStatus == Action.AC_ON.api_res():
-                    Devices[self._unit_index].Update(nValue=1,sValue="")
+                if vehicle_status.hvac_status == Action.AC_ON.api_res():
+                    self.write(1, "")
                 else:
-                    Devices[self._unit_index].Update(nValue=0,sValue="")
+                    self.write(0, "")
 
     def onCommand(self, Command, Level, Color) -> Action: # return: which action to apply
         """Process a command for this device and update the device in Domoticz."""
@@ -673,13 +2588,15 @@ class AircoRenaultSwitch(RenaultDomoticzDevice):
 class ChargeRenaultStatus(RenaultDomoticzDevice):
     """The Domoticz device that shows three charging statuses"""
 
-    def __init__(self) -> None:
-        super().__init__(UNIT_STATUS_INDEX)
+    READS = ('charge_mode', 'plug_status', 'charging_status', 'latitude', 'longitude')
+
+    def __init__(self, car: int = 0, label: str = '') -> None:
+        super().__init__(UNIT_STATUS_INDEX, car, label)
 
     def create(self) -> None:
         """Check if the device is present in Domoticz, and otherwise create it."""
         if not self.exists():
-            Domoticz.Device(Name='chargingStatus', Unit=self._unit_index,
+            Domoticz.Device(Name=self.name('chargingStatus'), Unit=self._unit_index,
                             Type=243, Subtype=22, # Alert
                             Used=1
                             ).Create()
@@ -701,11 +2618,11 @@ class ChargeRenaultStatus(RenaultDomoticzDevice):
                  -1:" - PlugError - ",
         -2147483648:" - PlugUnknown - "
                }
-        if vehicle_status:
+        if vehicle_status and vehicle_status.has('charge_mode') and vehicle_status.has('battery_status'):
             if self.exists():
-                chargeMode = vehicle_status[1].chargeMode
-                plugstatus=vehicle_status[2].plugStatus
-                state = vehicle_status[2].chargingStatus
+                chargeMode = vehicle_status.charge_mode
+                plugstatus=vehicle_status.plug_status
+                state = vehicle_status.charging_status
                 text = chargeMode
                 text+=plugs[plugstatus]
                 if state in states:
@@ -722,19 +2639,70 @@ class ChargeRenaultStatus(RenaultDomoticzDevice):
                             level = 1
                         else:
                             level = 2
-                Devices[self._unit_index].Update(nValue=level, sValue=text)
+                self.write(level, text)
+                return self.next_action(vehicle_status)
+
+    def next_action(self, vehicle_status) -> Action:
+        """Return the charge mode that the switch and the zone ask for, when the car has another one."""
+        if vehicle_status and vehicle_status.has('charge_mode') and vehicle_status.has('battery_status'):
+            if self.exists():
+                chargeMode = vehicle_status.charge_mode
                 action = Action.CHARGE_ALWAYS
-                if plugstatus == 1:
-                    dst_from_home = Devices[UNIT_SEPARATION_INDEX].sValue
-                    if float(dst_from_home) < 0.05:
-                        if Devices[UNIT_SWITCH_INDEX].nValue == 0:
-                            action = Action.CHARGE_SCHEDULED
+                if vehicle_status.plug_status == 1 and _writer.read(self._offset + UNIT_SWITCH_INDEX)[0] == 0:
+                    action = self.zone_charge()
                 Domoticz.Debug(chargeMode)
                 Domoticz.Debug(action.api_res())
                 if chargeMode == action.api_res():
                     return Action.NO_ACTION
                 else:
                     return action
+        return Action.NO_ACTION
+
+
+class MetricDevice(DomoticzDevice):
+    """A Custom Sensor that shows one of the metrics of the plugin."""
+
+    def __init__(self, unit_index: int, name: str, units: str, value: Callable[[], float]) -> None:
+        super().__init__(unit_index)
+        self._name = name
+        self._units = units
+        self._value = value
+
+    def create(self) -> None:
+        """Check if the device is present in Domoticz, and otherwise create it."""
+        if not self.exists():
+            Domoticz.Device(Name=self._name, Unit=self._unit_index,
+                            TypeName='Custom Sensor', Type=243, Subtype=31,
+                            Options={'Custom': '1;' + self._units},
+                            Used=1,
+                            Description='Performance metric of the plugin'
+                            ).Create()
+
+    def update(self) -> None:
+        """Show the actual value of the metric."""
+        if self.exists():
+            self.write(0, f'{self._value():g}')
+
+
+class BreakerDevice(DomoticzDevice):
+    """The Text device that shows the state of the circuit breaker around the Renault servers."""
+
+    def __init__(self) -> None:
+        super().__init__(UNIT_BREAKER_INDEX)
+
+    def create(self) -> None:
+        """Check if the device is present in Domoticz, and otherwise create it."""
+        if not self.exists():
+            Domoticz.Device(Name='Renault servers', Unit=self._unit_index,
+                            TypeName='Text', Type=243, Subtype=19,
+                            Used=1,
+                            Description='Circuit breaker: closed, open while the servers are down, half-open on a probe'
+                            ).Create()
+
+    def update(self) -> None:
+        """Show the actual state of the breaker."""
+        if self.exists():
+            self.write(0, _breaker.describe())
 
 
 class RenaultPlugin(ReducedHeartBeat, MyRenaultConnector):
@@ -743,49 +2711,422 @@ class RenaultPlugin(ReducedHeartBeat, MyRenaultConnector):
     def __init__(self) -> None:
         super().__init__()
         self._devices: List[RenaultDomoticzDevice] = []
-
-    def add_devices(self) -> None:
-        """Add all the device classes that are part of this plugin."""
-        self._devices += [SeparationRenaultDevice()]
-        self._devices += [DistanceRenaultDevice()]
-        self._devices += [FuelRenaultDevice()]
-        self._devices += [ChargeRenaultDevice()]
-        self._devices += [ChargeRenaultSwitch()]
-        self._devices += [RefreshRenaultSwitch()]
-        self._devices += [AircoRenaultSwitch()]
-        self._devices += [ChargeRenaultStatus()]
+        self._metric_devices: List[DomoticzDevice] = []
+        self._cars_added = 0 # the number of cars that have their devices
+        self._pending: Optional[concurrent.futures.Future] = None
+        self._turn = 0
+        self._jobs: deque = deque() # (unit, actions per car) waiting for the worker, unit None is a poll
+        self._job: Tuple[Optional[int], Dict[int, Action]] = (None, {})
+        self._last_pass = datetime.datetime.now()
+        self._issued: Dict[Tuple[int, Action], int] = {} # (car, command): the unit that asked for it
+        self._debouncer = CommandDebouncer()
+        self._tracks: Dict[int, TrackLog] = {}
+        self._solar_reading: Optional[concurrent.futures.Future] = None
+        self._snapshot_state = StateFile('renault_snapshot.json')
+        self._solar_next = 0.0
+        self._fast = False # heartbeat shortened while commands are held or a job runs
+        self._backfill: Optional[concurrent.futures.Future] = None
+        self._backfill_car = 0
+        self._backfill_waiting: deque = deque() # cars whose backfill waits for the running one
+        self._backfill_results: queue.Queue = queue.Queue()
+        self._backfill_totals: Dict[str, int] = {}
+
+    def add_devices(self, car: int = 0, label: str = '') -> None:
+        """Add all the device classes that are part of this plugin, for one car."""
+        self._devices += [SeparationRenaultDevice(car, label)]
+        self._devices += [DistanceRenaultDevice(car, label)]
+        self._devices += [FuelRenaultDevice(car, label)]
+        self._devices += [ChargeRenaultDevice(car, label)]
+        self._devices += [ChargeRenaultSwitch(car, label)]
+        self._devices += [RefreshRenaultSwitch(car, label)]
+        self._devices += [AircoRenaultSwitch(car, label)]
+        self._devices += [BackfillRenaultSwitch(car, label)]
+        self._devices += [ChargeRenaultStatus(car, label)]
+        self._devices += [ZoneRenaultDevice(car, label)]
+        self._cars_added = max(self._cars_added, car + 1)
+
+    def add_metric_devices(self) -> None:
+        """Add the metric devices when the metrics_devices option asks for them."""
+        if get_option('metrics_devices', 0):
+            self._metric_devices = [
+                MetricDevice(UNIT_METRIC_CYCLE, 'Cycle latency', 's', lambda: round(_metrics.last_cycle, 2)),
+                MetricDevice(UNIT_METRIC_CALLS, 'API calls today', 'calls', lambda: _metrics.today('api_calls')),
+                MetricDevice(UNIT_METRIC_LOGINS, 'Logins today', 'logins', lambda: _metrics.today('logins')),
+                MetricDevice(UNIT_METRIC_QUOTA, 'Quota errors today', 'errors', lambda: _metrics.today('quota_errors')),
+                BreakerDevice()]
 
     def create_devices(self) -> None:
         """Create the appropiate devices in Domoticz for the vehicle."""
-        for device in self._devices:
+        for device in self._devices + self._metric_devices:
             device.create()
 
-    def update_devices(self, action: Action = Action.NO_ACTION) -> None:
-        """Retrieve the status of the vehicle and update the Domoticz devices."""
+    def publish_metrics(self) -> None:
+        """Show the metrics and the breaker state on their devices and write the Prometheus textfile if asked for."""
+        for device in self._metric_devices:
+            device.update()
+        path = get_option('metrics_file', '')
+        if path:
+            _metrics.write(path)
+
+    def fetch_plan(self) -> Dict[int, frozenset]:
+        """Return per car the endpoints that the used devices and the scheduler read, each once."""
+        fields: Dict[int, set] = {}
+        for device in self._devices:
+            reads = fields.setdefault(device.car, self._scheduler.reads(self._snapshots.get(device.car)))
+            if device.used():
+                reads.update(device.READS)
+        return {car: VehicleSnapshot.endpoints_for(reads) for car, reads in fields.items()}
+
+    def _add_cars(self) -> None:
+        """Add and create the devices of the cars found at logon that have none yet."""
+        for car in range(self._cars_added, self.car_count()):
+            Domoticz.Status(f'Adding the devices of {self.car_label(car)}')
+            self.add_devices(car, self.car_label(car))
+            self.create_devices()
+            self.start_backfill(car, first_start=True)
+
+    def track(self, car: int = 0) -> TrackLog:
+        """Return the track log of a car, query it for trips and parking history."""
+        if car not in self._tracks:
+            self._tracks[car] = TrackLog(car)
+        return self._tracks[car]
+
+    def _car_of(self, unit: int) -> int:
+        """Return the car number of a device unit."""
+        return (unit - 1) // UNIT_BLOCK
+
+    def apply_status(self, statuses: Dict[int, Any]) -> Dict[int, Action]:
+        """Update the Domoticz devices with the vehicle statuses and return the next action per car they ask for."""
+        now = datetime.datetime.now()
+        self._scheduler.update(statuses, now)
+        self._add_cars()
+        next_actions: Dict[int, Action] = {}
+        received = {car: status for car, status in statuses.items() if status}
+        if received and not any(status.changed for status in received.values()) and \
+           (now - self._last_pass).total_seconds() < 6 * 3600:
+            Domoticz.Log('No new data from the car')
+            for device in self._devices: # the devices stay as they are, the switch may not
+                if device.car in received:
+                    action = device.next_action(received[device.car])
+                    if action:
+                        next_actions[device.car] = next_actions.get(device.car, Action.NO_ACTION) | action
+            return next_actions
+        if received:
+            self._last_pass = now
+            start = time.monotonic()
+            for car, status in received.items():
+                if status.has('location'):
+                    _geofence.locate(car, status.latitude, status.longitude)
+                    self.track(car).add(utc_stamp(status.gps_time), status.latitude, status.longitude)
+            for device in self._devices:
+                if device.car not in received:
+                    continue
+                try:
+                    action = device.update(received[device.car])
+                except TypeError: # allows update to not return action explicitly
+                    action = None
+                if action:
+                    next_actions[device.car] = next_actions.get(device.car, Action.NO_ACTION) | action
+            _writer.flush()
+            _metrics.observe('device_update_seconds', time.monotonic() - start)
+            Domoticz.Status(str(next_actions))
+            self.save_snapshots()
+        return next_actions
+
+    def save_snapshots(self) -> None:
+        """Keep the last snapshot of each car on disk, the next start shows them before its first fetch."""
+        if self.car_count():
+            self._snapshot_state.save({'username': Parameters['Username'], 'cars': Parameters['Mode1'],
+                                       'snapshots': [{'label': self.car_label(car),
+                                                      'extracts': self._snapshots[car].extracts()
+                                                                  if car in self._snapshots else {}}
+                                                     for car in range(self.car_count())]})
+
+    def restore(self) -> None:
+        """Show the snapshots that the last run saved right away, the live status follows in the background."""
+        stored = self._snapshot_state.load()
+        if stored.get('username') != Parameters['Username'] or stored.get('cars') != Parameters['Mode1']:
+            return
+        statuses: Dict[int, Any] = {}
+        try:
+            for car, saved in enumerate(stored.get('snapshots', [])):
+                if car >= self._cars_added:
+                    self.add_devices(car, saved['label'])
+                if saved['extracts']:
+                    statuses[car] = VehicleSnapshot.from_json(saved['extracts'])
+                    statuses[car].changed = statuses[car].diff(None)
+        except (KeyError, TypeError, ValueError) as ex:
+            Domoticz.Error(f'The saved snapshot could not be restored: {ex!r}')
+            return
+        self.create_devices()
+        Domoticz.Status(f'Restored the saved status of {len(statuses)} car(s), the live status follows')
+        self.apply_status(statuses) # the commands it asks for wait for the live status
+
+    def update_devices(self, actions: Optional[Dict[int, Action]] = None) -> None:
+        """Retrieve the status of the vehicles and update the Domoticz devices."""
         turn = 2 # how often engage_vehicle will be called maximum
-        next_action = action
+        next_actions = actions or {}
         while turn:
-            vehicle_status = self.engage_vehicle(next_action)
-            next_action = Action.NO_ACTION
-            if vehicle_status:
-                for device in self._devices:
-                    try:
-                        next_action = next_action | device.update(vehicle_status)
-                    except TypeError: # allows update to not return action explicitly
-                        pass
-                Domoticz.Status(next_action)
-                turn = turn - 1 if next_action else 0
+            self.plan_endpoints(self.fetch_plan())
+            statuses = self.engage_vehicle(next_actions)
+            next_actions = self.apply_status(statuses)
+            turn = turn - 1 if next_actions else 0
+        self.publish_metrics()
+        _writer.flush()
+
+    def queue_job(self, unit: Optional[int], action: Action) -> None:
+        """Queue an action for the worker, commands in order and before any waiting poll."""
+        if unit is None:
+            self._jobs.append((None, {}))
+        else:
+            car = self._car_of(unit)
+            job = (unit, {car: action or Action.NO_ACTION})
+            for part in ActionConfirmation.parts(action or Action.NO_ACTION):
+                self._issued[(car, part)] = unit
+            polls = [index for index, (queued, _) in enumerate(self._jobs) if queued is None]
+            self._jobs.insert(polls[0] if polls else len(self._jobs), job)
+        self._dispatch()
+
+    def debounce(self, unit: int, action: Action) -> None:
+        """Hold a command for the debounce window, a refresh joins a refresh that is held, running or queued."""
+        car = self._car_of(unit)
+        if not action and not self._debouncer.pending(car):
+            if self._refreshing(car):
+                Domoticz.Debug('Refresh joins the running refresh')
             else:
-                turn = 0
+                self.queue_job(unit, action)
+            return
+        self._debouncer.add(car, unit, action, time.monotonic())
+        self.release_commands()
+
+    def _refreshing(self, car: int) -> bool:
+        """Tell if a command job, which refreshes all endpoints of the car, is running or queued."""
+        jobs = list(self._jobs) + ([self._job] if self._pending is not None else [])
+        return any(unit is not None and car in actions for unit, actions in jobs)
+
+    def release_commands(self) -> None:
+        """Queue the held commands whose debounce window has passed."""
+        for car, unit, action, units in self._debouncer.release(time.monotonic()):
+            self.queue_job(unit, action)
+            self._issued.update({(car, part): part_unit for part, part_unit in units.items()})
+
+    def _pace(self) -> None:
+        """Beat every second while commands are held or a job runs, instead of every 10 seconds."""
+        fast = self._debouncer.pending() or self._pending is not None
+        if fast != self._fast:
+            self._fast = fast
+            Domoticz.Heartbeat(1 if fast else 10)
+
+    def _job_priority(self) -> int:
+        return PRIORITY_POLL if self._job[0] is None else PRIORITY_COMMAND
+
+    def _dispatch(self) -> None:
+        """Start the next queued job when the worker is idle."""
+        if self._pending is None and self._jobs:
+            self._job = self._jobs.popleft()
+            self._turn = 2 # how often engage_vehicle will be called maximum
+            self.plan_endpoints(self.fetch_plan())
+            self._pending = self.submit_vehicle(self._job[1], self._job_priority())
+
+    def idle(self) -> bool:
+        """Tell if no command is held, no job is running or waiting and no command waits for its confirmation."""
+        return (not self._debouncer.pending() and self._pending is None and not self._jobs
+                and not self._confirming and self.outcomes.empty())
+
+    def poll_devices(self) -> bool:
+        """Retrieve the status of the vehicles in the background, collect_devices picks up the result."""
+        if self._pending is not None or self._jobs: # a running or queued job refreshes anyway
+            return False
+        self.queue_job(None, Action.NO_ACTION)
+        return True
+
+    def collect_devices(self) -> None:
+        """Update the Domoticz devices once a background job has finished."""
+        if self._pending is None or not self._pending.done():
+            return
+        try:
+            statuses = self._pending.result()
+        except Exception as ex: # the worker must never take the plugin down
+            Domoticz.Error(f'Vehicle status could not be retrieved: {ex}')
+            statuses = {}
+        self._pending = None
+        unit, actions = self._job
+        if unit is not None and self._turn == 2 and actions[self._car_of(unit)]:
+            self._scheduler.follow_up(datetime.datetime.now())
+        next_actions = self.apply_status(statuses)
+        self._turn -= 1
+        self.publish_metrics()
+        _writer.flush()
+        if next_actions and self._turn:
+            self._pending = self.submit_vehicle(next_actions, self._job_priority())
+        else:
+            self._dispatch()
+
+    def collect_outcomes(self) -> None:
+        """Tell the devices how the commands they asked for ended."""
+        done = False
+        while True:
+            try:
+                confirmation = self.outcomes.get_nowait()
+            except queue.Empty:
+                break
+            done = True
+            action, outcome = confirmation.action, confirmation.outcome
+            if outcome == Outcome.CONFIRMED:
+                Domoticz.Status(f'Command {action.name} confirmed after {confirmation.polls} polls')
+                self.poll_devices() # show it, from the cache that the confirmation refreshed
+            else:
+                Domoticz.Error(f'Command {action.name} {outcome.name.lower()}')
+            unit = self._issued.pop((confirmation.car, action), None)
+            for device in self._devices:
+                if device._unit_index == unit:
+                    device.command_done(action, outcome)
+        if done: # a switch put back by command_done shows at once, not with the next poll
+            _writer.flush()
+
+    def sample_solar(self) -> None:
+        """Read the solar meter in the background every solar_interval seconds, collect_solar takes the reading."""
+        if not _solar.enabled() or self._solar_reading is not None or time.monotonic() < self._solar_next:
+            return
+        self._solar_next = time.monotonic() + get_option('solar_interval', 60)
+        self._solar_reading = self._worker.submit(self._read_solar())
+
+    async def _read_solar(self) -> float:
+        return await _solar.read(await self._worker.websession())
+
+    def collect_solar(self) -> None:
+        """Give the solar controller its reading, the devices decide again when the decision changed."""
+        if self._solar_reading is None or not self._solar_reading.done():
+            return
+        try:
+            surplus: Optional[float] = self._solar_reading.result()
+        except Exception as ex: # a missing meter must not stop the plugin
+            Domoticz.Error(f'Solar meter could not be read: {ex!r}')
+            surplus = None
+        self._solar_reading = None
+        if surplus is not None and _solar.add(time.monotonic(), surplus):
+            self._last_pass = datetime.datetime.min # pass the devices also when the car reports nothing new
+            self.poll_devices()
+
+    def start_backfills(self) -> None:
+        """Start the first backfill of the cars that have their devices, cars found later start theirs when added."""
+        for car in range(max(self._cars_added, 1)):
+            self.start_backfill(car, first_start=True)
+
+    def _backfill_state(self, car: int) -> StateFile:
+        return StateFile(car_file('renault_backfill.json', car))
+
+    @staticmethod
+    def _backfill_date(key: str, default: datetime.date) -> datetime.date:
+        """Return a date option of the backfill (YYYY-MM-DD), default when it is not set or not a date."""
+        value = get_option(key, '')
+        try:
+            return datetime.date.fromisoformat(value) if value else default
+        except ValueError:
+            Domoticz.Error(f'Option {key} is not a date: {value}')
+            return default
+
+    def start_backfill(self, car: int = 0, first_start: bool = False) -> None:
+        """Import the charge history of the past, resuming an interrupted import from its checkpoint."""
+        if self._backfill is not None and self._backfill.done():
+            self.collect_backfill() # it ended since the last heartbeat
+        if self._backfill is not None:
+            if car != self._backfill_car and car not in self._backfill_waiting:
+                self._backfill_waiting.append(car) # one car at a time, the quota is shared
+            else:
+                Domoticz.Log('Backfill is already running')
+            return
+        checkpoint = self._backfill_state(car).load()
+        if first_start and checkpoint.get('done'):
+            return self._next_backfill() # only once by itself, afterwards on request
+        today = datetime.date.today()
+        if checkpoint.get('next') and not checkpoint.get('done'):
+            first = datetime.date.fromisoformat(checkpoint['next'])
+            self._backfill_totals = checkpoint.get('totals', {})
+        else:
+            first = self._backfill_date('backfill_from', today - datetime.timedelta(days=get_option('backfill_days', 365)))
+            self._backfill_totals = {}
+        yesterday = today - datetime.timedelta(days=1) # today is for the regular polls
+        last = min(self._backfill_date('backfill_to', yesterday), yesterday)
+        if first > last:
+            return self._next_backfill()
+        self._backfill_state(car).save({'next': first.isoformat(), 'totals': self._backfill_totals})
+        Domoticz.Status(f'Backfill of charges from {first} to {last}')
+        self._backfill_car = car
+        self._backfill = self.submit_backfill(car, first, last, self._backfill_results)
+
+    def _next_backfill(self) -> None:
+        """Start the backfill of the next waiting car."""
+        if self._backfill is None and self._backfill_waiting:
+            self.start_backfill(self._backfill_waiting.popleft())
+
+    def collect_backfill(self) -> None:
+        """Write the windows that the backfill fetched so far, and checkpoint after each."""
+        while True:
+            try:
+                car, first, last, charges = self._backfill_results.get_nowait()
+            except queue.Empty:
+                break
+            if charges is None:
+                self._backfill = None
+                self._backfill_state(car).save({'done': datetime.date.today().isoformat()})
+                Domoticz.Status('Backfill of charges done')
+                self._next_backfill()
+                continue
+            charge_device = next((device for device in self._devices
+                                  if isinstance(device, ChargeRenaultDevice) and device.car == car), None)
+            if charge_device and charge_device.exists():
+                written = charge_device.backfill(charges, self._backfill_totals)
+                Domoticz.Log(f'Backfill {first} - {last}: {len(charges)} charges, {written} points')
+            self._backfill_state(car).save({'next': (last + datetime.timedelta(days=1)).isoformat(),
+                                            'totals': self._backfill_totals})
+        if self._backfill is not None and self._backfill.done() and \
+           not self._backfill.cancelled() and self._backfill.exception() is not None:
+            Domoticz.Error(f'Backfill of charges stopped: {self._backfill.exception()}, '
+                           f'press BackfillCharges to resume') # from the checkpoint of the last window
+            self._backfill = None
+            self._backfill_car = 0
+            self._next_backfill()
+
+    def disconnect(self) -> None:
+        """Stop a running backfill, its checkpoint lets it resume, and disconnect."""
+        if self._backfill is not None:
+            self._backfill.cancel()
+            self._backfill = None
+        self._backfill_waiting.clear()
+        self._debouncer.clear()
+        if self._solar_reading is not None:
+            self._solar_reading.cancel()
+            self._solar_reading = None
+        super().disconnect()
+
+    def onHeartbeat(self) -> None:
+        """Callback from Domoticz that the plugin can perform some work."""
+        self.collect_devices()
+        self.collect_outcomes()
+        self.collect_backfill()
+        self.release_commands()
+        self.collect_solar()
+        self.sample_solar()
+        super().onHeartbeat()
+        self._pace()
 
     def onCommand(self, Unit, Command, Level, Color) -> None:
         """Process the command"""
         for device in self._devices:
             if Unit == device._unit_index:
-                self.update_devices(device.onCommand(Command, Level, Color))
+                if not self._debouncer.pending(device.car) and Unit not in self._issued.values():
+                    device.command_start() # the first press of a new command
+                action = device.onCommand(Command, Level, Color) or Action.NO_ACTION
+                if Action.BACKFILL in action:
+                    self.start_backfill(device.car)
+                else:
+                    self.debounce(Unit, action)
+        self._pace()
+        _writer.flush()
 
 
-_plugin = RenaultPlugin() if 'renault_api' in sys.modules else None
+_plugin = RenaultPlugin() if RENAULT_API_FOUND else None
 
 def onStart() -> None:
     """Callback from Domoticz that the plugin is started."""
@@ -804,9 +3145,13 @@ def onStart() -> None:
                 Domoticz.Error(err)
         elif _plugin:
             Domoticz.Debug('onStart start')
+            _geofence.load()
             _plugin.add_devices()
+            _plugin.add_metric_devices()
             _plugin.create_devices()
-            _plugin.update_devices()
+            _plugin.restore()
+            _plugin.poll_devices() # the first live status, without blocking the start of Domoticz
+            _plugin.start_backfills()
 
 def onStop() -> None:
     """Callback from Domoticz that the plugin is stopped."""
@@ -0,0 +1,27 @@
+"""Run plugin.py with the Domoticz stand-in of tools/Domoticz.py, each test with fresh devices."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'tools'), ROOT] # the Domoticz stand-in and plugin.py
+
+import Domoticz  # noqa: E402 the stand-in
+import plugin    # noqa: E402
+
+
+@pytest.fixture
+def renault(tmp_path):
+    """A RenaultPlugin with the devices of one car created, and nothing written yet."""
+    Domoticz.Parameters['HomeFolder'] = str(tmp_path) + os.sep
+    Domoticz.Parameters['Mode3'] = ''
+    Domoticz.Devices.clear()
+    Domoticz.log.clear()
+    plugin._writer._queue.clear()
+    renault_plugin = plugin.RenaultPlugin()
+    renault_plugin.add_devices()
+    renault_plugin.create_devices()
+    yield renault_plugin
+    renault_plugin.disconnect()
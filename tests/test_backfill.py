@@ -0,0 +1,77 @@
+"""The backfill of the charge history at the start of the plugin."""
+
+import asyncio
+import concurrent.futures
+import datetime
+import queue
+
+import pytest
+
+import Domoticz
+import plugin
+
+
+def started(renault, monkeypatch):
+    """Start the backfill of onStart and return the windows submitted to the worker for it."""
+    windows = []
+
+    def submit(coroutine):
+        windows.append((coroutine.cr_frame.f_locals['first'], coroutine.cr_frame.f_locals['last']))
+        coroutine.close()
+        return concurrent.futures.Future()
+    monkeypatch.setattr(renault._worker, 'submit', submit)
+    renault.start_backfill(first_start=True)
+    return windows
+
+
+def test_first_start_imports_history(renault, monkeypatch):
+    days = plugin.get_option('backfill_days', 365)
+    assert started(renault, monkeypatch) == [(datetime.date.today() - datetime.timedelta(days=days),
+                                              datetime.date.today() - datetime.timedelta(days=1))]
+
+
+def test_interrupted_backfill_resumes_from_checkpoint(renault, monkeypatch):
+    resume = datetime.date.today() - datetime.timedelta(days=30)
+    renault._backfill_state(0).save({'next': resume.isoformat(), 'totals': {}})
+    assert started(renault, monkeypatch) == [(resume, datetime.date.today() - datetime.timedelta(days=1))]
+
+
+def test_backfill_range_options(renault, monkeypatch):
+    Domoticz.Parameters['Mode3'] = 'backfill_from=2024-01-01;backfill_to=2024-01-31'
+    assert started(renault, monkeypatch) == [(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))]
+
+
+def test_failing_window_gives_up_with_backoff(renault, monkeypatch):
+    delays = []
+
+    async def postponed(car, first, last):
+        return None
+
+    async def sleep(delay):
+        delays.append(delay)
+    monkeypatch.setattr(renault, '_backfill_window', postponed)
+    monkeypatch.setattr(plugin.asyncio, 'sleep', sleep)
+    results = queue.Queue()
+    day = datetime.date(2024, 1, 1)
+    with pytest.raises(plugin.BackfillException):
+        asyncio.run(renault._backfill_charges(0, day, day, results))
+    assert delays == [60, 120, 240, 480, 960, 1920, 3600] and results.empty()
+
+
+def test_failed_backfill_lets_the_next_car_start(renault, monkeypatch):
+    failed = concurrent.futures.Future()
+    submitted = []
+    monkeypatch.setattr(renault, 'submit_backfill', lambda car, first, last, results: submitted.append(car) or
+                        (failed if car == 0 else concurrent.futures.Future()))
+    renault.start_backfill(0)
+    renault.start_backfill(1)
+    failed.set_exception(RuntimeError('worker stopped'))
+    renault.collect_backfill()
+    assert submitted == [0, 1] and renault._backfill_car == 1
+    assert 'next' in renault._backfill_state(0).load() # pressing BackfillCharges resumes
+    assert any('worker stopped' in message for level, message in Domoticz.log if level == 'Error')
+
+
+def test_finished_backfill_is_not_repeated(renault, monkeypatch):
+    renault._backfill_state(0).save({'done': datetime.date.today().isoformat()})
+    assert started(renault, monkeypatch) == []
@@ -0,0 +1,94 @@
+"""The circuit breaker around the Renault servers."""
+
+import asyncio
+import types
+
+import aiohttp
+import renault_api.credential
+import renault_api.exceptions
+import renault_api.gigya.exceptions
+import pytest
+
+import plugin
+
+
+@pytest.fixture
+def breaker(renault):
+    plugin.load_libraries() # the worker imports renault_api
+    return plugin.CircuitBreaker()
+
+
+def unauthorized():
+    return aiohttp.client_exceptions.ClientResponseError(None, (), status=401)
+
+
+@pytest.mark.parametrize('error', [renault_api.exceptions.NotAuthenticatedException('token expired'), unauthorized(),
+                                   renault_api.gigya.exceptions.GigyaResponseException(403005, 'token expired')])
+def test_expired_token_does_not_open(breaker, error):
+    breaker.failure(error)
+    breaker.failure(error)
+    assert breaker.state == plugin.BreakerState.CLOSED
+
+
+def test_failed_login_opens(breaker):
+    breaker.failure(renault_api.gigya.exceptions.InvalidCredentialsException(403042, 'invalid loginID or password'),
+                    login=True)
+    assert breaker.state == plugin.BreakerState.OPEN and breaker.reason == 'login'
+
+
+def test_connection_error_during_login_counts_as_connection(breaker):
+    breaker.failure(aiohttp.client_exceptions.ClientConnectionError(), login=True)
+    assert breaker.state == plugin.BreakerState.CLOSED
+
+
+def test_expired_login_logs_in_again(renault, breaker, monkeypatch):
+    logins, failures = [], []
+    expired = [renault_api.exceptions.NotAuthenticatedException('token expired')]
+
+    class Vehicle():
+        get_cockpit = get_charge_mode = get_location = get_hvac_status = get_charges = None # not in the plan
+
+        async def get_battery_status(self):
+            if expired:
+                raise expired.pop()
+            return types.SimpleNamespace(batteryLevel=80)
+
+    class Client():
+        def __init__(self, websession, locale, locale_details, credential_store):
+            self.session = self
+            self._store = credential_store
+
+        async def login(self, username, password):
+            logins.append(username)
+            self._store[plugin.GIGYA_LOGIN_TOKEN] = renault_api.credential.Credential('token')
+
+        async def get_api_account(self, account_id):
+            return self
+
+        async def get_api_vehicle(self, vin):
+            return Vehicle()
+
+    async def websession():
+        return None
+
+    monkeypatch.setattr(plugin, 'RenaultClient', Client)
+    monkeypatch.setattr(plugin, '_breaker', breaker)
+    monkeypatch.setattr(breaker, 'failure', lambda ex, login=False: failures.append(ex))
+    monkeypatch.setattr(renault._worker, 'websession', websession)
+    renault._cars = [types.SimpleNamespace(vehicleDetails=types.SimpleNamespace(vin='VF1TEST'))]
+    renault.plan_endpoints({0: frozenset({'battery_status'})})
+    snapshot = asyncio.run(renault._engage_vehicle(0, plugin.Action.NO_ACTION))
+    assert len(logins) == 2 and not failures
+    assert snapshot.has('battery_status') and breaker.state == plugin.BreakerState.CLOSED
+
+
+def test_breaker_device_only_with_metrics_devices(renault):
+    renault.add_metric_devices()
+    renault.create_devices()
+    assert plugin.UNIT_BREAKER_INDEX not in plugin.Domoticz.Devices
+    plugin.Domoticz.Parameters['Mode3'] = 'metrics_devices=1'
+    renault.add_metric_devices()
+    renault.create_devices()
+    renault.publish_metrics()
+    plugin._writer.flush()
+    assert plugin.Domoticz.Devices[plugin.UNIT_BREAKER_INDEX].sValue == 'closed'
@@ -0,0 +1,85 @@
+"""The endpoint cache: time to live per endpoint, and what the car reported since the last fetch."""
+
+import types
+
+import pytest
+
+import plugin
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """The monotonic time of the plugin, moved by the test."""
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(plugin, 'time', types.SimpleNamespace(monotonic=lambda: clock.now, time=lambda: clock.now))
+    return clock
+
+
+def result(charging=0.0, hvac='off', stamp='2024-01-01T12:00:00Z'):
+    return types.SimpleNamespace(chargingStatus=charging, hvacStatus=hvac, timestamp=stamp, lastUpdateTime=stamp,
+                                 raw_data={})
+
+
+def filled(charging=0.0):
+    cache = plugin.EndpointCache()
+    for name in cache.stale():
+        cache.store(name, result(charging))
+    return cache
+
+
+def test_entries_are_fresh_up_to_their_ttl(renault, clock):
+    cache = filled()
+    clock.now += 300
+    assert cache.stale() == []
+    clock.now += 1
+    assert cache.stale() == ['battery_status', 'location', 'hvac_status']
+    clock.now += 1800
+    assert cache.stale() == list(plugin.ENDPOINTS)
+
+
+def test_charging_shortens_the_ttl(renault, clock):
+    cache = filled(charging=1.0)
+    clock.now += 60
+    assert cache.stale() == []
+    clock.now += 1
+    assert cache.stale() == ['battery_status', 'hvac_status']
+    clock.now += 240
+    assert cache.stale() == ['battery_status', 'location', 'hvac_status', 'charges']
+
+
+def test_ttl_follows_the_last_stored_status(renault, clock):
+    cache = filled(charging=1.0)
+    clock.now += 61
+    assert cache.stale(('battery_status', 'hvac_status')) == ['battery_status', 'hvac_status']
+    cache.store('battery_status', result(charging=0.0)) # charging ended, back to the long ttl
+    assert cache.stale(('battery_status', 'hvac_status')) == []
+    clock.now += 240
+    assert cache.stale(('battery_status', 'hvac_status')) == ['hvac_status']
+
+
+def test_invalidated_endpoint_is_fetched_again(renault, clock):
+    cache = filled()
+    cache.invalidate('charge_mode')
+    assert cache.stale() == ['charge_mode']
+
+
+def test_unchanged_server_timestamp_is_nothing_new(renault, clock):
+    previous = filled().snapshot()
+    cache = filled()
+    cache.store('battery_status', types.SimpleNamespace(timestamp='2024-01-01T12:00:00Z', batteryLevel=80))
+    cache.store('location', types.SimpleNamespace(lastUpdateTime='2024-01-01T12:05:00Z', gpsLatitude=52.1))
+    assert cache.snapshot().diff(previous) == {'gps_time', 'latitude'}
+
+
+def test_hits_and_misses_are_counted(renault, clock):
+    cache = filled()
+    cache.stale()
+    assert cache.hit_ratio() == 0.5
+
+
+def test_cache_hit_ratio_is_exported(renault, clock):
+    cache = filled()
+    cache.stale()
+    text = plugin._metrics.prometheus()
+    assert 'renault_cache_lookups_total{result="hit"}' in text
+    assert 'renault_cache_hit_ratio ' in text
@@ -0,0 +1,80 @@
+"""The cars of the account that get devices, and how a failing car affects the others."""
+
+import asyncio
+import types
+
+import pytest
+import renault_api.exceptions
+import renault_api.kamereon.exceptions
+
+import Domoticz
+import plugin
+
+
+def vehicle(plate):
+    return types.SimpleNamespace(vehicleDetails=types.SimpleNamespace(registrationNumber=plate, vin='VF1' + plate))
+
+
+def test_cars_beyond_the_units_are_skipped(renault):
+    cars = [vehicle(f'AB-{index:03}-CD') for index in range(plugin.MAX_CARS + 2)]
+    kept = plugin.MyRenaultConnector._cap_cars(cars)
+    assert kept == cars[:plugin.MAX_CARS]
+    assert (plugin.MAX_CARS - 1) * plugin.UNIT_BLOCK + plugin.UNIT_BLOCK < plugin.UNIT_METRIC_CYCLE
+    errors = [message for level, message in Domoticz.log if level == 'Error']
+    assert len(errors) == 2 and 'AB-012-CD' in errors[0]
+
+
+class Vehicle():
+    """The endpoints of a car, the battery status answers with error when it is set."""
+    get_cockpit = get_charge_mode = get_location = get_hvac_status = get_charges = None # not in the plan
+
+    def __init__(self, vin, error=None):
+        self.vin = vin
+        self._error = error
+
+    async def get_battery_status(self):
+        if self._error:
+            raise self._error
+        return types.SimpleNamespace(batteryLevel=80)
+
+
+@pytest.fixture
+def connected(renault, monkeypatch):
+    """The plugin logged on with two cars, the second one answers with errors."""
+    plugin.load_libraries()
+    renault._cars = [vehicle('AB-001-CD'), vehicle('AB-002-CD')]
+    renault._logged_on = True
+    renault.plan_endpoints({0: frozenset({'battery_status'}), 1: frozenset({'battery_status'})})
+    errors = {}
+
+    async def client(websession, priority):
+        return account
+
+    async def get_api_account(account_id):
+        return account
+
+    async def get_api_vehicle(vin):
+        return Vehicle(vin, errors.get(vin))
+
+    async def websession():
+        return None
+    account = types.SimpleNamespace(get_api_account=get_api_account, get_api_vehicle=get_api_vehicle)
+    monkeypatch.setattr(renault._tokens, 'client', client)
+    monkeypatch.setattr(renault._worker, 'websession', websession)
+    return renault, errors
+
+
+def test_failing_car_keeps_the_login(connected):
+    renault, errors = connected
+    errors['VF1AB-002-CD'] = renault_api.kamereon.exceptions.KamereonResponseException('err.func.500', 'failed')
+    assert asyncio.run(renault._engage_vehicle(1, plugin.Action.NO_ACTION)) is None
+    assert renault._logged_on
+    assert asyncio.run(renault._engage_vehicle(0, plugin.Action.NO_ACTION)).battery_level == 80
+    assert set(renault.endpoint_times) == {(0, 'battery_status'), (1, 'battery_status')} # one per car
+
+
+def test_expired_login_ends_the_session(connected):
+    renault, errors = connected
+    errors['VF1AB-002-CD'] = renault_api.exceptions.NotAuthenticatedException('token expired')
+    assert asyncio.run(renault._engage_vehicle(1, plugin.Action.NO_ACTION)) is None
+    assert not renault._logged_on
@@ -0,0 +1,49 @@
+"""Recording the renault_api traffic on a cassette and replaying it."""
+
+import gzip
+
+import pytest
+import renault_api.kamereon.exceptions
+import renault_api.kamereon.schemas
+
+import Domoticz
+import plugin
+
+VIN = 'VF1AG000123456789'
+
+
+@pytest.fixture
+def recorded(renault):
+    """A cassette of one cycle: the cars, a battery status and a failed location."""
+    plugin.load_libraries()
+    schemas = renault_api.kamereon.schemas
+    Domoticz.Parameters['Mode3'] = 'cassette=record'
+    cassette = plugin.Cassette()
+    cassette.record('get_vehicles', '', schemas.KamereonVehiclesResponseSchema.load(
+        {'accountId': 'account-1', 'vehicleLinks': [{'vin': VIN, 'vehicleDetails': {
+            'vin': VIN, 'registrationNumber': 'AB-123-C'}}]}))
+    cassette.record('get_battery_status', VIN,
+                    schemas.KamereonVehicleBatteryStatusDataSchema.load({'batteryLevel': 80, 'plugStatus': 1}))
+    cassette.record('get_location', VIN,
+                    error=renault_api.kamereon.exceptions.FailedForwardException('err.tech.wired.kamereon-proxy', 'x'))
+    cassette.end_cycle()
+    Domoticz.Parameters['Mode3'] = 'cassette=replay'
+    return cassette.path()
+
+
+def test_identifiers_are_masked(recorded):
+    with gzip.open(recorded, 'rt', encoding='utf-8') as cassette:
+        text = cassette.read()
+    assert VIN not in text and 'AB-123-C' not in text and 'account-1' not in text
+
+
+def test_replay_gives_back_the_recorded_cycle(recorded):
+    cassette = plugin.Cassette()
+    assert cassette.next_cycle()
+    link, = cassette.replay('get_vehicles', '').vehicleLinks
+    masked = plugin.Cassette.pseudonym('vin', VIN)
+    assert link.vin == masked and link.vehicleDetails.vin == masked
+    assert cassette.replay('get_battery_status', masked).batteryLevel == 80
+    with pytest.raises(renault_api.kamereon.exceptions.FailedForwardException):
+        cassette.replay('get_location', masked)
+    assert not cassette.next_cycle() and cassette.exhausted
@@ -0,0 +1,26 @@
+"""The charge records written on the Charge counter history."""
+
+import Domoticz
+import plugin
+
+
+def points(count):
+    """Return the last count values written on the Charge counter."""
+    plugin._writer.flush()
+    return [value for _, _, value in Domoticz.Devices[plugin.UNIT_CHARGE_INDEX].history][-count:]
+
+
+def test_watermark_skips_ingested_records(renault):
+    charges = (('2024-03-01T10:00:00Z', 5000), ('2024-03-02T10:00:00Z', 3000))
+    device = plugin.ChargeRenaultDevice()
+    assert device.ingest(charges) == 4
+    assert device.ingest(charges) == 0
+    assert plugin.ChargeRenaultDevice().ingest(charges) == 0 # the watermark is kept on disk
+
+
+def test_growing_charge_replaces_its_day_total(renault):
+    device = plugin.ChargeRenaultDevice()
+    device.ingest((('2024-03-02T10:00:00Z', 3000),))
+    assert device.ingest((('2024-03-01T10:00:00Z', 5000), ('2024-03-02T10:00:00Z', 4000))) == 2 # before the mark is skipped
+    written = points(2)
+    assert written[0].startswith('-1;4000;2024-03-02 ') and written[1] == '-1;4000;2024-03-02'
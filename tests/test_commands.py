@@ -0,0 +1,56 @@
+"""How the switches show commands that the car confirms or not."""
+
+import concurrent.futures
+
+import pytest
+
+import Domoticz
+import plugin
+
+
+@pytest.fixture(autouse=True)
+def no_servers(renault, monkeypatch):
+    """Jobs go nowhere, the outcomes are handed in by the tests."""
+    monkeypatch.setattr(renault, 'submit_vehicle', lambda actions, priority: concurrent.futures.Future())
+
+
+def finish(renault, unit, action, outcome):
+    """Let a command of a unit end with an outcome, as the worker reports it."""
+    renault._issued[(0, action)] = unit
+    confirmation = plugin.ActionConfirmation(0, action, 0.0)
+    confirmation.outcome = outcome
+    renault.outcomes.put(confirmation)
+    renault.collect_outcomes()
+
+
+def test_timed_out_charge_mode_puts_switch_back(renault):
+    renault.onCommand(plugin.UNIT_SWITCH_INDEX, 'On', 0, '')
+    assert Domoticz.Devices[plugin.UNIT_SWITCH_INDEX].nValue == 1
+    finish(renault, plugin.UNIT_SWITCH_INDEX, plugin.Action.CHARGE_ALWAYS, plugin.Outcome.TIMED_OUT)
+    assert Domoticz.Devices[plugin.UNIT_SWITCH_INDEX].nValue == 0
+
+
+def test_confirmed_charge_mode_keeps_switch(renault):
+    renault.onCommand(plugin.UNIT_SWITCH_INDEX, 'On', 0, '')
+    renault._debouncer.clear()
+    finish(renault, plugin.UNIT_SWITCH_INDEX, plugin.Action.CHARGE_ALWAYS, plugin.Outcome.CONFIRMED)
+    assert Domoticz.Devices[plugin.UNIT_SWITCH_INDEX].nValue == 1
+
+
+def test_failed_gesture_goes_back_to_state_before_it(renault):
+    renault.onCommand(plugin.UNIT_SWITCH_INDEX, 'On', 0, '')
+    renault.onCommand(plugin.UNIT_SWITCH_INDEX, 'Off', 0, '') # within the debounce window
+    assert Domoticz.Devices[plugin.UNIT_SWITCH_INDEX].nValue == 0
+    renault._debouncer.clear()
+    finish(renault, plugin.UNIT_SWITCH_INDEX, plugin.Action.CHARGE_ALWAYS, plugin.Outcome.REJECTED)
+    assert Domoticz.Devices[plugin.UNIT_SWITCH_INDEX].nValue == 0
+
+
+def test_press_while_waiting_keeps_state_before_first_command(renault):
+    renault.onCommand(plugin.UNIT_SWITCH_INDEX, 'On', 0, '')
+    renault._debouncer.clear() # released, the car has not confirmed yet
+    renault._issued[(0, plugin.Action.CHARGE_ALWAYS)] = plugin.UNIT_SWITCH_INDEX
+    renault.onCommand(plugin.UNIT_SWITCH_INDEX, 'Off', 0, '')
+    renault._debouncer.clear()
+    finish(renault, plugin.UNIT_SWITCH_INDEX, plugin.Action.CHARGE_ALWAYS, plugin.Outcome.TIMED_OUT)
+    assert Domoticz.Devices[plugin.UNIT_SWITCH_INDEX].nValue == 0
@@ -0,0 +1,30 @@
+"""The debounce window that merges the switch commands of a car."""
+
+import plugin
+
+
+def test_opposite_command_cancels_the_held_one(renault):
+    debouncer = plugin.CommandDebouncer()
+    debouncer.add(0, plugin.UNIT_AIRCO_INDEX, plugin.Action.AC_ON, 100.0)
+    debouncer.add(0, plugin.UNIT_AIRCO_INDEX, plugin.Action.AC_OFF, 101.0)
+    assert debouncer.release(102.0) == [] # the window started again at the second press
+    assert debouncer.release(103.0) == [] and not debouncer.pending()
+
+
+def test_last_state_per_endpoint_is_sent_once(renault):
+    debouncer = plugin.CommandDebouncer()
+    airco, switch = plugin.UNIT_AIRCO_INDEX, plugin.UNIT_SWITCH_INDEX
+    for now, (unit, action) in enumerate(((airco, plugin.Action.AC_ON), (airco, plugin.Action.AC_OFF),
+                                          (airco, plugin.Action.AC_ON), (switch, plugin.Action.CHARGE_SCHEDULED))):
+        debouncer.add(0, unit, action, float(now))
+    (car, unit, action, units), = debouncer.release(10.0)
+    assert action == plugin.Action.AC_ON | plugin.Action.CHARGE_SCHEDULED
+    assert unit == switch and units == {plugin.Action.AC_ON: airco, plugin.Action.CHARGE_SCHEDULED: switch}
+
+
+def test_cancelled_command_keeps_a_refresh(renault):
+    debouncer = plugin.CommandDebouncer()
+    debouncer.add(0, plugin.UNIT_REFRESH_INDEX, plugin.Action.NO_ACTION, 0.0)
+    debouncer.add(0, plugin.UNIT_AIRCO_INDEX, plugin.Action.AC_ON, 0.5)
+    debouncer.add(0, plugin.UNIT_AIRCO_INDEX, plugin.Action.AC_OFF, 1.0)
+    assert debouncer.release(10.0) == [(0, plugin.UNIT_AIRCO_INDEX, plugin.Action.NO_ACTION, {})]
@@ -0,0 +1,48 @@
+"""The discovery of the account and the cars, kept on disk between logins."""
+
+import aiohttp
+import pytest
+import renault_api.kamereon.exceptions
+import yarl
+
+import Domoticz
+import plugin
+
+
+@pytest.fixture
+def discovery(renault, monkeypatch):
+    """A discovery cache that holds one car, with the parameters it was made for restored after the test."""
+    plugin.load_libraries()
+    for key in ('Username', 'Mode1', 'Mode2'):
+        monkeypatch.setitem(Domoticz.Parameters, key, Domoticz.Parameters.get(key, ''))
+    vehicles = renault_api.kamereon.schemas.KamereonVehiclesResponseSchema.load(
+        {'vehicleLinks': [{'vin': 'VF1TEST', 'vehicleDetails': {'vin': 'VF1TEST', 'registrationNumber': 'AB-123-C'}}]})
+    discovery = plugin.DiscoveryCache()
+    discovery.save('account-1', list(vehicles.vehicleLinks))
+    return discovery
+
+
+def test_discovery_is_reused(discovery):
+    account_id, cars = discovery.load()
+    assert account_id == 'account-1' and cars[0].vehicleDetails.registrationNumber == 'AB-123-C'
+
+
+@pytest.mark.parametrize('key, value', [('Username', 'someone@else'), ('Mode1', 'XY-999-Z'), ('Mode2', 'fr_FR')])
+def test_other_parameters_discover_again(discovery, key, value):
+    Domoticz.Parameters[key] = value
+    assert discovery.load() is None
+
+
+@pytest.mark.parametrize('error', [
+    renault_api.kamereon.exceptions.ResourceNotFoundException('err.func.wired.notFound', 'not found'),
+    renault_api.kamereon.exceptions.AccessDeniedException('err.func.wired.forbidden', 'forbidden'),
+    aiohttp.client_exceptions.ClientResponseError(aiohttp.RequestInfo(yarl.URL('http://stand-in/vehicles'), 'GET', {}),
+                                                  (), status=404)])
+def test_not_found_or_forbidden_drops_it(discovery, error):
+    discovery.invalidate(error)
+    assert discovery.load() is None
+
+
+def test_other_errors_keep_it(discovery):
+    discovery.invalidate(renault_api.kamereon.exceptions.FailedForwardException('err.tech.wired.kamereon-proxy', 'x'))
+    assert discovery.load() is not None
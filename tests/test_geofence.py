@@ -0,0 +1,49 @@
+"""The zones the cars are parked in: distances and the grid lookup."""
+
+import math
+
+import pytest
+
+import plugin
+
+
+def haversine(zone, latitude, longitude):
+    phi, zone_phi = math.radians(latitude), math.radians(zone.latitude)
+    half = (math.sin((phi - zone_phi) / 2) ** 2
+            + math.cos(zone_phi) * math.cos(phi) * math.sin(math.radians(longitude - zone.longitude) / 2) ** 2)
+    return 2 * plugin.Zone.EARTH_RADIUS * math.asin(math.sqrt(half))
+
+
+@pytest.mark.parametrize('north', [0.1, 19.9, 20.1, 200.0]) # km, the flat projection ends at Zone.NEAR
+def test_flat_and_haversine_agree_around_the_boundary(north):
+    zone = plugin.Zone('home', 52.0, 5.0, 1.0)
+    latitude = zone.latitude + north / zone.KM_PER_DEGREE
+    assert zone.distance(latitude, 5.0) == pytest.approx(haversine(zone, latitude, 5.0), abs=0.001)
+    east = 5.0 + north / zone._km_lon / 2
+    assert zone.distance(zone.latitude, east) == pytest.approx(haversine(zone, zone.latitude, east), rel=0.001)
+
+
+def test_zone_on_a_cell_edge_is_found_from_both_cells():
+    geofence = plugin.Geofence()
+    edge = 52.0 # a multiple of Geofence.CELL
+    zone = plugin.Zone('shop', edge, 5.0, 0.5)
+    geofence.index([zone])
+    step = 0.0001 # about 11 m
+    assert geofence._cell(edge - step, 5.0) != geofence._cell(edge + step, 5.0)
+    assert geofence.zones_at(edge - step, 5.0) == [zone] and geofence.zones_at(edge + step, 5.0) == [zone]
+    assert geofence.zones_at(edge + 0.6 / zone.KM_PER_DEGREE, 5.0) == []
+
+
+def test_zone_across_the_date_line():
+    geofence = plugin.Geofence()
+    zone = plugin.Zone('fiji', -17.0, 179.999, 1.0)
+    geofence.index([zone])
+    assert geofence.zones_at(-17.0, -179.999) == [zone]
+
+
+def test_nearest_zone_first():
+    geofence = plugin.Geofence()
+    home, street = plugin.Zone('home', 52.0, 5.0, 0.05), plugin.Zone('street', 52.0003, 5.0, 1.0)
+    geofence.index([street, home])
+    assert geofence.zones_at(52.0, 5.0) == [home, street]
+    assert geofence.locate(0, 52.0, 5.0) is home
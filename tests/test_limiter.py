@@ -0,0 +1,42 @@
+"""The token bucket around the renault_api calls."""
+
+import asyncio
+import time
+
+import pytest
+
+import plugin
+
+
+@pytest.fixture
+def limiter(renault):
+    limiter = plugin.RequestLimiter()
+    limiter._load()
+    return limiter
+
+
+def test_tokens_refill_over_time(limiter):
+    limiter._tokens = 0.0
+    limiter._stamp = time.time() - 60 # 120 calls an hour, two a minute
+    assert limiter.available(plugin.PRIORITY_COMMAND, 2)
+    assert not limiter.available(plugin.PRIORITY_COMMAND, 3)
+
+
+def test_polls_leave_a_reserve_for_commands(limiter):
+    limiter._tokens = 4.0
+    assert not limiter.available(plugin.PRIORITY_POLL)
+    assert limiter.available(plugin.PRIORITY_COMMAND)
+    with pytest.raises(plugin.RequestLimitException):
+        asyncio.run(limiter.acquire(plugin.PRIORITY_POLL))
+    asyncio.run(limiter.acquire(plugin.PRIORITY_COMMAND))
+    assert limiter._tokens < 4
+
+
+def test_quota_backoff_survives_a_restart(limiter):
+    limiter.quota_error()
+    restarted = plugin.RequestLimiter()
+    assert not restarted.available(plugin.PRIORITY_COMMAND)
+    with pytest.raises(plugin.RequestLimitException):
+        asyncio.run(restarted.acquire(plugin.PRIORITY_COMMAND))
+    restarted.quota_error()
+    assert restarted._backoff == 2 * limiter._backoff
@@ -0,0 +1,34 @@
+"""The poll scheduler that chooses when the cars are polled."""
+
+import datetime
+
+import Domoticz
+import plugin
+
+
+def test_skipped_poll_is_not_counted(renault):
+    scheduler = plugin.PollScheduler()
+    later = datetime.datetime.now() + datetime.timedelta(hours=1)
+    assert scheduler.due(later)
+    renault._jobs.append((None, {0: plugin.Action.NO_ACTION})) # a job that refreshes anyway
+    renault._scheduler = scheduler
+    renault.onHeartbeat()
+    assert scheduler._polls_today == 0 and scheduler.due(later)
+
+
+def test_started_poll_is_counted(renault, monkeypatch):
+    monkeypatch.setattr(renault, 'queue_job', lambda unit, action: None)
+    renault.onHeartbeat() # onStart already polled
+    assert renault._scheduler._polls_today == 0
+    renault._scheduler._next = datetime.datetime.now()
+    renault.onHeartbeat()
+    assert renault._scheduler._polls_today == 1 and not renault._scheduler.due(datetime.datetime.now())
+
+
+def test_location_and_hvac_are_planned_when_known(renault):
+    for device in Domoticz.Devices.values():
+        device.Used = 0
+    assert {'location', 'hvac_status'} <= renault.fetch_plan()[0] # the first poll finds out
+    renault._snapshots[0] = plugin.VehicleSnapshot({'battery_status': (None, 80, 1, 0.0), 'location': (None, 52.1, 5.1)})
+    plan = renault.fetch_plan()[0]
+    assert 'location' in plan and 'hvac_status' not in plan
@@ -0,0 +1,36 @@
+"""The VehicleSnapshot of one poll and what changed since the previous one."""
+
+import plugin
+
+
+def snapshot(level=60, mode='schedule_mode', latitude=52.1, stamp='2024-01-01T12:00:00Z'):
+    return plugin.VehicleSnapshot({'charge_mode': (mode,), 'battery_status': (stamp, level, 1, 0.0),
+                                   'location': (stamp, latitude, 5.1)})
+
+
+def test_first_snapshot_changes_all_known_fields():
+    assert snapshot().diff(None) == {'charge_mode', 'battery_time', 'battery_level', 'plug_status',
+                                     'charging_status', 'gps_time', 'latitude', 'longitude'}
+
+
+def test_equal_snapshots_have_no_changes():
+    assert snapshot().diff(snapshot()) == frozenset() and snapshot() == snapshot()
+
+
+def test_only_the_changed_fields():
+    assert snapshot(level=61, mode='always_charging', stamp='2024-01-01T12:05:00Z').diff(snapshot()) == \
+           {'charge_mode', 'battery_time', 'battery_level', 'gps_time'}
+
+
+def test_endpoint_that_came_through_later_is_changed():
+    previous = plugin.VehicleSnapshot({'charge_mode': ('schedule_mode',)})
+    assert snapshot().diff(previous) == {'battery_time', 'battery_level', 'plug_status', 'charging_status',
+                                         'gps_time', 'latitude', 'longitude'}
+
+
+def test_saved_snapshot_reads_back_equal():
+    charges = (('2024-01-01T10:00:00Z', 5000),)
+    saved = plugin.VehicleSnapshot({'charge_mode': ('schedule_mode',), 'charges': (charges,)})
+    stored = {name: list(extract) for name, extract in saved.extracts().items()}
+    stored['charges'] = [[list(record) for record in charges]]
+    assert plugin.VehicleSnapshot.from_json(stored) == saved
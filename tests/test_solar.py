@@ -0,0 +1,39 @@
+"""The decision to charge on solar surplus."""
+
+import pytest
+
+import Domoticz
+import plugin
+
+
+@pytest.fixture
+def solar(renault):
+    Domoticz.Parameters['Mode3'] = 'solar_window=60;solar_on=1500;solar_off=-1000;solar_dwell=300;solar_flips=2'
+    return plugin.SolarController()
+
+
+def feed(solar, start, end, surplus, step=60):
+    """Give a reading every step seconds from start up to end, return the times the decision changed."""
+    return [now for now in range(start, end, step) if solar.add(float(now), surplus)]
+
+
+def test_on_and_off_thresholds_differ(solar):
+    assert feed(solar, 0, 1200, 1400) == [] # below solar_on
+    assert feed(solar, 1200, 2400, 1600) == [1200 + 300] # the average of the last minute reaches solar_on
+    assert feed(solar, 2400, 3600, -500) == [] # the car draws power, still above solar_off
+    assert feed(solar, 3600, 4800, -1200)[0] == 3600 + 300 + 60 and not solar.charging
+
+
+def test_dwell_resets_when_the_surplus_returns(solar):
+    feed(solar, 0, 240, 2000) # past solar_on, but shorter than solar_dwell
+    feed(solar, 240, 360, 0)
+    assert not solar.charging and solar._since is None
+    assert feed(solar, 360, 1200, 2000) == [360 + 60 + 300]
+
+
+def test_changes_per_hour_are_capped(solar):
+    changes = []
+    for part in range(12): # a surplus that comes and goes every 10 minutes, for two hours
+        changes += feed(solar, part * 600, part * 600 + 600, 2000 if part % 2 == 0 else -2000, step=30)
+    assert changes[1] - changes[0] < 3600 and changes[2] - changes[0] > 3600
+    assert all(len([change for change in changes if now - 3600 < change <= now]) <= 2 for now in changes)
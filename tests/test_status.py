@@ -0,0 +1,24 @@
+"""The statuses of the car applied to the devices."""
+
+import Domoticz
+import plugin
+
+
+def status(charge_mode, changed=frozenset()):
+    snapshot = plugin.VehicleSnapshot({'charge_mode': (charge_mode,),
+                                       'battery_status': ('2024-01-01T12:00:00Z', 60, 1, 0.0)})
+    snapshot.changed = changed
+    return snapshot
+
+
+def test_charge_mode_is_set_without_new_data(renault):
+    plugin._writer.update(plugin.UNIT_SWITCH_INDEX, 1, '') # charge now, the car still has its schedule
+    assert renault.apply_status({0: status('schedule_mode')}) == {0: plugin.Action.CHARGE_ALWAYS}
+
+
+def test_devices_are_not_written_without_new_data(renault):
+    plugin._writer.flush()
+    updates = Domoticz.Devices[plugin.UNIT_STATUS_INDEX].updates
+    assert renault.apply_status({0: status('always_charging')}) == {} # outside the zones
+    plugin._writer.flush()
+    assert Domoticz.Devices[plugin.UNIT_STATUS_INDEX].updates == updates
@@ -0,0 +1,46 @@
+"""The track log of the positions of a car."""
+
+import os
+
+import Domoticz
+import plugin
+
+
+def driven(samples, coarse=3600, records=4):
+    """Return a track log of the given number of samples, one a minute about 100 m apart."""
+    Domoticz.Parameters['Mode3'] = f'track_records={records};track_coarse={coarse}'
+    track = plugin.TrackLog()
+    for minute in range(samples):
+        assert track.add(1000 + 60 * minute, 52.0 + minute * 0.001, 5.0)
+    return track
+
+
+def test_recent_ring_wraps(renault):
+    track = driven(6, coarse=0)
+    assert [sample[0] for sample in track.query(0, 2**32)] == [1000 + 60 * minute for minute in range(6)]
+    assert track._rings == [[4, 2, 4], [4, 2, 2]]
+    assert os.path.getsize(track.path()) == plugin.TrackLog.HEADER.size + plugin.TrackLog.RECORD.size * 8
+
+
+def test_older_samples_are_thinned(renault):
+    track = driven(12, coarse=180)
+    stamps = [sample[0] for sample in track.query(0, 2**32)]
+    assert stamps == [1000, 1180, 1360] + [1000 + 60 * minute for minute in range(8, 12)]
+
+
+def test_query_a_time_range(renault):
+    track = driven(12, coarse=180)
+    assert [sample[0] for sample in track.query(1100, 1500)] == [1180, 1360, 1480]
+    assert track.query(2000, 3000) == []
+    assert track.last()[1:3] == (52.011, 5.0)
+
+
+def test_restart_keeps_the_samples(renault):
+    track = driven(6, coarse=0)
+    assert plugin.TrackLog().query(0, 2**32) == track.query(0, 2**32)
+
+
+def test_standing_car_is_not_logged(renault):
+    track = driven(1)
+    assert not track.add(2000, 52.0 + 0.00005, 5.0)
+    assert not track.add(900, 52.1, 5.0) # older than the last sample
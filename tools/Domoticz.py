@@ -0,0 +1,77 @@
+"""
+Minimal stand-in for the Domoticz module that Domoticz gives to its Python plugins.
+
+Only what plugin.py uses is here: Parameters, Settings, Devices, the log functions and Device.
+Put the tools folder in front on sys.path before plugin.py is imported, as tests/conftest.py and tools/benchmark.py do,
+or load a module of its own for each plugin instance, as tools/fleet.py does.
+"""
+
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+Parameters: Dict[str, str] = {'Name': 'Renault', 'HomeFolder': './', 'Username': 'stand-in', 'Password': 'stand-in',
+                              'Mode1': '', 'Mode2': 'nl_NL', 'Mode3': '', 'Mode4': '', 'Mode5': '', 'Mode6': '0'}
+Settings: Dict[str, str] = {'Location': '52.0;5.0'}
+Images: Dict[str, Any] = {}
+Devices: Dict[int, 'Device'] = {}
+
+log: list = [] # (level, message) of everything the plugin logged
+quiet = True   # only keep the log, do not print it
+clock: Callable[[], float] = time.time # stamps the write history, a simulated clock can take its place
+heartbeat = 10 # seconds between heartbeats, as last asked by the plugin
+HISTORY = 256  # writes kept per device
+
+
+def _log(level: str, message: Any) -> None:
+    log.append((level, str(message)))
+    if not quiet:
+        print(f'{level:6} {message}')
+
+def Log(message: Any) -> None:
+    _log('Log', message)
+
+def Status(message: Any) -> None:
+    _log('Status', message)
+
+def Error(message: Any) -> None:
+    _log('Error', message)
+
+def Debug(message: Any) -> None:
+    pass
+
+def Debugging(level: int) -> None:
+    pass
+
+def Heartbeat(seconds: int) -> None:
+    global heartbeat
+    heartbeat = seconds
+
+
+class Device():
+    """A Domoticz device as far as plugin.py uses it, with the last HISTORY writes as (time, nValue, sValue)."""
+
+    def __init__(self, Name: str = '', Unit: int = 0, Used: int = 0, **options: Any) -> None:
+        self.Name = Name
+        self.Unit = Unit
+        self.ID = Unit
+        self.Used = Used
+        self.Options = options
+        self.nValue = 0
+        self.sValue = ''
+        self.LastLevel = 0
+        self.updates = 0
+        self.history: deque = deque(maxlen=HISTORY)
+
+    def Create(self) -> None:
+        Devices[self.Unit] = self
+
+    def Update(self, nValue: int = 0, sValue: str = '', **options: Any) -> None:
+        self.updates += 1
+        self.history.append((clock(), nValue, sValue))
+        if not sValue.startswith('-1;'): # a counter history point leaves the current value alone
+            self.nValue = nValue
+            self.sValue = sValue
+
+    def Delete(self) -> None:
+        Devices.pop(self.Unit, None)
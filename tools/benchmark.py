@@ -0,0 +1,201 @@
+"""
+End-to-end benchmark of the plugin against the stand-in servers of tools/standin.py.
+
+Runs the plugin with the Domoticz stand-in of tools/Domoticz.py: onStart, a number of RefreshNow
+cycles and a number of Airco/Heater commands, each driven by heartbeats like Domoticz does. Reports
+the requests and logins per cycle, the p50 and p95 cycle latency and the peak memory.
+
+    python tools/benchmark.py --output bench.json
+    python tools/benchmark.py --compare bench.json   # exit code 1 on a regression
+
+The JSON results carry the plugin version, so the results of two versions can be compared.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TOOLS, os.path.dirname(TOOLS)] # the Domoticz stand-in and plugin.py
+
+import Domoticz  # noqa: E402 the stand-in
+import standin   # noqa: E402
+
+# no request limiter in the way, the stand-in scenario decides about quota, and no debounce window
+BENCH_OPTIONS = 'api_rate=1000000;api_burst=1000000;api_reserve=0;debounce=0'
+METRICS = ('requests', 'logins', 'p50_ms', 'p95_ms')
+
+
+def percentile(values: List[float], part: float) -> float:
+    """Return the value below which part of the values fall, nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(int(part * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+class Bench():
+    """One run of the plugin against a stand-in in a thread of its own."""
+
+    def __init__(self, scenario: Dict[str, Any], options: str) -> None:
+        self.stand_in = standin.StandIn(scenario)
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='stand-in', daemon=True).start()
+        runner = asyncio.run_coroutine_threadsafe(standin.start(self.stand_in), self._loop).result()
+        self._runner = runner
+        self._home = tempfile.TemporaryDirectory(prefix='renault-bench-') # removed after onStop
+        home = self._home.name
+        for car in range(self.stand_in.scenario['cars']): # measure the steady state, no backfill
+            name = f'renault_backfill_{car}.json' if car else 'renault_backfill.json'
+            with open(os.path.join(home, name), 'w', encoding='utf-8') as done:
+                json.dump({'done': datetime.date.today().isoformat()}, done)
+        Domoticz.Parameters['HomeFolder'] = home + os.sep
+        Domoticz.Parameters['Mode1'] = '*'
+        Domoticz.Parameters['Mode3'] = ';'.join(part for part in (
+            f'api_url=http://127.0.0.1:{standin.bound_port(runner)}', options, BENCH_OPTIONS) if part)
+        start = time.perf_counter()
+        import plugin # pylint: disable=import-outside-toplevel
+        self.import_seconds = time.perf_counter() - start
+        self.plugin = plugin
+
+    def counters(self) -> Dict[str, int]:
+        return {'requests': self.stand_in.stats['requests'], 'logins': self.stand_in.stats['logins']}
+
+    def cycle(self, trigger: Callable[[], None], timeout: float = 120) -> Dict[str, float]:
+        """Run one cycle to completion with heartbeats and return its cost."""
+        before = self.counters()
+        start = time.perf_counter()
+        trigger()
+        while not self.plugin._plugin.idle():
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError('cycle did not finish')
+            self.plugin.onHeartbeat()
+            time.sleep(0.005)
+        self.plugin.onHeartbeat()
+        after = self.counters()
+        return {'seconds': time.perf_counter() - start,
+                'requests': after['requests'] - before['requests'],
+                'logins': after['logins'] - before['logins']}
+
+    def run(self, refreshes: int, commands: int) -> Dict[str, Any]:
+        """Start the plugin, run the cycles and return the results."""
+        before = self.counters()
+        start = time.perf_counter()
+        self.plugin.onStart()
+        started = time.perf_counter() - start
+        self.cycle(lambda: None) # the first live status and the commands it asks for
+        startup = {'import': round(self.import_seconds, 3), 'seconds': round(started, 3),
+                   'first_status': round(time.perf_counter() - start, 3),
+                   'requests': self.counters()['requests'] - before['requests'],
+                   'logins': self.counters()['logins'] - before['logins']}
+        tracemalloc.start() # the steady state, not the libraries the worker imports at the start
+        refresh = [self.cycle(lambda: self.plugin.onCommand(self.plugin.UNIT_REFRESH_INDEX, 'On', 0, ''))
+                   for _ in range(refreshes)]
+        command = [self.cycle(lambda turn=turn: self.plugin.onCommand(self.plugin.UNIT_AIRCO_INDEX,
+                                                                      'Off' if turn % 2 else 'On', 0, ''))
+                   for turn in range(commands)]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.plugin.onStop()
+        self._home.cleanup()
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        return {'version': plugin_version(), 'python': sys.version.split()[0],
+                'scenario': self.stand_in.scenario, 'startup': startup,
+                'refresh': summary(refresh), 'command': summary(command),
+                'peak_kib': round(peak / 1024), 'errors': [message for level, message in Domoticz.log
+                                                           if level == 'Error']}
+
+
+def summary(cycles: List[Dict[str, float]]) -> Dict[str, float]:
+    """Return the averages and latency percentiles of a list of cycles."""
+    if not cycles:
+        return {'cycles': 0}
+    latencies = [cycle['seconds'] * 1000 for cycle in cycles]
+    return {'cycles': len(cycles),
+            'requests': round(statistics.mean(cycle['requests'] for cycle in cycles), 2),
+            'logins': round(statistics.mean(cycle['logins'] for cycle in cycles), 2),
+            'p50_ms': round(percentile(latencies, 0.50), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1)}
+
+
+def plugin_version() -> str:
+    with open(os.path.join(os.path.dirname(TOOLS), 'plugin.py'), encoding='utf-8') as source:
+        found = re.search(r'version="([^"]+)"', source.read())
+    return found.group(1) if found else 'unknown'
+
+
+def report(results: Dict[str, Any]) -> None:
+    print(f"plugin {results['version']} on Python {results['python']}")
+    startup = results['startup']
+    print(f"startup   {startup['seconds'] * 1000:9.1f} ms  import {startup.get('import', 0) * 1000:.1f} ms"
+          f"  first status {startup.get('first_status', 0) * 1000:.1f} ms"
+          f"  {startup['requests']} requests  {startup['logins']} logins")
+    for kind in ('refresh', 'command'):
+        cycle = results[kind]
+        if cycle['cycles']:
+            print(f"{kind:8}  p50 {cycle['p50_ms']:9.1f} ms  p95 {cycle['p95_ms']:9.1f} ms"
+                  f"  {cycle['requests']} requests  {cycle['logins']} logins per cycle ({cycle['cycles']} cycles)")
+    print(f"peak memory {results['peak_kib']} KiB")
+    for error in results['errors']:
+        print(f'error: {error}')
+
+
+def compare(previous: Dict[str, Any], results: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print the changes against previous results and return the regressions."""
+    regressions = []
+    print(f"compared to {previous['version']}:")
+    pairs = [(f'{kind}.{metric}', previous[kind].get(metric), results[kind].get(metric))
+             for kind in ('refresh', 'command') for metric in METRICS]
+    pairs.append(('peak_kib', previous.get('peak_kib'), results.get('peak_kib')))
+    for name, old, new in pairs:
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        print(f'{name:18} {old:10} -> {new:10} {change:+7.1f}%')
+        slack = 1 if name.endswith('_ms') or name == 'peak_kib' else 0 # noise on small numbers
+        if new > old * (1 + tolerance) + slack:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the plugin against the stand-in servers.')
+    parser.add_argument('--refreshes', type=int, default=20, help='RefreshNow cycles')
+    parser.add_argument('--commands', type=int, default=4, help='Airco/Heater on and off commands')
+    parser.add_argument('--cars', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds of latency of the stand-in')
+    parser.add_argument('--scenario', help='JSON file with a stand-in scenario, see tools/standin.py')
+    parser.add_argument('--options', default='', help='plugin options, key=value;key=value, these win')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed growth before it is a regression')
+    args = parser.parse_args()
+    scenario: Dict[str, Any] = {'cars': args.cars, 'latency': args.latency}
+    if args.scenario:
+        with open(args.scenario, encoding='utf-8') as scenario_file:
+            scenario.update(json.load(scenario_file))
+    results = Bench(scenario, args.options).run(args.refreshes, args.commands)
+    report(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+    regressions: Optional[List[str]] = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as previous:
+            regressions = compare(json.load(previous), results, args.tolerance)
+        if regressions:
+            print('regressions: ' + ', '.join(regressions))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
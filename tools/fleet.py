@@ -0,0 +1,248 @@
+"""
+Load test of a fleet of simulated cars: many plugin instances in one process on a simulated clock.
+
+Each instance is plugin.py loaded as a module of its own, with a Domoticz module of its own from
+tools/Domoticz.py, as Domoticz gives each plugin an interpreter of its own. The instances talk to one
+stand-in of tools/standin.py with all the cars, each instance picks its cars with Car (Mode1).
+
+The plugin sees the simulated clock through time.time, time.monotonic, datetime.datetime.now and
+datetime.date.today: poll scheduling, endpoint cache, request limiter, debounce and command deadlines
+run on it. Every instance gets onHeartbeat at the interval it asks for with Domoticz.Heartbeat, and
+onCommand for random commands of the user. The requests themselves take real time, the clock runs
+--speed times faster than real time.
+
+    python tools/fleet.py --instances 50 --cars 4 --hours 6 --speed 600 --output fleet.json
+
+Reports requests, logins, cycles, commands by outcome, device writes, job queue depth and errors.
+"""
+
+import argparse
+import asyncio
+import builtins
+import datetime
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+from typing import Any, Dict
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS)
+
+import standin  # noqa: E402
+
+PLUGIN = os.path.join(os.path.dirname(TOOLS), 'plugin.py')
+# no backfill of a year of charges for each car, unless the options ask for it
+FLEET_OPTIONS = 'backfill_days=0'
+COMMANDS = ((7, 'On'), (8, 'On'), (8, 'Off'), (4, 'On'), (4, 'Off')) # RefreshNow, Airco/Heater, ChargeNowWhenAtHome
+
+
+class SimClock():
+    """The simulated time, and the time and datetime modules that show it to a plugin instance."""
+
+    def __init__(self, start: float) -> None:
+        self.now = start
+        clock = self
+
+        class ClockDatetime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return datetime.datetime.fromtimestamp(clock.now, tz)
+
+        class ClockDate(datetime.date):
+            @classmethod
+            def today(cls):
+                return datetime.date.fromtimestamp(clock.now)
+
+        self.time = types.ModuleType('time')
+        self.time.__dict__.update(vars(time))
+        self.time.time = lambda: clock.now
+        self.time.monotonic = lambda: clock.now
+        self.datetime = types.ModuleType('datetime')
+        self.datetime.__dict__.update(vars(datetime))
+        self.datetime.datetime = ClockDatetime
+        self.datetime.date = ClockDate
+
+
+class Instance():
+    """One plugin with its own Domoticz module, devices and plugin folder."""
+
+    def __init__(self, index: int, clock: SimClock, parameters: Dict[str, str]) -> None:
+        self.index = index
+        self.domoticz = self._load('Domoticz', os.path.join(TOOLS, 'Domoticz.py'), {})
+        self.domoticz.clock = lambda: clock.now
+        self.domoticz.Parameters.update(parameters)
+        self.home = tempfile.TemporaryDirectory(prefix=f'renault-fleet-{index}-') # removed after onStop
+        self.domoticz.Parameters['HomeFolder'] = self.home.name + os.sep
+        self.plugin = self._load(f'plugin_{index}', PLUGIN, {'Domoticz': self.domoticz,
+                                                             'time': clock.time, 'datetime': clock.datetime})
+        self.next_beat = clock.now
+        self.max_jobs = 0
+
+    @staticmethod
+    def _load(name: str, path: str, modules: Dict[str, Any]) -> types.ModuleType:
+        """Load a module from a file, its imports of the names in modules get those instead."""
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        if modules:
+            def instance_import(name, globals=None, locals=None, fromlist=(), level=0): # pylint: disable=W0622
+                if name in modules and level == 0:
+                    return modules[name]
+                return builtins.__import__(name, globals, locals, fromlist, level)
+            module.__dict__['__builtins__'] = dict(vars(builtins), __import__=instance_import)
+        spec.loader.exec_module(module)
+        return module
+
+    def beat(self, now: float) -> None:
+        self.plugin.onHeartbeat()
+        self.next_beat = now + max(self.domoticz.heartbeat, 1)
+        self.max_jobs = max(self.max_jobs, len(self.plugin._plugin._jobs))
+
+    def results(self) -> Dict[str, Any]:
+        metrics = self.plugin._metrics
+        caches = self.plugin._plugin._caches.values()
+        return {'cycles_ok': metrics.total('cycles', result='ok'),
+                'cycles_failed': metrics.total('cycles', result='failed'),
+                'api_errors': metrics.total('api_errors'), 'quota_errors': metrics.total('quota_errors'),
+                'commands': {outcome: metrics.total('commands', outcome=outcome)
+                             for outcome in ('confirmed', 'timed_out', 'rejected')},
+                'writes': sum(device.updates for device in self.domoticz.Devices.values()),
+                'hit_ratio': sum(cache.hit_ratio() for cache in caches) / len(caches) if caches else 0.0,
+                'max_jobs': self.max_jobs,
+                'errors': [message for level, message in self.domoticz.log if level == 'Error']}
+
+
+class Fleet():
+    """The stand-in, the instances and the simulated clock that drives them."""
+
+    def __init__(self, instances: int, cars: int, scenario: Dict[str, Any], options: str, seed: int) -> None:
+        self.random = random.Random(seed)
+        self.clock = SimClock(time.time())
+        self.stand_in = standin.StandIn(dict(scenario, cars=instances * cars), lambda: self.clock.now)
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name='stand-in', daemon=True).start()
+        self._runner = asyncio.run_coroutine_threadsafe(standin.start(self.stand_in), self._loop).result()
+        mode3 = ';'.join(part for part in (
+            f'api_url=http://127.0.0.1:{standin.bound_port(self._runner)}', options, FLEET_OPTIONS) if part)
+        self.cars = cars
+        self.instances = [Instance(index, self.clock, {
+            'Name': f'Renault {index}', 'Mode3': mode3,
+            'Mode1': ','.join(car.plate for car in self.stand_in.cars[index * cars:(index + 1) * cars])})
+            for index in range(instances)]
+
+    def _tick(self, speed: float) -> None:
+        """Move the clock to the next heartbeat and give it to the instances that are due."""
+        due = min(instance.next_beat for instance in self.instances)
+        time.sleep(max(due - self.clock.now, 0) / speed) # real time for the workers and the stand-in
+        self.clock.now = max(due, self.clock.now)
+        for instance in self.instances:
+            if instance.next_beat <= self.clock.now:
+                instance.beat(self.clock.now)
+
+    def run(self, hours: float, commands: float, speed: float, drain: float) -> Dict[str, Any]:
+        """Start the instances, run the simulated hours with commands per car per hour and stop them."""
+        real = time.perf_counter()
+        start = self.clock.now
+        for instance in self.instances:
+            instance.plugin.onStart()
+        end = start + hours * 3600
+        rate = commands * self.cars / 3600 # per instance per simulated second
+        upcoming = [start + self.random.expovariate(rate) if rate else float('inf') for _ in self.instances]
+        sent = 0
+        while self.clock.now < end:
+            self._tick(speed)
+            for index, instance in enumerate(self.instances):
+                while upcoming[index] <= self.clock.now:
+                    unit, command = self.random.choice(COMMANDS)
+                    car = self.random.randrange(self.cars)
+                    instance.plugin.onCommand(car * instance.plugin.UNIT_BLOCK + unit, command, 0, '')
+                    instance.next_beat = min(instance.next_beat, self.clock.now + instance.domoticz.heartbeat)
+                    upcoming[index] += self.random.expovariate(rate)
+                    sent += 1
+        simulated = self.clock.now - start
+        deadline = time.perf_counter() + drain
+        while time.perf_counter() < deadline and not all(instance.plugin._plugin.idle()
+                                                         for instance in self.instances):
+            self._tick(speed)
+        for instance in self.instances:
+            instance.plugin.onStop()
+            instance.home.cleanup()
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        return self._summary(simulated, time.perf_counter() - real, sent)
+
+    def _summary(self, simulated: float, real: float, sent: int) -> Dict[str, Any]:
+        per = [instance.results() for instance in self.instances]
+        cars = len(self.instances) * self.cars
+        car_hours = cars * simulated / 3600 or 1
+        errors: Dict[str, int] = {}
+        for result in per:
+            for message in result['errors']:
+                errors[message] = errors.get(message, 0) + 1
+        return {'instances': len(self.instances), 'cars': cars,
+                'simulated_hours': round(simulated / 3600, 2), 'real_seconds': round(real, 1),
+                'requests': self.stand_in.stats['requests'], 'logins': self.stand_in.stats['logins'],
+                'requests_per_car_hour': round(self.stand_in.stats['requests'] / car_hours, 2),
+                'paths': self.stand_in.stats['paths'],
+                'cycles_ok': sum(result['cycles_ok'] for result in per),
+                'cycles_failed': sum(result['cycles_failed'] for result in per),
+                'api_errors': sum(result['api_errors'] for result in per),
+                'quota_errors': sum(result['quota_errors'] for result in per),
+                'commands_sent': sent,
+                'commands': {outcome: sum(result['commands'][outcome] for result in per)
+                             for outcome in ('confirmed', 'timed_out', 'rejected')},
+                'writes_per_car_hour': round(sum(result['writes'] for result in per) / car_hours, 2),
+                'hit_ratio': round(sum(result['hit_ratio'] for result in per) / len(per), 3),
+                'max_jobs': max(result['max_jobs'] for result in per),
+                'errors': errors}
+
+
+def report(results: Dict[str, Any]) -> None:
+    print(f"{results['instances']} instances, {results['cars']} cars, {results['simulated_hours']} simulated hours"
+          f" in {results['real_seconds']} s")
+    print(f"requests  {results['requests']} ({results['requests_per_car_hour']} per car per hour),"
+          f" {results['logins']} logins")
+    print(f"cycles    {results['cycles_ok']:g} ok, {results['cycles_failed']:g} failed,"
+          f" endpoint cache hit ratio {results['hit_ratio']}")
+    print(f"commands  {results['commands_sent']} given, " +
+          ', '.join(f'{count:g} {outcome}' for outcome, count in results['commands'].items()) +
+          f", at most {results['max_jobs']} jobs queued")
+    print(f"errors    {results['api_errors']:g} api, {results['quota_errors']:g} quota,"
+          f" {results['writes_per_car_hour']} device writes per car per hour")
+    for message, count in sorted(results['errors'].items(), key=lambda item: -item[1])[:10]:
+        print(f'{count:6}x {message}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run a fleet of plugin instances on a simulated clock.')
+    parser.add_argument('--instances', type=int, default=10, help='plugin instances, as many Domoticz hardware')
+    parser.add_argument('--cars', type=int, default=2, help='cars per instance')
+    parser.add_argument('--hours', type=float, default=2, help='simulated hours')
+    parser.add_argument('--speed', type=float, default=300, help='simulated seconds per real second')
+    parser.add_argument('--commands', type=float, default=0.5, help='user commands per car per simulated hour')
+    parser.add_argument('--drain', type=float, default=30, help='real seconds to let the last work finish')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds of latency of the stand-in')
+    parser.add_argument('--scenario', help='JSON file with a stand-in scenario, see tools/standin.py')
+    parser.add_argument('--options', default='', help='plugin options, key=value;key=value, these win')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+    scenario: Dict[str, Any] = {'latency': args.latency}
+    if args.scenario:
+        with open(args.scenario, encoding='utf-8') as scenario_file:
+            scenario.update(json.load(scenario_file))
+    results = Fleet(args.instances, args.cars, scenario, args.options, args.seed).run(
+        args.hours, args.commands, args.speed, args.drain)
+    report(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
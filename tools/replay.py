@@ -0,0 +1,95 @@
+"""
+Replay a cassette recorded with the option cassette=record, without the Renault servers.
+
+Runs the plugin with the Domoticz stand-in of tools/Domoticz.py and cassette=replay: onStart, then a
+status cycle after another until the cassette is exhausted. The plugin takes the same decisions as when
+it was recorded, the commands of the user in a cycle are sent again. Reports the cycles per second and
+the values the devices end with, which can be compared with an earlier replay.
+
+    python tools/benchmark.py --options "cassette=record;cassette_file=/tmp/renault.jsonl.gz"
+    python tools/replay.py /tmp/renault.jsonl.gz --output devices.json
+    python tools/replay.py /tmp/renault.jsonl.gz --compare devices.json   # exit code 1 on a difference
+
+The cassette masks the VIN, so the replay uses all the cars of its get_vehicles (Car *).
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [TOOLS, os.path.dirname(TOOLS)] # the Domoticz stand-in and plugin.py
+
+import Domoticz  # noqa: E402 the stand-in
+
+# no request limiter in the way, no debounce window and no backfill that is not on the cassette
+REPLAY_OPTIONS = 'api_rate=1000000;api_burst=1000000;api_reserve=0;debounce=0;backfill_days=0'
+
+
+def replay(path: str, options: str, timeout: float) -> Dict[str, Any]:
+    """Run the plugin on the cassette and return the cycles, the time it took and the devices."""
+    home = tempfile.TemporaryDirectory(prefix='renault-replay-') # removed after onStop
+    Domoticz.Parameters['HomeFolder'] = home.name + os.sep
+    Domoticz.Parameters['Mode1'] = '*'
+    Domoticz.Parameters['Mode3'] = ';'.join(part for part in (
+        options, f'cassette=replay;cassette_file={os.path.abspath(path)}', REPLAY_OPTIONS) if part)
+    import plugin # pylint: disable=import-outside-toplevel
+    start = time.perf_counter()
+    plugin.onStart()
+    while not plugin._plugin.idle(): # the first status comes from the background worker
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError('first status did not finish')
+        plugin.onHeartbeat()
+        time.sleep(0.005)
+    plugin.onHeartbeat()
+    first_status = time.perf_counter() - start
+    cycles = plugin._cassette.cycles
+    start = time.perf_counter()
+    while not plugin._cassette.exhausted:
+        plugin._plugin.update_devices()
+    seconds = time.perf_counter() - start
+    devices = {str(unit): {'name': device.Name, 'nValue': device.nValue, 'sValue': device.sValue}
+               for unit, device in sorted(Domoticz.Devices.items())}
+    plugin.onStop()
+    home.cleanup()
+    return {'first_status': round(first_status, 3), 'cycles': plugin._cassette.cycles - cycles,
+            'seconds': round(seconds, 3),
+            'updates': sum(device.updates for device in Domoticz.Devices.values()),
+            'devices': devices, 'errors': [message for level, message in Domoticz.log if level == 'Error']}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Replay a recorded cassette through the plugin.')
+    parser.add_argument('cassette', help='file recorded with cassette=record')
+    parser.add_argument('--options', default='', help='plugin options, key=value;key=value, these win')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for the first status')
+    parser.add_argument('--output', help='write the devices as JSON to this file')
+    parser.add_argument('--compare', help='JSON devices of an earlier replay')
+    args = parser.parse_args()
+    results = replay(args.cassette, args.options, args.timeout)
+    print(f"first status {results['first_status'] * 1000:.1f} ms, then {results['cycles']} cycles"
+          f" in {results['seconds'] * 1000:.1f} ms ({results['cycles'] / max(results['seconds'], 1e-9):.0f} cycles/s),"
+          f" {results['updates']} device updates")
+    for error in results['errors']:
+        print(f'error: {error}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results['devices'], output, indent=2)
+    differences = 0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as previous:
+            expected = json.load(previous)
+        for unit in sorted(set(expected) | set(results['devices']), key=int):
+            old, new = expected.get(unit), results['devices'].get(unit)
+            if old != new:
+                differences += 1
+                print(f'device {unit}: {old} -> {new}')
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
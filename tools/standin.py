@@ -0,0 +1,272 @@
+"""
+Local stand-in for the Gigya and Kamereon servers that the plugin talks to.
+
+It answers the calls that renault_api makes for this plugin, with cars whose state follows the
+commands that are sent. Latency, errors and quota responses can be scripted, so the plugin can be
+measured and tried without touching the Renault servers. Point the plugin to it with the option
+api_url=http://127.0.0.1:<port>
+
+    python tools/standin.py --port 8080 --scenario scenario.json
+
+The scenario is a JSON document with any of the keys of StandIn.DEFAULTS. While running it can be
+changed with POST /_script, the counters are at GET /_stats and are cleared with POST /_reset.
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+import jwt
+
+JWT_KEY = 'stand-in-key-for-local-benchmarks-only' # HS256 wants 32 bytes or more
+
+class StandInCar():
+    """The state of one car, changed by the commands it receives."""
+
+    def __init__(self, index: int) -> None:
+        self.vin = f'VF1STANDIN{index:07d}'
+        self.plate = f'SI-{index:03d}-NL'
+        self.charge_mode = 'always_charging'
+        self.hvac_status = 'off'
+        self.plug_status = 1
+        self.charging_status = 1.0
+        self.battery_level = 40 + index % 60
+        self.mileage = 12000.0 + 1000 * index
+        self.latitude = 52.0 + index / 1000
+        self.longitude = 5.0
+        self.pending: List[Any] = [] # (clock time, attribute, value) of commands not applied yet
+
+    def apply(self, now: float) -> None:
+        """Apply the commands whose delay has passed."""
+        for command in [command for command in self.pending if command[0] <= now]:
+            setattr(self, command[1], command[2])
+            self.pending.remove(command)
+
+    def charges(self, start: datetime.date, end: datetime.date) -> List[Dict[str, Any]]:
+        """Return a charge of 7 kWh on every other day between start and end."""
+        charges = []
+        day = start
+        while day <= end:
+            if day.toordinal() % 2 == 0:
+                charges.append({'chargeStartDate': f'{day:%Y-%m-%d}T01:00:00Z',
+                                'chargeEndDate': f'{day:%Y-%m-%d}T04:00:00Z',
+                                'chargeDuration': 180,
+                                'chargeStartBatteryLevel': 30, 'chargeEndBatteryLevel': 80,
+                                'chargeEnergyRecovered': 7.0,
+                                'chargeEndStatus': 'ok'})
+            day += datetime.timedelta(days=1)
+        return charges
+
+
+class StandIn():
+    """The aiohttp application with the Gigya and Kamereon routes, the scenario and the counters."""
+
+    DEFAULTS: Dict[str, Any] = {
+        'cars': 1,                # number of cars in the account
+        'latency': 0.05,          # seconds before each answer
+        'jitter': 0.0,            # random extra latency, up to this many seconds
+        'endpoint_latency': {},   # endpoint: seconds, instead of latency
+        'errors': {},             # endpoint: chance of a failed forward (502) on each call
+        'fail': {},               # endpoint: the next so many calls fail with a failed forward
+        'quota': 0,               # Kamereon calls allowed per quota_window, 0 for no limit
+        'quota_window': 3600,     # seconds
+        'jwt_lifetime': 900,      # seconds a JWT is valid
+        'apply_delay': 0.0,       # seconds before a command shows in the status of the car
+    }
+
+    def __init__(self, scenario: Optional[Dict[str, Any]] = None, clock: Callable[[], float] = time.time) -> None:
+        self.clock = clock # JWT expiry, quota window, command delays and timestamps, a simulated clock can take its place
+        self.scenario = dict(self.DEFAULTS)
+        self.scenario.update(scenario or {})
+        self.cars = [StandInCar(index) for index in range(self.scenario['cars'])]
+        self.stats: Dict[str, Any] = {}
+        self._quota_calls: List[float] = []
+        self.reset()
+        self.app = web.Application(middlewares=[self._middleware])
+        gigya = '/gigya/accounts.'
+        commerce = '/kamereon/commerce/v1'
+        adapter = commerce + '/accounts/{account}/kamereon/kca/car-adapter/v{version}/cars/{vin}'
+        self.app.add_routes([
+            web.post(gigya + 'login', self.login),
+            web.post(gigya + 'getAccountInfo', self.account_info),
+            web.post(gigya + 'getJWT', self.get_jwt),
+            web.get(commerce + '/persons/{person}', self.person),
+            web.get(commerce + '/accounts/{account}/vehicles', self.vehicles),
+            web.get(commerce + '/accounts/{account}/vehicles/{vin}/details', self.details),
+            web.get(adapter + '/{endpoint}', self.vehicle_data),
+            web.post(adapter + '/actions/{action}', self.vehicle_action),
+            web.get('/_stats', self.get_stats),
+            web.post('/_reset', self.post_reset),
+            web.post('/_script', self.post_script)])
+
+    def reset(self) -> None:
+        """Clear the counters."""
+        self.stats = {'requests': 0, 'logins': 0, 'jwts': 0, 'errors': 0, 'quota': 0, 'paths': {}}
+
+    def _car(self, vin: str) -> StandInCar:
+        for car in self.cars:
+            if car.vin == vin:
+                return car
+        raise web.HTTPNotFound(text=json.dumps({'errors': [{'errorCode': 'err.func.wired.notFound',
+                                                            'errorMessage': 'Vehicle not found'}]}),
+                               content_type='application/json')
+
+    @staticmethod
+    def _kamereon_error(status: int, code: str, message: str) -> web.Response:
+        return web.json_response({'errors': [{'errorCode': code, 'errorMessage': message}]}, status=status)
+
+    def _endpoint(self, request: web.Request) -> str:
+        if 'action' in request.match_info:
+            return 'actions/' + request.match_info['action']
+        return request.match_info.get('endpoint') or request.match_info.handler.__name__
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        """Count, delay and fail the requests the way the scenario says."""
+        if request.path.startswith('/_'):
+            return await handler(request)
+        endpoint = self._endpoint(request)
+        self.stats['requests'] += 1
+        self.stats['paths'][endpoint] = self.stats['paths'].get(endpoint, 0) + 1
+        latency = self.scenario['endpoint_latency'].get(endpoint, self.scenario['latency'])
+        await asyncio.sleep(latency + random.uniform(0, self.scenario['jitter']))
+        if request.path.startswith('/kamereon'):
+            now = self.clock()
+            if self.scenario['quota']:
+                window = self.scenario['quota_window']
+                self._quota_calls = [stamp for stamp in self._quota_calls if now - stamp < window]
+                if len(self._quota_calls) >= self.scenario['quota']:
+                    self.stats['quota'] += 1
+                    return self._kamereon_error(429, 'err.func.wired.overloaded',
+                                                'You have reached your quota limit')
+                self._quota_calls.append(now)
+            try:
+                token = jwt.decode(request.headers.get('x-gigya-id_token', ''), JWT_KEY, algorithms=['HS256'])
+            except jwt.PyJWTError:
+                token = None
+            if token is None:
+                self.stats['errors'] += 1
+                return self._kamereon_error(403, 'err.func.403', 'Access is denied for this resource')
+            fail = self.scenario['fail']
+            if fail.get(endpoint, 0) > 0 or random.random() < self.scenario['errors'].get(endpoint, 0.0):
+                fail[endpoint] = max(fail.get(endpoint, 0) - 1, 0)
+                self.stats['errors'] += 1
+                return self._kamereon_error(502, 'err.tech.wired.kamereon-proxy', 'Failed to forward request')
+        return await handler(request)
+
+    async def login(self, request: web.Request) -> web.Response:
+        self.stats['logins'] += 1
+        return web.json_response({'errorCode': 0, 'sessionInfo': {'cookieValue': uuid.uuid4().hex}})
+
+    async def account_info(self, request: web.Request) -> web.Response:
+        return web.json_response({'errorCode': 0, 'data': {'personId': 'person-stand-in'}})
+
+    async def get_jwt(self, request: web.Request) -> web.Response:
+        self.stats['jwts'] += 1
+        token = jwt.encode({'exp': int(self.clock()) + self.scenario['jwt_lifetime']}, JWT_KEY, algorithm='HS256')
+        return web.json_response({'errorCode': 0, 'id_token': token})
+
+    async def person(self, request: web.Request) -> web.Response:
+        return web.json_response({'personId': request.match_info['person'],
+                                  'accounts': [{'accountId': 'account-stand-in', 'accountType': 'MYRENAULT',
+                                                'accountStatus': 'ACTIVE'}]})
+
+    def _details(self, car: StandInCar) -> Dict[str, Any]:
+        return {'vin': car.vin, 'registrationNumber': car.plate, 'engineEnergyType': 'ELEC',
+                'brand': {'label': 'RENAULT'}, 'model': {'code': 'X101VE', 'label': 'ZOE'},
+                'energy': {'code': 'ELEC', 'label': 'ELECTRIQUE'}}
+
+    async def vehicles(self, request: web.Request) -> web.Response:
+        return web.json_response({'accountId': request.match_info['account'], 'country': 'NL',
+                                  'vehicleLinks': [{'vin': car.vin, 'vehicleDetails': self._details(car)}
+                                                   for car in self.cars]})
+
+    async def details(self, request: web.Request) -> web.Response:
+        return web.json_response(self._details(self._car(request.match_info['vin'])))
+
+    async def vehicle_data(self, request: web.Request) -> web.Response:
+        car = self._car(request.match_info['vin'])
+        car.apply(self.clock())
+        endpoint = request.match_info['endpoint']
+        stamp = datetime.datetime.fromtimestamp(self.clock(), datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if endpoint == 'cockpit':
+            attributes = {'totalMileage': car.mileage, 'fuelQuantity': None, 'fuelAutonomy': None}
+        elif endpoint == 'charge-mode':
+            attributes = {'chargeMode': car.charge_mode}
+        elif endpoint == 'battery-status':
+            attributes = {'timestamp': stamp, 'batteryLevel': car.battery_level, 'batteryAutonomy': 3 * car.battery_level,
+                          'plugStatus': car.plug_status, 'chargingStatus': car.charging_status}
+        elif endpoint == 'location':
+            attributes = {'gpsLatitude': car.latitude, 'gpsLongitude': car.longitude, 'lastUpdateTime': stamp}
+        elif endpoint == 'hvac-status':
+            attributes = {'hvacStatus': car.hvac_status, 'externalTemperature': 12.0, 'lastUpdateTime': stamp}
+        elif endpoint == 'charges':
+            start = datetime.datetime.strptime(request.query['start'], '%Y%m%d').date()
+            end = datetime.datetime.strptime(request.query['end'], '%Y%m%d').date()
+            attributes = {'charges': car.charges(start, end)}
+        else:
+            return self._kamereon_error(501, 'err.tech.501', 'This feature is not technically supported by this gateway')
+        return web.json_response({'data': {'type': 'Car', 'id': car.vin, 'attributes': attributes}})
+
+    async def vehicle_action(self, request: web.Request) -> web.Response:
+        car = self._car(request.match_info['vin'])
+        body = await request.json()
+        action = request.match_info['action']
+        attributes = body['data']['attributes']
+        due = self.clock() + self.scenario['apply_delay']
+        if action == 'charge-mode':
+            car.pending.append((due, 'charge_mode', attributes['action']))
+        elif action == 'hvac-start':
+            car.pending.append((due, 'hvac_status', 'on' if attributes['action'] == 'start' else 'off'))
+        else:
+            return self._kamereon_error(501, 'err.tech.501', 'This feature is not technically supported by this gateway')
+        car.apply(self.clock())
+        return web.json_response({'data': {'type': body['data']['type'], 'id': uuid.uuid4().hex,
+                                           'attributes': attributes}})
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    async def post_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response(self.stats)
+
+    async def post_script(self, request: web.Request) -> web.Response:
+        self.scenario.update(await request.json())
+        return web.json_response(self.scenario)
+
+
+async def start(stand_in: StandIn, host: str = '127.0.0.1', port: int = 0) -> web.AppRunner:
+    """Start serving the stand-in, port 0 picks a free port, see bound_port."""
+    runner = web.AppRunner(stand_in.app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def bound_port(runner: web.AppRunner) -> int:
+    """Return the port a started stand-in listens on."""
+    return runner.addresses[0][1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Stand-in for the Gigya and Kamereon servers.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scenario', help='JSON file with the scenario')
+    args = parser.parse_args()
+    scenario = None
+    if args.scenario:
+        with open(args.scenario, encoding='utf-8') as scenario_file:
+            scenario = json.load(scenario_file)
+    web.run_app(StandIn(scenario).app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()